@@ -1,11 +1,46 @@
-import React, { useState } from 'react'
+import React, { useEffect, useRef, useState } from 'react'
 import './App.css';
 
+// Reads a text/event-stream response body and calls onEvent(name, data) per event
+const readEvents = async (response, onEvent) => {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      let event = 'message'
+      let data = ''
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim()
+        else if (line.startsWith('data:')) data += line.slice(5).trim()
+      }
+      if (data) onEvent(event, JSON.parse(data))
+    }
+  }
+}
+
+const progressMessages = {
+  queries: (data) => `Searching with ${data.queries.length} queries...`,
+  urls: (data) => `Found ${data.urls.length} recipe pages, reading them...`,
+  page_fetched: (data) => `Reading ${data.url}`,
+}
+
 function App() {
   const [ingredientsInput, setIngredientsInput] = useState('')
   const [recipes, setRecipes] = useState([])
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null)
+  const [progress, setProgress] = useState(null)
+  const searchRef = useRef(null)
+
+  // stop the server-side search when the user navigates away
+  useEffect(() => () => searchRef.current && searchRef.current.abort(), [])
 
   const handleSubmit = async (e) => {
     e.preventDefault()
@@ -17,22 +52,37 @@ function App() {
 
     setLoading(true)
     setError(null)
+    setRecipes([])
+    setProgress('Planning searches...')
+    const controller = new AbortController()
+    searchRef.current = controller
     try {
-      const response = await fetch('/find_recipes', {
+      const response = await fetch('/find_recipes/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ingredients, top_k: 3})
+        body: JSON.stringify({ingredients, top_k: 3}),
+        signal: controller.signal
       })
       if (!response.ok) {
         const text = await response.text()
         throw new Error(text || response.statusText)
       }
-      const data = await response.json()
-      setRecipes(data.results)
+      await readEvents(response, (event, data) => {
+        if (event === 'recipe') {
+          setRecipes((found) => [...found, data])
+        } else if (event === 'results') {
+          setRecipes(data.results)
+        } else if (event === 'error') {
+          setError(data.detail)
+        } else if (progressMessages[event]) {
+          setProgress(progressMessages[event](data))
+        }
+      })
     } catch (err) {
-      setError(err.message)
+      if (err.name !== 'AbortError') setError(err.message)
     } finally {
       setLoading(false)
+      setProgress(null)
     }
   }
 
@@ -56,8 +106,9 @@ function App() {
           </button>
         </form>
       {error && <p style={{color:"red"}}>{error}</p>}
+      {progress && <p className="progress">{progress}</p>}
       <div className="recipe-result">
-        <h2 className="title">Recipe Suggestions:</h2>
+        <h2 className="title">{loading && recipes.length ? 'Recipes Found So Far:' : 'Recipe Suggestions:'}</h2>
         <div className="recipe">
         {recipes.map((recipe, idx) => (
           <div key={idx} className="recipe-card">
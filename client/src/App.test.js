@@ -57,10 +57,20 @@ test('renders recipe cards on successful fetch', async () => {
     source_url: "http:creamymushroompasta.com"
   }
 
+  const chunks = [
+    `event: recipe\ndata: ${JSON.stringify(mockRecipe)}\n\n`,
+    `event: results\ndata: ${JSON.stringify({ results: [mockRecipe] })}\n\n`,
+  ].map((chunk) => Buffer.from(chunk))
   global.fetch = jest.fn(() =>
     Promise.resolve({
       ok: true,
-      json: () => Promise.resolve({ results: [mockRecipe] })
+      body: {
+        getReader: () => ({
+          read: () => Promise.resolve(
+            chunks.length ? { done: false, value: chunks.shift() } : { done: true }
+          )
+        })
+      }
     })
   )
 
@@ -89,3 +99,28 @@ test("display server error on failed fetch", async () => {
 
   expect(await screen.findByText(/Server error occured/i)).toBeInTheDocument
 })
+
+test('shows the error event sent by the stream', async () => {
+  const chunks = [
+    Buffer.from(`event: error\ndata: ${JSON.stringify({ status_code: 404, detail: 'No recipes extracted' })}\n\n`)
+  ]
+  global.fetch = jest.fn(() =>
+    Promise.resolve({
+      ok: true,
+      body: {
+        getReader: () => ({
+          read: () => Promise.resolve(
+            chunks.length ? { done: false, value: chunks.shift() } : { done: true }
+          )
+        })
+      }
+    })
+  )
+
+  render(<App />)
+  const input = screen.getByPlaceholderText(/Enter recipe requirements, e\.g\. tofu, broccoli, vegetarian/i)
+  fireEvent.change(input, { target: { value: 'tofu' }})
+  fireEvent.click(screen.getByRole('button', {name: /Find Recipes/i}))
+
+  expect(await screen.findByText(/No recipes extracted/i)).toBeInTheDocument()
+})
@@ -3,3 +3,7 @@
 // expect(element).toHaveTextContent(/react/i)
 // learn more: https://github.com/testing-library/jest-dom
 import '@testing-library/jest-dom';
+
+// jsdom does not expose TextDecoder, App uses it to read the event stream
+import { TextDecoder } from 'util';
+global.TextDecoder = global.TextDecoder || TextDecoder;
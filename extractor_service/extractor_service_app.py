@@ -1,9 +1,12 @@
 import json
 import os
-from typing import List
+import time
+from typing import List, Optional
 
 import openai
-from fastapi import FastAPI, HTTPException
+from blob_store import blob_store_from_env
+from codec import CodecRoute, NegotiatedResponse
+from fastapi import FastAPI, Header, HTTPException, Response
 from openai import OpenAIError
 from pydantic import BaseModel
 
@@ -11,10 +14,18 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 if not openai.api_key:
     raise RuntimeError("Missing OpenAI key")
 
+# OpenAI timeout when the caller sends no X-Request-Timeout budget
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+
+
+# pages passed by reference are read from the store the html fetcher writes to
+blob_store = blob_store_from_env()
+
 
 class ExtractRequest(BaseModel):
     url: str
-    html: str
+    html: Optional[str] = None
+    html_ref: Optional[str] = None
 
 
 class ExtractResponse(BaseModel):
@@ -47,11 +58,52 @@ recipe_schema = {
     "additionalProperties": False,
 }
 
-app = FastAPI(title="Recipe Extractor Service")
+app = FastAPI(
+    title="Recipe Extractor Service", default_response_class=NegotiatedResponse
+)
+# msgpack and compressed bodies besides plain JSON
+app.router.route_class = CodecRoute
+
+
+def time_budget(x_request_timeout: Optional[str], default: float) -> float:
+    """Seconds left of the caller's X-Request-Timeout budget, capped at default."""
+    if x_request_timeout is None:
+        return default
+    try:
+        budget = float(x_request_timeout)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail=f"invalid X-Request-Timeout {x_request_timeout}"
+        )
+    if budget <= 0:
+        raise HTTPException(status_code=504, detail="request deadline exceeded")
+    return min(budget, default)
+
+
+def cut_by_budget(err: Exception, timeout: float, default: float) -> bool:
+    """Whether ``err`` is the timeout of a call that the caller's budget gave less
+    than its ``default`` timeout, answered with 504 instead of 502."""
+    return isinstance(err, openai.APITimeoutError) and timeout < default
 
 
 @app.post("/extract_recipe", response_model=ExtractResponse)
-def extract_recipe(req: ExtractRequest):
+def extract_recipe(
+    req: ExtractRequest,
+    http_response: Response,
+    x_request_timeout: Optional[str] = Header(default=None),
+):
+    html = req.html
+    if html is None:
+        if not req.html_ref:
+            raise HTTPException(status_code=422, detail="html or html_ref required")
+        html = blob_store.get(req.html_ref)
+        if html is None:
+            raise HTTPException(
+                status_code=404, detail=f"Unknown html_ref {req.html_ref}"
+            )
+
+    timeout = time_budget(x_request_timeout, OPENAI_TIMEOUT)
+    started = time.perf_counter()
     try:
         response = openai.responses.create(
             model="gpt-4.1-mini",
@@ -60,7 +112,7 @@ def extract_recipe(req: ExtractRequest):
                 "Parse the provided HTML and RETURN ONLY a JSON object "
                 "that matches exactly the schema."
             ),
-            input=req.html,
+            input=html,
             text={
                 "format": {
                     "type": "json_schema",
@@ -70,9 +122,14 @@ def extract_recipe(req: ExtractRequest):
                 }
             },
             stream=False,
+            timeout=timeout,
         )
     except OpenAIError as e:
+        if cut_by_budget(e, timeout, OPENAI_TIMEOUT):
+            raise HTTPException(status_code=504, detail=f"OpenAI API timed out: {e}")
         raise HTTPException(status_code=502, detail=f"OpenAI API error: {e}")
+    openai_ms = (time.perf_counter() - started) * 1000
+    http_response.headers["Server-Timing"] = f"openai;dur={openai_ms:.1f}"
 
     json_string = getattr(response, "output_text", None)
     if not json_string:
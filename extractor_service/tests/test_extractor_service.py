@@ -6,6 +6,7 @@ from fastapi.testclient import TestClient
 
 os.environ["OPENAI_API_KEY"] = "sk-test"
 
+import extractor_service_app
 from extractor_service_app import app
 
 mock_recipe = {
@@ -63,3 +64,44 @@ def test_extract_recipe_pass():
 
     data = recipe_response.json()
     assert data == mock_recipe
+
+
+def test_extract_recipe_reads_html_by_reference(monkeypatch):
+    import openai
+
+    inputs = []
+
+    def fake_create(*args, **kwargs):
+        inputs.append(kwargs["input"])
+        return MockResponse(json.dumps(mock_recipe))
+
+    monkeypatch.setattr(openai.responses, "create", fake_create)
+    html = "<html><body>stored page</body></html>"
+    html_ref = extractor_service_app.blob_store.put(html)
+
+    payload = {"url": "http:creamymushroompasta.com", "html_ref": html_ref}
+    recipe_response = client.post("/extract_recipe", json=payload)
+    assert recipe_response.status_code == 200, recipe_response.text
+    assert inputs == [html]
+
+    payload["html_ref"] = "0" * 64
+    assert client.post("/extract_recipe", json=payload).status_code == 404
+
+
+def test_extract_recipe_answers_504_when_the_budget_cut_the_timeout(monkeypatch):
+    import httpx
+    import openai
+
+    def time_out(*args, **kwargs):
+        raise openai.APITimeoutError(request=httpx.Request("POST", "https://openai"))
+
+    monkeypatch.setattr(openai.responses, "create", time_out)
+    payload = {"url": "http:slow.com", "html": "<html></html>"}
+
+    res = client.post(
+        "/extract_recipe", json=payload, headers={"X-Request-Timeout": "3"}
+    )
+    assert res.status_code == 504
+    # the service's own timeout ran out
+    res = client.post("/extract_recipe", json=payload)
+    assert res.status_code == 502
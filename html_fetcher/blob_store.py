@@ -0,0 +1,152 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# keys are the sha256 hex digest of the stored text
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def blob_key(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def valid_key(key: str) -> bool:
+    return bool(_KEY_PATTERN.match(key))
+
+
+class BlobStore:
+    """Content-addressed store for page HTML shared by fetcher and extractor."""
+
+    def put(self, data: str) -> str:
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+
+class MemoryBlobStore(BlobStore):
+    """In-process store, least recently used blobs are dropped past max_bytes."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._blobs: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, data: str) -> str:
+        key = blob_key(data)
+        with self._lock:
+            if key in self._blobs:
+                self._blobs.move_to_end(key)
+                return key
+            self._blobs[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._blobs) > 1:
+                _, dropped = self._blobs.popitem(last=False)
+                self.size -= len(dropped)
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            data = self._blobs.get(key)
+            if data is not None:
+                self._blobs.move_to_end(key)
+            return data
+
+
+class DiskBlobStore(BlobStore):
+    """Store on a local (or shared volume) directory, one file per blob.
+
+    Blobs not written for ``max_age`` seconds (0 keeps them forever) are
+    deleted by a sweep that ``put`` runs at most every ``sweep_interval``
+    seconds; writing a blob again makes it new.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_age: float = 0,
+        sweep_interval: float = 60,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.root = root
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self._last_sweep = clock()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def sweep(self) -> int:
+        """Delete the blobs older than max_age, returns how many."""
+        cutoff = self.clock() - self.max_age
+        removed = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    # deleted by another worker's sweep
+                    continue
+        return removed
+
+    def _maybe_sweep(self) -> None:
+        if not self.max_age:
+            return
+        with self._lock:
+            if self.clock() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = self.clock()
+        self.sweep()
+
+    def put(self, data: str) -> str:
+        self._maybe_sweep()
+        key = blob_key(data)
+        path = self._path(key)
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+                return key
+            except FileNotFoundError:
+                pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file first so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        if not valid_key(key):
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as blob:
+                return blob.read()
+        except FileNotFoundError:
+            return None
+
+
+def blob_store_from_env() -> BlobStore:
+    """BLOB_STORE is "disk" (at BLOB_STORE_PATH, blobs deleted after
+    BLOB_STORE_MAX_AGE_SECS) or "memory"."""
+    kind = os.getenv("BLOB_STORE", "disk")
+    if kind == "memory":
+        return MemoryBlobStore()
+    if kind == "disk":
+        return DiskBlobStore(
+            os.getenv("BLOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "blobs")),
+            max_age=float(os.getenv("BLOB_STORE_MAX_AGE_SECS", "3600")),
+        )
+    raise RuntimeError(f"Unknown BLOB_STORE {kind}")
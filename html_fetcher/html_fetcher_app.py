@@ -1,41 +1,109 @@
-from typing import List
+import os
+import time
+from typing import List, Optional
 
 import requests
+from blob_store import blob_store_from_env
 from bs4 import BeautifulSoup
-from fastapi import FastAPI, HTTPException
+from codec import CodecRoute, NegotiatedResponse
+from fastapi import FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
 
-app = FastAPI(title="HTML Fetcher Service")
+# per-URL timeout, shortened to the caller's X-Request-Timeout budget
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "5"))
+
+# answer for a page its site would not serve (error status, DNS failure, read
+# timeout): a 4xx, so the caller's breaker does not blame the fetcher for it
+SITE_FAILURE_STATUS = 424
+
+# cleaned pages requested by reference are written here for the extractor
+blob_store = blob_store_from_env()
+
+app = FastAPI(title="HTML Fetcher Service", default_response_class=NegotiatedResponse)
+# msgpack and compressed bodies besides plain JSON
+app.router.route_class = CodecRoute
+
+
+def time_budget(x_request_timeout: Optional[str], default: float) -> float:
+    """Seconds left of the caller's X-Request-Timeout budget, capped at default."""
+    if x_request_timeout is None:
+        return default
+    try:
+        budget = float(x_request_timeout)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail=f"invalid X-Request-Timeout {x_request_timeout}"
+        )
+    if budget <= 0:
+        raise HTTPException(status_code=504, detail="request deadline exceeded")
+    return min(budget, default)
+
+
+def cut_by_budget(err: Exception, timeout: float, default: float) -> bool:
+    """Whether ``err`` is the timeout of a fetch that the caller's budget gave less
+    than its ``default`` timeout, answered with 504 instead of a site failure."""
+    return isinstance(err, requests.Timeout) and timeout < default
 
 
 class FetchRequest(BaseModel):
     urls: List[str]
+    by_reference: bool = False
 
 
 class FetchResult(BaseModel):
     url: str
-    html: str
+    html: Optional[str] = None
+    html_ref: Optional[str] = None
 
 
 class FetchResponse(BaseModel):
     results: List[FetchResult]
 
 
-@app.post("/fetch_html", response_model=FetchResponse)
-def fetch_html(req: FetchRequest):
+@app.post("/fetch_html", response_model=FetchResponse, response_model_exclude_none=True)
+def fetch_html(
+    req: FetchRequest,
+    http_response: Response,
+    x_request_timeout: Optional[str] = Header(default=None),
+):
     results: List[FetchResult] = []
+    deadline = time.monotonic() + time_budget(x_request_timeout, float("inf"))
+    download_ms = 0.0
+    clean_ms = 0.0
     for url in req.urls:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HTTPException(
+                status_code=504, detail=f"Deadline exceeded before fetching {url}"
+            )
+        timeout = min(FETCH_TIMEOUT, remaining)
+        started = time.perf_counter()
         try:
-            response = requests.get(url, timeout=5)
+            response = requests.get(url, timeout=timeout)
             response.raise_for_status()
         except Exception as e:
-            raise HTTPException(status_code=502, detail=f"Error fetching {url}: {e}")
+            if cut_by_budget(e, timeout, FETCH_TIMEOUT):
+                raise HTTPException(
+                    status_code=504, detail=f"Deadline exceeded fetching {url}: {e}"
+                )
+            raise HTTPException(
+                status_code=SITE_FAILURE_STATUS, detail=f"Error fetching {url}: {e}"
+            )
+        downloaded = time.perf_counter()
+        download_ms += (downloaded - started) * 1000
 
         soup = BeautifulSoup(response.text, "html.parser")
         for tag in soup(["script", "style"]):
             tag.decompose()
 
         cleaned_html = str(soup)
-        results.append(FetchResult(url=url, html=cleaned_html))
+        clean_ms += (time.perf_counter() - downloaded) * 1000
+        if req.by_reference:
+            results.append(FetchResult(url=url, html_ref=blob_store.put(cleaned_html)))
+        else:
+            results.append(FetchResult(url=url, html=cleaned_html))
 
+    http_response.headers["Server-Timing"] = (
+        f"download;dur={download_ms:.1f}, clean;dur={clean_ms:.1f}"
+    )
     return FetchResponse(results=results)
@@ -1,6 +1,9 @@
 import os
 
+import html_fetcher_app
 import pytest
+from blob_store import DiskBlobStore
+from codec import decode_body, encode_body
 from fastapi.testclient import TestClient
 from html_fetcher_app import app
 
@@ -53,3 +56,110 @@ def test_fetch_html_strips_scripts_and_styles():
 
     assert "<script" not in html
     assert "<style" not in html
+
+
+def test_fetch_html_honors_request_timeout_header(monkeypatch):
+    import requests
+
+    timeouts = []
+
+    def fake_get(url, timeout):
+        timeouts.append(timeout)
+        return MockResponse(mock_HTML)
+
+    monkeypatch.setattr(requests, "get", fake_get)
+
+    payload = {"urls": ["http://example.com"]}
+    res = client.post("/fetch_html", json=payload, headers={"X-Request-Timeout": "2"})
+    assert res.status_code == 200, res.text
+    assert 0 < timeouts[0] <= 2
+
+    res = client.post("/fetch_html", json=payload, headers={"X-Request-Timeout": "0"})
+    assert res.status_code == 504
+
+
+def test_fetch_html_reports_site_failures_as_424(monkeypatch):
+    import requests
+
+    def fail(url, timeout):
+        raise requests.ConnectionError("Name or service not known")
+
+    monkeypatch.setattr(requests, "get", fail)
+
+    res = client.post("/fetch_html", json={"urls": ["http://paywalled.com"]})
+    assert res.status_code == 424
+    assert "paywalled.com" in res.json()["detail"]
+
+
+def test_fetch_html_answers_504_when_the_budget_cut_the_timeout(monkeypatch):
+    import requests
+
+    def time_out(url, timeout):
+        raise requests.ReadTimeout(f"read timeout={timeout}")
+
+    monkeypatch.setattr(requests, "get", time_out)
+    payload = {"urls": ["http://slow.com"]}
+
+    res = client.post("/fetch_html", json=payload, headers={"X-Request-Timeout": "2"})
+    assert res.status_code == 504
+    # the site was slower than FETCH_TIMEOUT
+    res = client.post("/fetch_html", json=payload)
+    assert res.status_code == 424
+
+
+def test_fetch_html_by_reference_stores_page_in_blob_store():
+    payload = {"urls": ["http://example.com"], "by_reference": True}
+    res = client.post("/fetch_html", json=payload)
+    assert res.status_code == 200, res.text
+
+    result = res.json()["results"][0]
+    assert "html" not in result
+    html = html_fetcher_app.blob_store.get(result["html_ref"])
+    assert "<h1>Header</h1>" in html
+    assert "<script" not in html
+
+
+def test_disk_blob_store_deletes_old_blobs(tmp_path):
+    now = [1000.0]
+    store = DiskBlobStore(
+        str(tmp_path), max_age=100, sweep_interval=10, clock=lambda: now[0]
+    )
+    old_key = store.put("<html>old</html>")
+    os.utime(store._path(old_key), (800, 800))
+    kept_key = store.put("<html>kept</html>")
+    os.utime(store._path(kept_key), (950, 950))
+
+    now[0] = 1020
+    store.put("<html>new</html>")
+    assert store.get(old_key) is None
+    assert store.get(kept_key) == "<html>kept</html>"
+
+
+def test_fetch_html_negotiates_msgpack_and_compression(monkeypatch):
+    import requests
+
+    big_html = "<html><body>" + "<p>Stir the risotto.</p>" * 200 + "</body></html>"
+    monkeypatch.setattr(requests, "get", lambda url, timeout: MockResponse(big_html))
+
+    content, headers = encode_body(
+        {"urls": ["http://example.com"]}, "application/msgpack", "gzip"
+    )
+    res = client.post(
+        "/fetch_html",
+        content=content,
+        headers={
+            **headers,
+            "Accept": "application/msgpack",
+            "Accept-Encoding": "zstd, gzip;q=0.5",
+        },
+    )
+    assert res.status_code == 200, res.text
+    assert res.headers["content-type"] == "application/msgpack"
+    assert res.headers["content-encoding"] == "zstd"
+    # the test client hands back the body as sent
+    data = decode_body(res.content, "application/msgpack", "zstd")
+    result = data["results"][0]
+    assert result["html"].count("Stir the risotto.") == 200
+
+    res = client.post("/fetch_html", json={"urls": ["http://example.com"]})
+    assert res.headers["content-type"] == "application/json"
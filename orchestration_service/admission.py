@@ -0,0 +1,234 @@
+import asyncio
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+# client id of callers with neither a client id nor an address, one client like
+# any other
+ANONYMOUS = "anonymous"
+
+
+class Overloaded(Exception):
+    """Raised when a request can neither run nor wait for a slot."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency with a weighted fair wait queue.
+
+    At most ``max_active`` callers hold a slot, at most
+    ``class_max_active[priority]`` of them of one priority class and at most
+    ``client_max_active`` (0 for no quota) of one client. Callers that cannot
+    run wait, up to ``max_queued`` per class and ``client_max_queued`` per
+    client, for at most ``queue_timeouts[priority]`` seconds (else
+    ``queue_timeout``); anyone beyond that is rejected at once with
+    ``Overloaded``.
+
+    A released slot goes to the class with the smallest virtual finish time,
+    so the classes share slots in proportion to ``weights``, and within the
+    class to the clients in turn, so one busy client cannot starve the others.
+    ``max_active`` of 0 admits everything.
+    """
+
+    def __init__(
+        self,
+        max_active: int,
+        max_queued: int,
+        queue_timeout: float,
+        client_max_active: int = 0,
+        client_max_queued: Optional[int] = None,
+        weights: Optional[Dict[str, float]] = None,
+        class_max_active: Optional[Dict[str, int]] = None,
+        queue_timeouts: Optional[Dict[str, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.client_max_active = client_max_active
+        self.client_max_queued = client_max_queued or max_queued
+        self.weights = {INTERACTIVE: 1.0, BACKGROUND: 1.0, **(weights or {})}
+        self.class_max_active = class_max_active or {}
+        self.queue_timeouts = queue_timeouts or {}
+        self.clock = clock
+        self.active = 0
+        self.active_by_class: Counter = Counter()
+        self.active_by_client: Counter = Counter()
+        # waiters per class, per client in round robin order
+        self.queues: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self.queued_by_class: Counter = Counter()
+        self.queued_by_client: Counter = Counter()
+        self.passes: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self.virtual_time = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        # moving average of how long a slot is held, for Retry-After
+        self.avg_hold_secs: Optional[float] = None
+
+    def queued(self) -> int:
+        return sum(self.queued_by_class.values())
+
+    def retry_after(self, priority: str = INTERACTIVE) -> int:
+        """Seconds until the queue ahead of a new caller has likely drained."""
+        if not self.avg_hold_secs or not self.max_active:
+            return 1
+        slots = self.class_max_active.get(priority) or self.max_active
+        rounds = (self.queued_by_class[priority] + 1) / slots
+        return max(math.ceil(self.avg_hold_secs * rounds), 1)
+
+    def _can_run(self, client: str, priority: str) -> bool:
+        class_limit = self.class_max_active.get(priority)
+        return (
+            self.active < self.max_active
+            and (not class_limit or self.active_by_class[priority] < class_limit)
+            and (
+                not self.client_max_active
+                or self.active_by_client[client] < self.client_max_active
+            )
+        )
+
+    def _start(self, client: str, priority: str) -> None:
+        self.active += 1
+        self.active_by_class[priority] += 1
+        self.active_by_client[client] += 1
+        self.admitted += 1
+
+    def _next_waiter(self) -> Optional[Tuple[str, str]]:
+        """(priority, client) of the waiter that gets the next free slot."""
+        best = None
+        for priority, clients in self.queues.items():
+            client = next(
+                (client for client in clients if self._can_run(client, priority)),
+                None,
+            )
+            if client is None:
+                continue
+            finish = self.passes[priority] + 1 / self.weights[priority]
+            if best is None or finish < best[0]:
+                best = (finish, priority, client)
+        return best and best[1:]
+
+    def _dispatch(self) -> None:
+        while True:
+            chosen = self._next_waiter()
+            if chosen is None:
+                return
+            priority, client = chosen
+            clients = self.queues[priority]
+            waiter = clients[client].popleft()
+            if clients[client]:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            self.queued_by_class[priority] -= 1
+            self.queued_by_client[client] -= 1
+            if waiter.done():
+                continue
+            self.passes[priority] += 1 / self.weights[priority]
+            self.virtual_time = self.passes[priority]
+            self._start(client, priority)
+            waiter.set_result(None)
+
+    async def acquire(
+        self, client: str = ANONYMOUS, priority: str = INTERACTIVE
+    ) -> None:
+        if not self.max_active:
+            return
+        if self._can_run(client, priority) and self._next_waiter() is None:
+            self._start(client, priority)
+            return
+        if (
+            self.queued_by_class[priority] >= self.max_queued
+            or self.queued_by_client[client] >= self.client_max_queued
+        ):
+            self.rejected += 1
+            raise Overloaded("Server busy, queue is full", self.retry_after(priority))
+        waiter = asyncio.get_running_loop().create_future()
+        clients = self.queues[priority]
+        if not clients:
+            # an idle class does not bank credit while others were served
+            self.passes[priority] = max(self.passes[priority], self.virtual_time)
+        clients.setdefault(client, deque()).append(waiter)
+        self.queued_by_class[priority] += 1
+        self.queued_by_client[client] += 1
+        timeout = self.queue_timeouts.get(priority, self.queue_timeout)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._forget(waiter, client, priority)
+            self.rejected += 1
+            raise Overloaded(
+                "Server busy, timed out in queue", self.retry_after(priority)
+            )
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the cancellation
+                self.release(client, priority)
+            else:
+                self._forget(waiter, client, priority)
+            raise
+
+    def release(self, client: str = ANONYMOUS, priority: str = INTERACTIVE) -> None:
+        if not self.max_active:
+            return
+        self.active -= 1
+        self.active_by_class[priority] -= 1
+        self.active_by_client[client] -= 1
+        if not self.active_by_client[client]:
+            del self.active_by_client[client]
+        self._dispatch()
+
+    def _forget(self, waiter: asyncio.Future, client: str, priority: str) -> None:
+        clients = self.queues[priority]
+        waiting = clients.get(client)
+        if waiting is None or waiter not in waiting:
+            return
+        waiting.remove(waiter)
+        if not waiting:
+            del clients[client]
+        self.queued_by_class[priority] -= 1
+        self.queued_by_client[client] -= 1
+
+    @asynccontextmanager
+    async def slot(
+        self, client: str = ANONYMOUS, priority: str = INTERACTIVE
+    ) -> AsyncIterator[None]:
+        await self.acquire(client, priority)
+        started = self.clock()
+        try:
+            yield
+        finally:
+            held = self.clock() - started
+            if self.avg_hold_secs is None:
+                self.avg_hold_secs = held
+            else:
+                self.avg_hold_secs = 0.8 * self.avg_hold_secs + 0.2 * held
+            self.release(client, priority)
+
+    def snapshot(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queued(),
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "classes": {
+                priority: {
+                    "active": self.active_by_class[priority],
+                    "queued": self.queued_by_class[priority],
+                }
+                for priority in PRIORITIES
+            },
+            "clients_active": len(self.active_by_client),
+        }
@@ -0,0 +1,128 @@
+import time
+from typing import Callable, Optional
+
+import httpx
+
+# request extension set on calls whose timeout the caller's deadline cut below
+# the call's own cap, their timeouts do not count against the service
+DEADLINE_CUT = "deadline_cut"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one downstream service.
+
+    After ``failure_threshold`` failures in a row the breaker opens and calls
+    fail fast. After ``reset_timeout`` seconds it lets ``half_open_calls``
+    probe calls through: a success closes it again, a failure reopens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        half_open_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self.probes = 0
+        if self.state == HALF_OPEN:
+            if self.probes >= self.half_open_calls:
+                return False
+            self.probes += 1
+        return True
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+
+    def release(self) -> None:
+        """Give back the probe slot of a call that ended without showing whether
+        the service is healthy, like one cancelled by its caller."""
+        if self.state == HALF_OPEN and self.probes > 0:
+            self.probes -= 1
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = self.clock()
+
+    def retry_after(self) -> int:
+        """Seconds until the breaker lets a probe through."""
+        if self.state != OPEN:
+            return 0
+        return max(int(self.opened_at + self.reset_timeout - self.clock()) + 1, 1)
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of sending a request while the breaker is open."""
+
+    def __init__(
+        self, breaker: CircuitBreaker, request: Optional[httpx.Request] = None
+    ):
+        super().__init__(f"{breaker.name} circuit is open", request=request)
+        self.breaker = breaker
+
+
+class BreakerTransport(httpx.AsyncBaseTransport):
+    """Transport that routes every request of a client through its breaker.
+
+    Connection errors, timeouts and 5xx responses count as failures, cancelled
+    calls count as neither failure nor success, and so do timeouts and 504s of
+    calls marked ``DEADLINE_CUT``.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker):
+        self.transport = transport
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.breaker, request)
+        cut = request.extensions.get(DEADLINE_CUT, False)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TimeoutException:
+            if cut:
+                self.breaker.release()
+            else:
+                self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        if response.status_code == 504 and cut:
+            self.breaker.release()
+        elif response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,282 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+# ingredient words excluded by "<group>-free" and by the diets below
+INGREDIENT_GROUPS: Dict[str, FrozenSet[str]] = {
+    "dairy": frozenset(
+        [
+            "milk",
+            "cream",
+            "butter",
+            "buttermilk",
+            "cheese",
+            "parmesan",
+            "mozzarella",
+            "cheddar",
+            "ricotta",
+            "feta",
+            "yogurt",
+            "yoghurt",
+            "ghee",
+            "creme fraiche",
+            "sour cream",
+            "whey",
+        ]
+    ),
+    "gluten": frozenset(
+        [
+            "flour",
+            "wheat",
+            "bread",
+            "breadcrumbs",
+            "pasta",
+            "spaghetti",
+            "noodles",
+            "couscous",
+            "barley",
+            "rye",
+            "semolina",
+            "tortilla",
+        ]
+    ),
+    "egg": frozenset(["egg", "eggs", "mayonnaise"]),
+    "nut": frozenset(
+        [
+            "almond",
+            "walnut",
+            "pecan",
+            "cashew",
+            "hazelnut",
+            "pistachio",
+            "peanut",
+            "pine nut",
+        ]
+    ),
+    "meat": frozenset(
+        [
+            "beef",
+            "pork",
+            "chicken",
+            "lamb",
+            "bacon",
+            "ham",
+            "sausage",
+            "turkey",
+            "veal",
+            "prosciutto",
+            "chorizo",
+            "pancetta",
+            "mince",
+        ]
+    ),
+    "fish": frozenset(
+        [
+            "fish",
+            "salmon",
+            "tuna",
+            "cod",
+            "anchovy",
+            "shrimp",
+            "prawn",
+            "crab",
+            "lobster",
+            "mussel",
+            "clam",
+            "fish sauce",
+        ]
+    ),
+    "sugar": frozenset(["sugar", "honey", "syrup"]),
+}
+
+# dietary keywords, by the tag they stand for
+DIET_KEYWORDS: Dict[str, List[str]] = {
+    "vegetarian": ["vegetarian", "veggie", "meatless", "meat-free", "meat free"],
+    "vegan": ["vegan", "plant-based", "plant based"],
+    "pescatarian": ["pescatarian", "pescetarian"],
+    "gluten-free": ["gluten-free", "gluten free", "gf", "celiac", "coeliac"],
+    "dairy-free": ["dairy-free", "dairy free", "lactose-free", "lactose free"],
+    "nut-free": ["nut-free", "nut free"],
+    "egg-free": ["egg-free", "egg free"],
+    "high-protein": ["high-protein", "high protein", "protein-rich", "protein rich"],
+    "low-carb": ["low-carb", "low carb", "keto", "ketogenic"],
+    "low-fat": ["low-fat", "low fat"],
+    "low-sodium": ["low-sodium", "low sodium", "low salt"],
+    "paleo": ["paleo"],
+    "sugar-free": ["sugar-free", "sugar free", "no sugar"],
+}
+
+# ingredient groups each checkable diet excludes
+DIETS: Dict[str, List[str]] = {
+    "vegetarian": ["meat", "fish"],
+    "pescatarian": ["meat"],
+    "vegan": ["meat", "fish", "dairy", "egg"],
+}
+
+_KEYWORDS = sorted(
+    ((keyword, tag) for tag, keywords in DIET_KEYWORDS.items() for keyword in keywords),
+    key=lambda pair: -len(pair[0]),
+)
+_FREE = re.compile(r"\b([a-z]+)[- ]free\b")
+_WITHOUT = re.compile(
+    r"\b(?:without|no|skip(?: the)?|hold the)\s+([a-z ]+?)(?=$|[,.;!]|\band\b|\bor\b)"
+)
+_UNIT = r"(min(?:ute)?s?|h(?:ou)?rs?)"
+_MINUTES = [
+    re.compile(
+        r"\b(?:under|(?:less|no more|not more) than|below|within|at most|max(?:imum)?"
+        rf"|in)\s+(\d+(?:\.\d+)?)\s*{_UNIT}\b"
+    ),
+    re.compile(rf"\b(\d+(?:\.\d+)?)[- ]?{_UNIT}\s+(?:or less|max(?:imum)?|tops)\b"),
+]
+# "no more than 30 minutes" is a time limit, not an ingredient
+_NOT_INGREDIENTS = ("more", "longer", "later", "than")
+# ingredient lines naming a stand-in, like "gluten-free pasta" or "vegan butter"
+_SUBSTITUTE = re.compile(r"\b(?:[a-z]+-free|vegan|plant-based|non-dairy|substitute)\b")
+# plant milks and nut butters are not dairy: "almond milk" is read as "almond"
+_PLANT_DAIRY = re.compile(
+    r"\b(coconut|almond|oat|soy|soya|rice|cashew|hazelnut|macadamia|hemp|peanut"
+    r"|nut|seed|sunflower|sesame|cocoa|apple)\s+(?:milk|cream|butter|yogh?urt)s?\b"
+)
+# nor are these, whatever their names say
+_NOT_DAIRY = re.compile(r"\b(?:butter beans?|cream of tartar)\b")
+
+
+def singular(word: str) -> str:
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes") or word.endswith("shes") or word.endswith("ches"):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+@dataclass
+class Constraints:
+    """Cheap local recipe filters: excluded ingredients, diets, cook time."""
+
+    excluded: FrozenSet[str] = frozenset()
+    diets: FrozenSet[str] = frozenset()
+    max_cook_mins: Optional[int] = None
+    _patterns: List[re.Pattern] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        terms = set(self.excluded)
+        for diet in self.diets:
+            for group in DIETS.get(diet, []):
+                terms |= INGREDIENT_GROUPS[group]
+        self._patterns = [
+            re.compile(rf"\b{re.escape(singular(term))}(?:e?s)?\b")
+            for term in sorted(terms)
+        ]
+
+    def __bool__(self) -> bool:
+        return bool(self.excluded or self.diets or self.max_cook_mins is not None)
+
+    def merge(self, other: "Constraints") -> "Constraints":
+        cook_times = [
+            mins for mins in (self.max_cook_mins, other.max_cook_mins) if mins
+        ]
+        return Constraints(
+            excluded=self.excluded | other.excluded,
+            diets=self.diets | other.diets,
+            max_cook_mins=min(cook_times) if cook_times else None,
+        )
+
+    def allows(self, recipe: dict) -> bool:
+        if self.max_cook_mins is not None:
+            if recipe.get("cook_time_mins", 0) > self.max_cook_mins:
+                return False
+        ingredients = " | ".join(
+            line
+            for line in map(str.lower, recipe.get("ingredients", []))
+            if not _SUBSTITUTE.search(line)
+        )
+        ingredients = _NOT_DAIRY.sub(" ", _PLANT_DAIRY.sub(r"\1", ingredients))
+        return not any(pattern.search(ingredients) for pattern in self._patterns)
+
+    def filter(self, recipes: Iterable[dict]) -> List[dict]:
+        return [recipe for recipe in recipes if self.allows(recipe)]
+
+
+def take_phrases(text: str, phrases, found: List[str]) -> str:
+    """Blank out the (keyword, value) ``phrases`` in ``text`` and add their
+    values to ``found`` in the order they appear."""
+    matches = []
+    for keyword, value in phrases:
+        pattern = rf"(?<![\w-]){re.escape(keyword)}(?![\w-])"
+        for match in re.finditer(pattern, text):
+            matches.append((match.start(), value))
+        text = re.sub(pattern, lambda match: " " * len(match.group()), text)
+    for _, value in sorted(matches):
+        if value not in found:
+            found.append(value)
+    return text
+
+
+def take_requirements(text: str) -> Tuple[str, dict]:
+    """The requirements stated in the lower-case ``text``, and ``text`` with
+    them blanked out.
+
+    Understands the diets of ``DIET_KEYWORDS``, "<ingredient>-free", "without
+    / no <ingredient>" and cook time limits like "under 30 minutes" or
+    "within 1 hour". The requirements are a dict like the query planner
+    returns, without its required ingredients.
+    """
+    diets: List[str] = []
+    text = take_phrases(text, _KEYWORDS, diets)
+    max_cook_mins = None
+    for pattern in _MINUTES:
+        for amount, unit in pattern.findall(text):
+            minutes = int(float(amount) * (60 if unit.startswith("h") else 1))
+            max_cook_mins = min(minutes, max_cook_mins or minutes)
+        text = pattern.sub(" ", text)
+    phrases = sorted(
+        (match.start(), match.group(1).strip())
+        for pattern in (_WITHOUT, _FREE)
+        for match in pattern.finditer(text)
+    )
+    excluded: List[str] = []
+    for _, phrase in phrases:
+        if phrase and not phrase.startswith(_NOT_INGREDIENTS):
+            if phrase not in excluded:
+                excluded.append(phrase)
+    text = _FREE.sub(" ", _WITHOUT.sub(" ", text))
+    requirements = {
+        "excluded_ingredients": excluded,
+        "diets": diets,
+        "max_cook_mins": max_cook_mins,
+    }
+    return text, requirements
+
+
+def parse_constraints(text: str) -> Constraints:
+    """Constraints stated in a free text refinement (see ``take_requirements``),
+    where "<group>-free" and "no <group>" exclude a whole ingredient group."""
+    return from_requirements(take_requirements(" ".join(text.lower().split()))[1])
+
+
+def from_requirements(requirements: dict) -> Constraints:
+    """Constraints of the structured requirements the query planner returns.
+
+    Excluded ingredients that name a group in ``INGREDIENT_GROUPS`` and
+    "<group>-free" diet tags exclude the whole group; other diet tags (like
+    "high-protein") cannot be checked locally and are ignored.
+    """
+    excluded = set()
+    diets = set()
+    for phrase in requirements.get("excluded_ingredients") or []:
+        phrase = singular(phrase.lower().strip())
+        excluded |= INGREDIENT_GROUPS.get(phrase, {phrase})
+    for tag in requirements.get("diets") or []:
+        tag = tag.lower().strip()
+        if tag in DIETS:
+            diets.add(tag)
+        elif tag.endswith("-free") and tag[:-5] in INGREDIENT_GROUPS:
+            excluded |= INGREDIENT_GROUPS[tag[:-5]]
+    return Constraints(
+        excluded=frozenset(excluded),
+        diets=frozenset(diets),
+        max_cook_mins=requirements.get("max_cook_mins"),
+    )
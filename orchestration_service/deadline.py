@@ -0,0 +1,38 @@
+import time
+from typing import Callable, Dict
+
+from fastapi import HTTPException
+
+# header carrying the caller's remaining time budget in seconds
+DEADLINE_HEADER = "X-Request-Timeout"
+
+
+class Deadline:
+    """Overall time budget of one request, shared by all downstream calls."""
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - self.clock(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Timeout of a single call, never past the deadline."""
+        return min(cap, self.remaining())
+
+    def cuts_short(self, cap: float) -> bool:
+        """Whether a call capped at ``cap`` gets less time than that."""
+        return self.remaining() < cap
+
+    def headers(self) -> Dict[str, str]:
+        return {DEADLINE_HEADER: f"{self.remaining():.3f}"}
+
+    def check(self, stage: str) -> None:
+        if self.expired():
+            raise HTTPException(
+                status_code=504, detail=f"Deadline exceeded before {stage}"
+            )
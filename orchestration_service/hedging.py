@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Hedger:
+    """Sends a backup call when the first one is slower than usual.
+
+    The hedge delay is the ``quantile`` of the recently observed call
+    latencies (no hedging until ``min_samples`` have been seen). Every call
+    earns ``budget_ratio`` hedge tokens and a hedge spends one, so at most that
+    fraction of calls is duplicated. Calls go round robin over ``replicas``
+    and a hedge goes to the replica after the first call's.
+    """
+
+    def __init__(
+        self,
+        replicas: int = 1,
+        quantile: float = 0.9,
+        budget_ratio: float = 0.1,
+        min_samples: int = 20,
+        window: int = 200,
+        max_tokens: float = 10,
+    ):
+        self.replicas = max(1, replicas)
+        self.quantile = quantile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+        self.latencies = deque(maxlen=window)
+        self.tokens = 0.0
+        self.hedges_sent = 0
+        self._next_replica = itertools.cycle(range(self.replicas))
+
+    def record(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.budget_ratio <= 0 or len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * self.quantile), len(ordered) - 1)]
+
+    def _spend_token(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.hedges_sent += 1
+        return True
+
+    async def call(self, fn: Callable[[int], Awaitable[Optional[T]]]) -> Optional[T]:
+        """Call ``fn(replica)``, hedged, returns the first non-None result."""
+        first = next(self._next_replica)
+        self.tokens = min(self.tokens + self.budget_ratio, self.max_tokens)
+
+        async def attempt(replica: int) -> Optional[T]:
+            started = time.monotonic()
+            result = await fn(replica)
+            if result is not None:
+                self.record(time.monotonic() - started)
+            return result
+
+        pending = {asyncio.ensure_future(attempt(first))}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self._spend_token():
+                    hedge = (first + 1) % self.replicas
+                    pending.add(asyncio.ensure_future(attempt(hedge)))
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    result = task.result()
+                    if result is not None:
+                        return result
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job(BaseModel):
+    job_id: str
+    status: str = QUEUED
+    created_at: float
+    updated_at: float
+    request: dict
+    stage: Optional[str] = None
+    partial: List[dict] = []
+    result: Optional[dict] = None
+    error: Optional[dict] = None
+
+
+class JobStore:
+    """Where job state lives, so it can be polled from any request."""
+
+    def save(self, job: Job) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def unfinished(self) -> List[Job]:
+        raise NotImplementedError
+
+    def prune(self, finished_before: float) -> None:
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    def __init__(self, max_jobs: int = 10000):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def save(self, job: Job) -> None:
+        self._jobs[job.job_id] = job.model_copy(deep=True)
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        return job.model_copy(deep=True) if job else None
+
+    def unfinished(self) -> List[Job]:
+        return [j for j in self._jobs.values() if j.status in (QUEUED, RUNNING)]
+
+    def prune(self, finished_before: float) -> None:
+        for job_id, job in list(self._jobs.items()):
+            if job.status in (DONE, FAILED) and job.updated_at < finished_before:
+                del self._jobs[job_id]
+
+
+class SqliteJobStore(JobStore):
+    """Keeps jobs in a local SQLite file, so they survive restarts."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, status TEXT, updated_at REAL, data TEXT)"
+        )
+        self._db.commit()
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                (job.job_id, job.status, job.updated_at, job.model_dump_json()),
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        return [Job(**json.loads(row[0])) for row in rows]
+
+    def prune(self, finished_before: float) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, finished_before),
+            )
+            self._db.commit()
+
+
+# runs one job: receives the request and a progress callback, returns the result
+JobFn = Callable[[dict, Callable[[str, dict], Awaitable[None]]], Awaitable[dict]]
+
+
+class JobRunner:
+    """In-process worker pool that executes jobs from a bounded queue."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        run: JobFn,
+        workers: int,
+        queue_size: int,
+        retention: float,
+    ):
+        self.store = store
+        self.run = run
+        self.workers = workers
+        self.retention = retention
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        # jobs that were queued or running when the process stopped are lost
+        for job in self.store.unfinished():
+            self._finish(
+                job, FAILED, error={"status_code": 500, "detail": "interrupted"}
+            )
+        self._tasks = [
+            asyncio.create_task(self._work()) for _ in range(max(1, self.workers))
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, request: dict) -> Job:
+        """Queue a job, raises asyncio.QueueFull when the queue is full."""
+        now = time.time()
+        job = Job(
+            job_id=uuid.uuid4().hex, created_at=now, updated_at=now, request=request
+        )
+        self.queue.put_nowait(job)
+        self.store.save(job)
+        return job
+
+    def _finish(self, job: Job, status: str, **fields) -> None:
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.status = status
+        job.updated_at = time.time()
+        self.store.save(job)
+
+    async def _work(self) -> None:
+        while True:
+            job: Job = await self.queue.get()
+            job.status = RUNNING
+            job.updated_at = time.time()
+            self.store.save(job)
+
+            async def progress(event: str, data: dict) -> None:
+                job.stage = event
+                if event == "recipe":
+                    job.partial.append(data)
+                job.updated_at = time.time()
+                self.store.save(job)
+
+            try:
+                result = await self.run(job.request, progress)
+            except HTTPException as e:
+                error = {"status_code": e.status_code, "detail": e.detail}
+                self._finish(job, FAILED, error=error)
+            except Exception as e:
+                self._finish(job, FAILED, error={"status_code": 500, "detail": str(e)})
+            else:
+                self._finish(job, DONE, result=result)
+            self.store.prune(time.time() - self.retention)
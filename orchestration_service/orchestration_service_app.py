@@ -1,9 +1,59 @@
+import asyncio
+import json
+import math
 import os
-from typing import List
+import time
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import requests
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import httpx
+from admission import (
+    ANONYMOUS,
+    BACKGROUND,
+    INTERACTIVE,
+    AdmissionController,
+    Overloaded,
+)
+from circuit_breaker import BreakerTransport, CircuitBreaker, CircuitOpenError
+from constraints import from_requirements, parse_constraints
+from deadline import Deadline
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.requests import HTTPConnection
+from fastapi.responses import StreamingResponse
+from hedging import Hedger
+from jobs import Job, JobRunner, JobStore, MemoryJobStore, SqliteJobStore
+from page_memo import PageMemo
+from pipeline import run_page_pipeline
+from pydantic import BaseModel, Field, ValidationError
+from result_cache import ResultCache
+from services import SITE_FAILURE_STATUS, HttpServices, LocalServices, Services
+from sessions import Session
+from singleflight import SingleFlight
+from timing import StageTimer
+from yield_stats import YieldTracker
+
+# "http" calls the services over the network, "local" imports them and runs the
+# whole pipeline in this process
+SERVICE_MODE = os.getenv("SERVICE_MODE", "http")
+if SERVICE_MODE not in ("http", "local"):
+    raise RuntimeError(f"Unknown SERVICE_MODE {SERVICE_MODE}")
 
 QUERY_PLANNER_URL = os.getenv("QUERY_PLANNER_URL")
 SEARCH_SERVICE_URL = os.getenv("SEARCH_SERVICE_URL")
@@ -18,15 +68,235 @@ for name, url in [
     ("EXTRACTOR_SERVICE_URL", EXTRACTOR_SERVICE_URL),
     ("RANKER_SERVICE_URL", RANKER_SERVICE_URL),
 ]:
-    if not url:
+    if not url and SERVICE_MODE == "http":
         raise RuntimeError(f"Missing required environment variable {name}")
 
-app = FastAPI(title="AI Cooking Assistant Orchestration Layer")
+# number of fetch and extract workers of the page pipeline
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "8"))
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "4"))
+# fetched pages waiting for a free extract worker
+PAGE_QUEUE_SIZE = int(os.getenv("PAGE_QUEUE_SIZE", "8"))
+# stop fetching and extracting once top_k * EARLY_STOP_FACTOR recipes have been
+# extracted, 0 disables early termination
+EARLY_STOP_FACTOR = float(os.getenv("EARLY_STOP_FACTOR", "2"))
+# adaptive search fan-out: ask for enough URLs to reach the early stop target at
+# the observed share of URLs that yield a recipe (YIELD_INITIAL_RATE until
+# there are observations, never assumed below YIELD_MIN_RATE), and at most
+# top_k * SEARCH_MAX_FANOUT
+YIELD_INITIAL_RATE = float(os.getenv("YIELD_INITIAL_RATE", "0.5"))
+YIELD_MIN_RATE = float(os.getenv("YIELD_MIN_RATE", "0.25"))
+SEARCH_MAX_FANOUT = int(os.getenv("SEARCH_MAX_FANOUT", "8"))
+# cached /find_recipes results, fresh for RESULT_CACHE_TTL seconds and then
+# served stale (and refreshed in the background) for RESULT_CACHE_STALE_TTL more
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_STALE_TTL = float(os.getenv("RESULT_CACHE_STALE_TTL", "86400"))
+# overall time budget of a request (FindRequest.deadline_secs may only ask for
+# less), and the part of it (at most a quarter) kept back for ranking
+REQUEST_DEADLINE_SECS = float(os.getenv("REQUEST_DEADLINE_SECS", "90"))
+RANK_RESERVE_SECS = float(os.getenv("RANK_RESERVE_SECS", "15"))
+# hedged extractor calls: a duplicate goes out when a call is slower than the
+# EXTRACT_HEDGE_QUANTILE of recent latencies, for at most EXTRACT_HEDGE_BUDGET
+# of the calls (0 disables hedging)
+EXTRACT_HEDGE_BUDGET = float(os.getenv("EXTRACT_HEDGE_BUDGET", "0"))
+EXTRACT_HEDGE_QUANTILE = float(os.getenv("EXTRACT_HEDGE_QUANTILE", "0.9"))
+EXTRACT_HEDGE_MIN_SAMPLES = int(os.getenv("EXTRACT_HEDGE_MIN_SAMPLES", "20"))
+# a downstream service's breaker opens after BREAKER_FAILURE_THRESHOLD failed
+# calls in a row and lets BREAKER_HALF_OPEN_CALLS probes through after
+# BREAKER_RESET_SECS
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECS = float(os.getenv("BREAKER_RESET_SECS", "30"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+# have the fetcher write pages to the shared blob store and hand only their
+# hash to the extractor, instead of relaying the HTML through the orchestrator
+PASS_HTML_BY_REFERENCE = os.getenv("PASS_HTML_BY_REFERENCE", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# /find_recipes/batch: requests run at once and the largest accepted batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "1000"))
+# /jobs: worker count, queued jobs beyond which submissions get a 503, how long
+# finished jobs are kept and where ("memory" or "sqlite" at JOB_STORE_PATH)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION_SECS = float(os.getenv("JOB_RETENTION_SECS", "3600"))
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.sqlite3")
+# admission control of pipeline runs: at most ADMISSION_MAX_ACTIVE at once
+# (0 disables the limit), up to ADMISSION_MAX_QUEUED more wait at most
+# ADMISSION_QUEUE_TIMEOUT seconds for a slot, the rest get a 503
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "16"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# fairness between clients (told apart by X-Client-Id, else by their address:
+# the first one in the CLIENT_ADDRESS_HEADER a trusted proxy sets, like
+# X-Forwarded-For, or the peer address) and
+# between the interactive and background (jobs, batches, cache refreshes)
+# classes: a client runs at most ADMISSION_CLIENT_MAX_ACTIVE pipelines (0 for no
+# quota) and queues at most ADMISSION_CLIENT_MAX_QUEUED, free slots go to the
+# classes in proportion to their weights, background runs use at most
+# ADMISSION_BACKGROUND_MAX_ACTIVE slots and may wait
+# ADMISSION_BACKGROUND_QUEUE_TIMEOUT seconds
+CLIENT_ADDRESS_HEADER = os.getenv("CLIENT_ADDRESS_HEADER", "")
+ADMISSION_CLIENT_MAX_ACTIVE = int(os.getenv("ADMISSION_CLIENT_MAX_ACTIVE", "4"))
+ADMISSION_CLIENT_MAX_QUEUED = int(os.getenv("ADMISSION_CLIENT_MAX_QUEUED", "8"))
+ADMISSION_INTERACTIVE_WEIGHT = float(os.getenv("ADMISSION_INTERACTIVE_WEIGHT", "8"))
+ADMISSION_BACKGROUND_WEIGHT = float(os.getenv("ADMISSION_BACKGROUND_WEIGHT", "1"))
+ADMISSION_BACKGROUND_MAX_ACTIVE = int(os.getenv("ADMISSION_BACKGROUND_MAX_ACTIVE", "8"))
+ADMISSION_BACKGROUND_QUEUE_TIMEOUT = float(
+    os.getenv("ADMISSION_BACKGROUND_QUEUE_TIMEOUT", "300")
+)
+# encoding of the bodies exchanged with the services: SERVICE_MEDIA_TYPE is
+# "json" or "msgpack", SERVICE_CONTENT_ENCODING "identity", "gzip" or "zstd"
+SERVICE_MEDIA_TYPE = os.getenv("SERVICE_MEDIA_TYPE", "json")
+SERVICE_CONTENT_ENCODING = os.getenv("SERVICE_CONTENT_ENCODING", "identity")
+if SERVICE_MEDIA_TYPE not in ("json", "msgpack"):
+    raise RuntimeError(f"Unknown SERVICE_MEDIA_TYPE {SERVICE_MEDIA_TYPE}")
+if SERVICE_CONTENT_ENCODING not in ("identity", "gzip", "zstd"):
+    raise RuntimeError(f"Unknown SERVICE_CONTENT_ENCODING {SERVICE_CONTENT_ENCODING}")
+# search for the raw input (for half the URLs) while the queries are planned and
+# start fetching its results, then merge in the planned search results by rank
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# search for each query as soon as the planner streams it, instead of waiting
+# for all of them (a speculative search then runs alongside and its results are
+# taken as they arrive, not merged by rank)
+STREAM_QUERIES = os.getenv("STREAM_QUERIES", "false").lower() in ("1", "true", "yes")
+# candidate recipes kept per /sessions WebSocket
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "100"))
+# connection pool size of each downstream client
+MAX_CONNECTIONS_PER_SERVICE = int(os.getenv("MAX_CONNECTIONS_PER_SERVICE", "32"))
+
+# EXTRACTOR_SERVICE_URL may list several comma separated replicas
+EXTRACTOR_REPLICA_URLS = [
+    replica.strip()
+    for replica in (EXTRACTOR_SERVICE_URL or "").split(",")
+    if replica.strip()
+] or [""]
+
+SERVICE_URLS = {
+    "query_planner": QUERY_PLANNER_URL,
+    "search_service": SEARCH_SERVICE_URL,
+    "html_fetcher": HTML_FETCHER_URL,
+    "extractor_service": EXTRACTOR_REPLICA_URLS[0],
+    "ranker_service": RANKER_SERVICE_URL,
+}
+
+
+def build_breakers() -> Dict[str, CircuitBreaker]:
+    return {
+        service: CircuitBreaker(
+            service,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_SECS,
+            half_open_calls=BREAKER_HALF_OPEN_CALLS,
+        )
+        for service in SERVICE_URLS
+    }
+
+
+def build_clients(
+    breakers: Dict[str, CircuitBreaker],
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> Dict[str, httpx.AsyncClient]:
+    """One pooled keep-alive client per downstream service, behind its breaker."""
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS_PER_SERVICE,
+        max_keepalive_connections=MAX_CONNECTIONS_PER_SERVICE,
+    )
+    return {
+        service: httpx.AsyncClient(
+            base_url=url,
+            transport=BreakerTransport(
+                transport or httpx.AsyncHTTPTransport(limits=limits),
+                breakers[service],
+            ),
+        )
+        for service, url in SERVICE_URLS.items()
+    }
+
+
+def build_services(breakers: Dict[str, CircuitBreaker]) -> Services:
+    if SERVICE_MODE == "local":
+        return LocalServices(breakers)
+    return HttpServices(
+        build_clients(breakers),
+        EXTRACTOR_REPLICA_URLS,
+        media_type=f"application/{SERVICE_MEDIA_TYPE}",
+        encoding=SERVICE_CONTENT_ENCODING,
+    )
+
+
+def build_job_store() -> JobStore:
+    if JOB_STORE == "sqlite":
+        return SqliteJobStore(JOB_STORE_PATH)
+    if JOB_STORE == "memory":
+        return MemoryJobStore()
+    raise RuntimeError(f"Unknown JOB_STORE {JOB_STORE}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.breakers = build_breakers()
+    app.state.services = build_services(app.state.breakers)
+    app.state.extract_hedger = Hedger(
+        replicas=len(EXTRACTOR_REPLICA_URLS),
+        quantile=EXTRACT_HEDGE_QUANTILE,
+        budget_ratio=EXTRACT_HEDGE_BUDGET,
+        min_samples=EXTRACT_HEDGE_MIN_SAMPLES,
+    )
+    app.state.yield_tracker = YieldTracker(
+        initial_rate=YIELD_INITIAL_RATE, min_rate=YIELD_MIN_RATE
+    )
+    app.state.result_cache = ResultCache(
+        RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_STALE_TTL
+    )
+    app.state.admission = AdmissionController(
+        ADMISSION_MAX_ACTIVE,
+        ADMISSION_MAX_QUEUED,
+        ADMISSION_QUEUE_TIMEOUT,
+        client_max_active=ADMISSION_CLIENT_MAX_ACTIVE,
+        client_max_queued=ADMISSION_CLIENT_MAX_QUEUED,
+        weights={
+            INTERACTIVE: ADMISSION_INTERACTIVE_WEIGHT,
+            BACKGROUND: ADMISSION_BACKGROUND_WEIGHT,
+        },
+        class_max_active={BACKGROUND: ADMISSION_BACKGROUND_MAX_ACTIVE},
+        queue_timeouts={BACKGROUND: ADMISSION_BACKGROUND_QUEUE_TIMEOUT},
+    )
+    app.state.inflight = SingleFlight()
+    app.state.listeners = {}
+    app.state.background_tasks = set()
+    app.state.open_sessions = 0
+    app.state.jobs = JobRunner(
+        build_job_store(),
+        run_job,
+        workers=JOB_WORKERS,
+        queue_size=JOB_QUEUE_SIZE,
+        retention=JOB_RETENTION_SECS,
+    )
+    app.state.jobs.start()
+    yield
+    await app.state.jobs.stop()
+    for task in app.state.background_tasks:
+        task.cancel()
+    app.state.inflight.cancel_all()
+    await app.state.services.aclose()
+
+
+app = FastAPI(title="AI Cooking Assistant Orchestration Layer", lifespan=lifespan)
 
 
 class FindRequest(BaseModel):
     ingredients: str
     top_k: int = 3
+    deadline_secs: Optional[float] = Field(default=None, gt=0)
+    include_timings: bool = False
 
 
 class RecipeOut(BaseModel):
@@ -41,107 +311,893 @@ class RecipeOut(BaseModel):
 
 class FindResponse(BaseModel):
     results: List[RecipeOut]
+    # stage durations in ms, only when FindRequest.include_timings is set
+    timings: Optional[Dict[str, float]] = None
+    # answered by a fallback or cut short by the deadline, so not cached
+    degraded: bool = Field(default=False, exclude=True)
 
 
-@app.post("/find_recipes", response_model=FindResponse)
-def find_recipes(req: FindRequest):
-    # query planning (qp)
+class JobSubmitted(BaseModel):
+    job_id: str
+    status: str
+
+
+class BatchRequest(BaseModel):
+    requests: List[FindRequest]
+
+
+# progress callback of run_find_recipes, receives an event name and its payload
+EventFn = Callable[[str, dict], Awaitable[None]]
+
+# header naming the client for per-client quotas, and the one a client uses to
+# mark its interactive-endpoint requests as background work
+CLIENT_ID_HEADER = "X-Client-Id"
+PRIORITY_HEADER = "X-Priority"
+
+
+class Caller(NamedTuple):
+    """Who a pipeline run is for, for admission control."""
+
+    client_id: str = ANONYMOUS
+    priority: str = INTERACTIVE
+
+
+def identify(connection: HTTPConnection, priority: str = INTERACTIVE) -> Caller:
+    """The caller of a request, background if the endpoint or client says so.
+
+    Callers without X-Client-Id are told apart by their address: the first one
+    of the CLIENT_ADDRESS_HEADER if one is set (behind a proxy every user has
+    the proxy's address), else the peer address. Leaving out the header does
+    not escape the per-client quota.
+    """
+    client_id = connection.headers.get(CLIENT_ID_HEADER)
+    if not client_id and CLIENT_ADDRESS_HEADER:
+        forwarded = connection.headers.get(CLIENT_ADDRESS_HEADER, "")
+        client_id = forwarded.split(",")[0].strip()
+    if not client_id and connection.client:
+        client_id = connection.client.host
+    client_id = client_id or ANONYMOUS
+    if connection.headers.get(PRIORITY_HEADER, "").lower() == BACKGROUND:
+        priority = BACKGROUND
+    return Caller(client_id, priority)
+
+
+@asynccontextmanager
+async def admitted(caller: Caller):
+    """Hold an admission slot for ``caller``, 503 if there is none to wait for."""
     try:
-        qp_http_response = requests.post(
-            f"{QUERY_PLANNER_URL}/generate_queries",
-            json={"ingredients": req.ingredients},
-            timeout=90,
+        async with app.state.admission.slot(caller.client_id, caller.priority):
+            yield
+    except Overloaded as err:
+        raise HTTPException(
+            status_code=503,
+            detail=str(err),
+            headers={"Retry-After": str(err.retry_after)},
         )
-        qp_http_response.raise_for_status()
-        queries = qp_http_response.json().get("queries", [])
-        if not queries:
-            raise ValueError("Empty queries list")
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"QueryPlanner error: {e}")
 
-    # web search (ws)
+
+async def fetch_page(
+    services: Services,
+    page_url: str,
+    deadline: Deadline,
+    timer: Optional[StageTimer] = None,
+    yields: Optional[YieldTracker] = None,
+) -> Optional[dict]:
+    """The fetched page, or None. With ``yields`` a page its site would not serve
+    counts as a failure of the site's domain, errors of the fetcher or of this
+    call do not."""
+    if deadline.expired():
+        return None
     try:
-        ws_http_response = requests.post(
-            f"{SEARCH_SERVICE_URL}/search_urls",
-            json={"queries": queries, "num_results": req.top_k * 4},
-            timeout=60,
+        fh_reply = await services.fetch_html(page_url, PASS_HTML_BY_REFERENCE, deadline)
+    except httpx.HTTPError as err:
+        print(err)
+        site_failed = (
+            isinstance(err, httpx.HTTPStatusError)
+            and err.response.status_code == SITE_FAILURE_STATUS
         )
-        ws_http_response.raise_for_status()
-        urls = [item["url"] for item in ws_http_response.json().get("results", [])]
-        if not urls:
-            raise ValueError("Search returned no URLs")
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"SearchService error: {e}")
+        if yields and site_failed:
+            yields.record(page_url, False)
+        return None
+    if timer:
+        timer.add_downstream("fetch", fh_reply.server_timing, page_url)
+    results = fh_reply.data.get("results", [])
+    if results and (results[0].get("html") or results[0].get("html_ref")):
+        return results[0]
+    if yields:
+        yields.record(page_url, False)
+    return None
+
+
+async def extract_page(
+    services: Services,
+    item: dict,
+    deadline: Deadline,
+    replica: int = 0,
+    timer: Optional[StageTimer] = None,
+) -> Optional[dict]:
+    url = item.get("url")
+    html = item.get("html")
+    html_ref = item.get("html_ref")
+    if not url or not (html or html_ref) or deadline.expired():
+        return None
+    page = (
+        {"url": url, "html_ref": html_ref} if html_ref else {"url": url, "html": html}
+    )
+    try:
+        er_reply = await services.extract_recipe(page, deadline, replica)
+    except httpx.HTTPError:
+        return None
+    if timer:
+        timer.add_downstream("extract", er_reply.server_timing, url)
+    recipe = dict(er_reply.data)
+    recipe["id"] = recipe["source_url"]
+    return recipe
+
+
+def unavailable(err: CircuitOpenError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(err),
+        headers={"Retry-After": str(err.breaker.retry_after())},
+    )
 
-    # fetch html (fh)
-    html_items = []
-    for page_url in urls:
+
+def raw_query(ingredients: str) -> str:
+    """Search query of the unplanned request."""
+    return f"{ingredients} recipe"
+
+
+def merge_by_rank(*rankings: List[str]) -> List[str]:
+    """Interleave the rankings rank by rank, dropping repeated URLs."""
+    merged: Dict[str, None] = {}
+    for rank in range(max(map(len, rankings), default=0)):
+        for ranking in rankings:
+            if rank < len(ranking):
+                merged.setdefault(ranking[rank])
+    return list(merged)
+
+
+def rank_locally(ingredients: str, recipes: List[dict], top_k: int) -> List[dict]:
+    """Fallback ranking by how many words of the request a recipe mentions."""
+    wanted = set(ingredients.lower().replace(",", " ").split())
+
+    def score(recipe: dict) -> int:
+        text = " ".join([recipe["title"], *recipe["ingredients"]]).lower()
+        return sum(word in text for word in wanted)
+
+    return sorted(recipes, key=score, reverse=True)[:top_k]
+
+
+def request_deadline(req: FindRequest) -> float:
+    """Seconds the request may take, its deadline_secs up to REQUEST_DEADLINE_SECS."""
+    return min(req.deadline_secs or REQUEST_DEADLINE_SECS, REQUEST_DEADLINE_SECS)
+
+
+def to_recipe_out(recipe: dict) -> dict:
+    return {
+        "title": recipe["title"],
+        "url": recipe["source_url"],
+        "ingredients": recipe["ingredients"],
+        "steps": recipe["steps"],
+        "tools": recipe["tools"],
+        "cook_time_mins": recipe["cook_time_mins"],
+        "source_url": recipe["source_url"],
+    }
+
+
+async def ignore_event(event: str, data: dict) -> None:
+    return None
+
+
+async def run_find_recipes(
+    req: FindRequest,
+    services: Services,
+    emit: EventFn = ignore_event,
+    page_memo: Optional[PageMemo] = None,
+    timer: Optional[StageTimer] = None,
+) -> FindResponse:
+    """Run the full pipeline, reporting progress through ``emit``.
+
+    With a ``page_memo`` the page fetches and extractions are shared with the
+    other requests using the same memo.
+
+    The number of URLs searched for and the order they are tried in follow the
+    recipe yield observed so far, overall and per domain.
+
+    Every downstream call gets the time left of the request deadline as its
+    timeout and in the X-Request-Timeout header. Stage durations, and those the
+    services report in their Server-Timing headers, are recorded on ``timer``.
+    """
+    deadline = Deadline(request_deadline(req))
+    timer = timer or StageTimer()
+    yields: YieldTracker = app.state.yield_tracker
+    stop_after = math.ceil(req.top_k * EARLY_STOP_FACTOR)
+
+    num_results = yields.urls_needed(
+        max(stop_after, req.top_k), req.top_k * SEARCH_MAX_FANOUT
+    )
+    # cheap local filters of the extracted recipes: the constraints the request
+    # states, tightened by the structured requirements the planner returns
+    constraints = parse_constraints(req.ingredients)
+    requirements: dict = {}
+    rejected = 0
+    degraded = False
+
+    def learn(planned: dict) -> None:
+        nonlocal constraints, requirements
+        requirements = planned
+        constraints = constraints.merge(from_requirements(planned))
+
+    # query planning (qp)
+    async def plan() -> List[str]:
+        nonlocal degraded
+        try:
+            with timer.measure("plan"):
+                qp_reply = await services.generate_queries(req.ingredients, deadline)
+            timer.add_downstream("plan", qp_reply.server_timing)
+            queries = qp_reply.data.get("queries", [])
+            if not queries:
+                raise ValueError("Empty queries list")
+            learn(qp_reply.data.get("requirements") or {})
+        except CircuitOpenError:
+            # search with the raw input while the planner is unavailable
+            queries = [raw_query(req.ingredients)]
+            degraded = True
+        except httpx.TimeoutException as e:
+            raise HTTPException(status_code=504, detail=f"QueryPlanner timed out: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"QueryPlanner error: {e}")
+        await emit("queries", {"queries": queries})
+        return queries
+
+    # web search (ws)
+    async def search(
+        queries: List[str], num_results: int, stage: str = "search"
+    ) -> List[str]:
+        deadline.check(stage)
         try:
-            fh_http_response = requests.post(
-                f"{HTML_FETCHER_URL}/fetch_html", json={"urls": [page_url]}, timeout=60
+            with timer.measure(stage):
+                ws_reply = await services.search_urls(queries, num_results, deadline)
+            timer.add_downstream(stage, ws_reply.server_timing)
+            urls = yields.order(
+                [item["url"] for item in ws_reply.data.get("results", [])]
             )
-            fh_http_response.raise_for_status()
-            results = fh_http_response.json().get("results", [])
-            if results and "html" in results[0]:
-                html_items.append(results[0])
-        except requests.RequestException as err:
-            print(err)
-            continue
-    if not html_items:
-        raise HTTPException(status_code=404, detail="No pages could be fetched")
+            if not urls:
+                raise ValueError("Search returned no URLs")
+        except CircuitOpenError as e:
+            raise unavailable(e)
+        except httpx.TimeoutException as e:
+            raise HTTPException(status_code=504, detail=f"SearchService timed out: {e}")
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"SearchService error: {e}")
+        return urls
+
+    async def planned_search() -> List[str]:
+        return await search(await plan(), num_results)
+
+    async def speculative_urls() -> AsyncIterator[List[str]]:
+        """URLs of a search for the raw input while the queries are planned,
+        then the planned search results merged with them by rank."""
+
+        async def guess() -> List[str]:
+            try:
+                return await search(
+                    [raw_query(req.ingredients)],
+                    max(1, num_results // 2),
+                    "speculative_search",
+                )
+            except HTTPException:
+                return []
+
+        nonlocal degraded
+        guessed_task = asyncio.ensure_future(guess())
+        planned_task = asyncio.ensure_future(planned_search())
+        sent: List[str] = []
+        try:
+            await asyncio.wait(
+                [guessed_task, planned_task], return_when=asyncio.FIRST_COMPLETED
+            )
+            guessed: List[str] = []
+            if planned_task.done() and not planned_task.exception():
+                guessed_task.cancel()
+            else:
+                guessed = await guessed_task
+                if guessed:
+                    sent.extend(guessed)
+                    await emit("urls", {"urls": list(sent)})
+                    yield guessed
+            try:
+                planned = await planned_task
+            except HTTPException:
+                if not sent:
+                    raise
+                # the speculative results have to do
+                degraded = True
+                return
+            merged = merge_by_rank(planned, guessed)
+            more = [url for url in merged if url not in sent]
+            more = more[: max(num_results - len(sent), 0)]
+            if more:
+                sent.extend(more)
+                await emit("urls", {"urls": list(sent)})
+                yield more
+        finally:
+            guessed_task.cancel()
+            planned_task.cancel()
 
-    # extract recipes (er)
-    extracted_recipes = []
-    for item in html_items:
-        url = item.get("url")
-        html = item.get("html")
-        if not url or not html:
-            continue
+    async def streamed_queries() -> AsyncIterator[str]:
+        nonlocal degraded
+        queries: List[str] = []
         try:
-            er_http_response = requests.post(
-                f"{EXTRACTOR_SERVICE_URL}/extract_recipe",
-                json={"url": url, "html": html},
-                timeout=60,
+            with timer.measure("plan"):
+                async for item in services.stream_queries(req.ingredients, deadline):
+                    if "requirements" in item:
+                        learn(item["requirements"] or {})
+                        continue
+                    queries.append(item["query"])
+                    await emit("queries", {"queries": list(queries)})
+                    yield item["query"]
+        except CircuitOpenError:
+            degraded = True
+            if not queries:
+                # search with the raw input while the planner is unavailable
+                queries.append(raw_query(req.ingredients))
+                await emit("queries", {"queries": queries})
+                yield queries[0]
+        except httpx.TimeoutException as e:
+            degraded = True
+            if not queries:
+                raise HTTPException(
+                    status_code=504, detail=f"QueryPlanner timed out: {e}"
+                )
+        except Exception as e:
+            degraded = True
+            if not queries:
+                raise HTTPException(status_code=502, detail=f"QueryPlanner error: {e}")
+        if not queries:
+            raise HTTPException(
+                status_code=502, detail="QueryPlanner error: Empty queries list"
+            )
+
+    async def streamed_urls() -> AsyncIterator[List[str]]:
+        """URLs of a search per query, started as soon as the planner has
+        streamed the query and passed on in the order the searches finish."""
+        found: asyncio.Queue = asyncio.Queue()
+        searches: List[asyncio.Task] = []
+        errors: List[HTTPException] = []
+
+        async def search_one(query: str, count: int, stage: str) -> None:
+            try:
+                await found.put(await search([query], count, stage))
+            except HTTPException as e:
+                errors.append(e)
+                await found.put([])
+
+        def start(query: str, count: int = num_results, stage: str = "search"):
+            searches.append(asyncio.create_task(search_one(query, count, stage)))
+
+        async def run_planner() -> None:
+            async for query in streamed_queries():
+                start(query)
+
+        if SPECULATIVE_SEARCH:
+            start(
+                raw_query(req.ingredients),
+                max(1, num_results // 2),
+                "speculative_search",
             )
-            er_http_response.raise_for_status()
-            recipe = er_http_response.json()
-            recipe["id"] = recipe["source_url"]
-            extracted_recipes.append(recipe)
-        except requests.RequestException:
-            continue
+        planner = asyncio.create_task(run_planner())
+        sent: List[str] = []
+        answered = 0
+        try:
+            while len(sent) < num_results:
+                if planner.done() and answered == len(searches):
+                    break
+                getter = asyncio.ensure_future(found.get())
+                waiting = {getter} if planner.done() else {getter, planner}
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    # the planner finished, maybe without another query
+                    getter.cancel()
+                    continue
+                answered += 1
+                more = [url for url in getter.result() if url not in sent]
+                more = more[: num_results - len(sent)]
+                if more:
+                    sent.extend(more)
+                    await emit("urls", {"urls": list(sent)})
+                    yield more
+            if not sent:
+                # the planner's error, else the last search error
+                planner.result()
+                raise errors[-1]
+        finally:
+            if planner.done() and not planner.cancelled():
+                planner.exception()
+            planner.cancel()
+            for task in searches:
+                task.cancel()
+
+    if STREAM_QUERIES:
+        url_source: Union[List[str], AsyncIterator[List[str]]] = streamed_urls()
+    elif SPECULATIVE_SEARCH:
+        url_source = speculative_urls()
+    else:
+        url_source = await planned_search()
+        await emit("urls", {"urls": url_source})
+
+    # the page work shared through a page_memo runs with a deadline of its own
+    async def fetch(page_url: str, page_deadline: Deadline = deadline):
+        with timer.measure("fetch", page_url):
+            return await fetch_page(services, page_url, page_deadline, timer, yields)
+
+    async def extract(item: dict, page_deadline: Deadline = deadline):
+        with timer.measure("extract", item.get("url")):
+            recipe = await app.state.extract_hedger.call(
+                lambda replica: extract_page(
+                    services, item, page_deadline, replica, timer
+                )
+            )
+        # an extraction that failed says nothing about the page
+        if recipe is not None:
+            yields.record(item["url"], True)
+        return recipe
+
+    async def fetch_and_report(page_url: str) -> Optional[dict]:
+        if page_memo:
+            page = await page_memo.fetch(
+                page_url, lambda page_deadline: fetch(page_url, page_deadline)
+            )
+        else:
+            page = await fetch(page_url)
+        if page:
+            await emit("page_fetched", {"url": page_url})
+        return page
+
+    async def extract_and_report(item: dict) -> Optional[dict]:
+        nonlocal rejected
+        if page_memo:
+            recipe = await page_memo.extract(
+                item["url"], lambda page_deadline: extract(item, page_deadline)
+            )
+        else:
+            recipe = await extract(item)
+        if recipe and not constraints.allows(recipe):
+            rejected += 1
+            return None
+        if recipe:
+            await emit("recipe", to_recipe_out(recipe))
+        return recipe
+
+    # fetch html (fh) and extract recipes (er) as one streaming pipeline, leaving
+    # time for ranking
+    rank_reserve = min(RANK_RESERVE_SECS, deadline.remaining() / 4)
+    pipeline = await run_page_pipeline(
+        url_source,
+        fetch_page=fetch_and_report,
+        extract_page=extract_and_report,
+        fetch_workers=FETCH_CONCURRENCY,
+        extract_workers=EXTRACT_CONCURRENCY,
+        queue_size=PAGE_QUEUE_SIZE,
+        stop_after=stop_after,
+        time_limit=deadline.remaining() - rank_reserve,
+    )
+    if not pipeline.pages_fetched:
+        raise HTTPException(status_code=404, detail="No pages could be fetched")
+    # recipes extracted before the planner's requirements arrived
+    extracted_recipes = constraints.filter(pipeline.recipes)
     if not extracted_recipes:
+        if rejected or pipeline.recipes:
+            raise HTTPException(
+                status_code=404, detail="No recipes match the requirements"
+            )
         raise HTTPException(status_code=404, detail="No recipes extracted")
 
     # rank recipes (rr)
+    deadline.check("ranking")
     try:
         payload = {
-            "requirements": {"ingredients": req.ingredients},
+            "requirements": {"ingredients": req.ingredients, **requirements},
             "recipes": extracted_recipes,
             "top_k": req.top_k,
         }
-        rr_http_response = requests.post(
-            f"{RANKER_SERVICE_URL}/rank_recipes", json=payload, timeout=60
-        )
-        rr_http_response.raise_for_status()
-        top_recipes = rr_http_response.json().get("recipes", [])
+        with timer.measure("rank"):
+            rr_reply = await services.rank_recipes(payload, deadline)
+        timer.add_downstream("rank", rr_reply.server_timing)
+        top_recipes = rr_reply.data.get("recipes", [])
         if not top_recipes:
             raise ValueError("Ranker returned no recipes")
+    except CircuitOpenError:
+        top_recipes = rank_locally(req.ingredients, extracted_recipes, req.top_k)
+        degraded = True
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"RankService timed out: {e}")
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"RankService error: {e}")
 
-    # full response
-    output_recipe = []
-    for recipe in top_recipes:
-        output_recipe.append(
-            {
-                "title": recipe["title"],
-                "url": recipe["source_url"],
-                "ingredients": recipe["ingredients"],
-                "steps": recipe["steps"],
-                "tools": recipe["tools"],
-                "cook_time_mins": recipe["cook_time_mins"],
-                "source_url": recipe["source_url"],
-            }
+    return FindResponse(
+        results=[to_recipe_out(recipe) for recipe in top_recipes],
+        degraded=degraded or pipeline.timed_out,
+    )
+
+
+def cache_key(req: FindRequest) -> Tuple[str, int]:
+    return " ".join(req.ingredients.lower().split()), req.top_k
+
+
+def flight_key(req: FindRequest) -> Tuple[str, int, float]:
+    """Key of the identical requests that share a run, which includes the
+    deadline so no request waits on a run bound to end sooner than it may."""
+    return (*cache_key(req), request_deadline(req))
+
+
+async def coalesced_find_recipes(
+    req: FindRequest,
+    emit: EventFn = ignore_event,
+    timer: Optional[StageTimer] = None,
+    caller: Caller = Caller(),
+) -> FindResponse:
+    """Run the pipeline once for all concurrent identical requests.
+
+    Every caller's ``emit`` receives the progress events of the shared run
+    from the moment it joins, until it raises. The result is stored in the
+    result cache unless it is degraded.
+
+    The shared run waits for an admission slot of the first ``caller`` and
+    fails with 503 and Retry-After when it cannot queue for one.
+    """
+    key = flight_key(req)
+    listeners: Dict[Tuple[str, int, float], set] = app.state.listeners
+    listeners.setdefault(key, set()).add(emit)
+
+    async def broadcast(event: str, data: dict) -> None:
+        for listener in list(listeners.get(key, ())):
+            try:
+                await listener(event, data)
+            except Exception as err:
+                # a caller that went away, like a closed WebSocket, must not
+                # fail the run for the others
+                print(f"dropping a listener of {key}: {err}")
+                listeners.get(key, set()).discard(listener)
+
+    async def run() -> FindResponse:
+        run_timer = timer or StageTimer()
+        queued_at = time.perf_counter()
+        async with admitted(caller):
+            run_timer.add("queue", (time.perf_counter() - queued_at) * 1000)
+            response = await run_find_recipes(
+                req, app.state.services, broadcast, timer=run_timer
+            )
+        if not response.degraded:
+            app.state.result_cache.set(cache_key(req), response)
+        return response
+
+    try:
+        return await app.state.inflight.do(key, run)
+    finally:
+        waiting = listeners.get(key)
+        if waiting is not None:
+            waiting.discard(emit)
+            if not waiting:
+                del listeners[key]
+
+
+def refresh_in_background(req: FindRequest) -> None:
+    cache: ResultCache = app.state.result_cache
+    key = cache_key(req)
+    if not cache.start_refresh(key):
+        return
+
+    async def refresh():
+        try:
+            await coalesced_find_recipes(
+                req, caller=Caller("cache-refresh", BACKGROUND)
+            )
+        except Exception as err:
+            print(f"refresh of {key} failed: {err}")
+        finally:
+            cache.end_refresh(key)
+
+    task = asyncio.create_task(refresh())
+    app.state.background_tasks.add(task)
+    task.add_done_callback(app.state.background_tasks.discard)
+
+
+async def cached_find_recipes(
+    req: FindRequest,
+    emit: EventFn = ignore_event,
+    timer: Optional[StageTimer] = None,
+    caller: Caller = Caller(),
+) -> Tuple[FindResponse, str]:
+    """Serve from the result cache, returns the response and HIT/STALE/MISS."""
+    cache: ResultCache = app.state.result_cache
+    cached, stale = cache.get(cache_key(req))
+    if cached is not None:
+        if stale:
+            refresh_in_background(req)
+        return cached, "STALE" if stale else "HIT"
+    return await coalesced_find_recipes(req, emit, timer, caller), "MISS"
+
+
+def with_timings(
+    req: FindRequest, result: FindResponse, timer: StageTimer
+) -> FindResponse:
+    timer.total()
+    if not req.include_timings:
+        return result
+    return result.model_copy(update={"timings": timer.as_dict()})
+
+
+@app.post(
+    "/find_recipes", response_model=FindResponse, response_model_exclude_none=True
+)
+async def find_recipes(req: FindRequest, request: Request, response: Response):
+    timer = StageTimer()
+    result, cache_status = await cached_find_recipes(
+        req, timer=timer, caller=identify(request)
+    )
+    result = with_timings(req, result, timer)
+    response.headers["X-Cache"] = cache_status
+    response.headers["Server-Timing"] = timer.header()
+    return result
+
+
+async def run_job(request: dict, emit: EventFn) -> dict:
+    request = dict(request)
+    caller = Caller(request.pop("client_id", ANONYMOUS), BACKGROUND)
+    req = FindRequest(**request)
+    timer = StageTimer()
+    response, _ = await cached_find_recipes(req, emit, timer, caller)
+    return with_timings(req, response, timer).model_dump(exclude_none=True)
+
+
+@app.post("/jobs", response_model=JobSubmitted, status_code=202)
+async def submit_job(req: FindRequest, request: Request, response: Response):
+    """Queue a find request and return at once, poll GET /jobs/{job_id}.
+
+    Jobs run as background work of the submitting client.
+    """
+    caller = identify(request, BACKGROUND)
+    try:
+        job = app.state.jobs.submit({**req.model_dump(), "client_id": caller.client_id})
+    except asyncio.QueueFull:
+        raise HTTPException(
+            status_code=503, detail="Job queue is full", headers={"Retry-After": "5"}
+        )
+    response.headers["Location"] = f"/jobs/{job.job_id}"
+    return JobSubmitted(job_id=job.job_id, status=job.status)
+
+
+@app.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    """Status, recipes extracted so far (``partial``) and the final ``result``."""
+    job = app.state.jobs.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+@app.get("/health")
+async def health():
+    return {
+        "admission": app.state.admission.snapshot(),
+        "yield": app.state.yield_tracker.snapshot(),
+        "sessions": app.state.open_sessions,
+        "breakers": {
+            service: breaker.snapshot()
+            for service, breaker in app.state.breakers.items()
+        },
+    }
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/find_recipes/stream")
+async def find_recipes_stream(req: FindRequest, request: Request):
+    """Server-Sent Events version of /find_recipes.
+
+    Emits ``queries``, ``urls``, ``page_fetched`` and ``recipe`` events as the
+    pipeline moves, then either ``results`` with the ranked recipes or
+    ``error``. The pipeline is cancelled when the client disconnects.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def emit(event: str, data: dict) -> None:
+        await events.put((event, data))
+
+    async def run():
+        try:
+            timer = StageTimer()
+            response, _ = await cached_find_recipes(req, emit, timer, identify(request))
+            response = with_timings(req, response, timer)
+            await emit("results", response.model_dump(exclude_none=True))
+        except HTTPException as e:
+            await emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            await emit("error", {"status_code": 500, "detail": str(e)})
+        finally:
+            await events.put(None)
+
+    async def event_stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                yield format_sse(*item)
+        finally:
+            task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/find_recipes/batch")
+async def find_recipes_batch(batch: BatchRequest, request: Request):
+    """Run many find requests, streaming one NDJSON line per request.
+
+    Lines are ``{"index": i, "results": [...]}`` or ``{"index": i, "error":
+    {"status_code": ..., "detail": ...}}`` in completion order. Identical
+    requests run once and every URL is fetched and extracted once for the
+    whole batch. Fresh cached results are reused and new ones are cached
+    unless degraded.
+    Every request of the batch is admitted as background work of the client.
+    """
+    if len(batch.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(batch.requests)} requests exceeds {BATCH_MAX_REQUESTS}",
         )
+    cache: ResultCache = app.state.result_cache
+    page_memo = PageMemo(FETCH_CONCURRENCY, EXTRACT_CONCURRENCY, REQUEST_DEADLINE_SECS)
+    request_slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    solving: Dict[Tuple[str, int, float], asyncio.Task] = {}
+    caller = identify(request, BACKGROUND)
+
+    async def solve(req: FindRequest) -> FindResponse:
+        cached, stale = cache.get(cache_key(req))
+        if cached is not None and not stale:
+            return cached
+        async with request_slots, admitted(caller):
+            response = await run_find_recipes(
+                req, app.state.services, page_memo=page_memo
+            )
+        if not response.degraded:
+            cache.set(cache_key(req), response)
+        return response
+
+    async def run_one(index: int, req: FindRequest) -> dict:
+        key = flight_key(req)
+        if key not in solving:
+            solving[key] = asyncio.ensure_future(solve(req))
+        try:
+            response = await asyncio.shield(solving[key])
+        except HTTPException as e:
+            return {
+                "index": index,
+                "error": {"status_code": e.status_code, "detail": e.detail},
+            }
+        except Exception as e:
+            return {"index": index, "error": {"status_code": 500, "detail": str(e)}}
+        return {"index": index, "results": response.model_dump()["results"]}
+
+    async def lines():
+        runs = [
+            asyncio.ensure_future(run_one(index, req))
+            for index, req in enumerate(batch.requests)
+        ]
+        try:
+            for next_done in asyncio.as_completed(runs):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            for task in [*runs, *solving.values()]:
+                task.cancel()
+            page_memo.cancel_all()
 
-    return FindResponse(results=output_recipe)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def search_for_session(
+    session: Session, emit: EventFn, caller: Caller
+) -> List[dict]:
+    """Search with the session's refined request and add the finds to its pool.
+
+    The ranker's order is kept for the results that meet the session's
+    constraints, the rest of the top_k comes from the pool.
+    """
+    req = FindRequest(ingredients=session.query(), top_k=session.top_k)
+    response, _ = await cached_find_recipes(req, emit, caller=caller)
+    found = session.constraints.filter(
+        recipe.model_dump() for recipe in response.results
+    )
+    session.add(found)
+    found_urls = {recipe["url"] for recipe in found}
+    rest = [
+        recipe for recipe in session.candidates() if recipe["url"] not in found_urls
+    ]
+    return found + rank_locally(session.query(), rest, session.top_k - len(found))
+
+
+@app.websocket("/sessions")
+async def recipe_session(websocket: WebSocket):
+    """Interactive search over one WebSocket, refined without searching again.
+
+    The client sends ``{"type": "search", "ingredients": ..., "top_k": ...}``
+    and then any number of ``{"type": "refine", "text": "make it dairy-free"}``.
+    Searches stream the progress events of ``/find_recipes/stream`` and every
+    recipe extracted goes into the session's candidate pool. A refinement
+    filters the pool by the constraints it states and re-ranks it locally,
+    searching again (with the refinements added to the request) only when
+    fewer than top_k candidates are left. Every message is answered with
+    ``{"type": "results", "source": "search" | "pool", "results": [...]}`` or
+    ``{"type": "error", "status_code": ..., "detail": ...}``.
+    """
+    await websocket.accept()
+    app.state.open_sessions += 1
+    caller = identify(websocket)
+    session: Optional[Session] = None
+
+    async def emit(event: str, data: dict) -> None:
+        if event == "recipe" and session is not None:
+            session.add([data])
+        await websocket.send_json({"type": event, **data})
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                if message.get("type") == "search":
+                    req = FindRequest(
+                        ingredients=message.get("ingredients"),
+                        top_k=message.get("top_k", 3),
+                    )
+                    session = Session(req.ingredients, req.top_k, SESSION_POOL_SIZE)
+                    results = await search_for_session(session, emit, caller)
+                    source = "search"
+                elif message.get("type") == "refine":
+                    if session is None:
+                        raise HTTPException(
+                            status_code=400, detail="Send a search before refining"
+                        )
+                    session.refine(str(message.get("text", "")))
+                    results = rank_locally(
+                        session.query(), session.candidates(), session.top_k
+                    )
+                    source = "pool"
+                    if len(results) < session.top_k:
+                        results = await search_for_session(session, emit, caller)
+                        source = "search"
+                else:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Unknown message type {message.get('type')}",
+                    )
+            except HTTPException as e:
+                await websocket.send_json(
+                    {"type": "error", "status_code": e.status_code, "detail": e.detail}
+                )
+                continue
+            except ValidationError as e:
+                await websocket.send_json(
+                    {"type": "error", "status_code": 422, "detail": str(e)}
+                )
+                continue
+            await websocket.send_json(
+                {
+                    "type": "results",
+                    "source": source,
+                    "results": results,
+                    "pool_size": len(session.pool),
+                }
+            )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        app.state.open_sessions -= 1
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from deadline import Deadline
+
+PageFn = Callable[[Deadline], Awaitable[Optional[dict]]]
+
+
+class PageMemo:
+    """Shares the page work between the requests of a batch.
+
+    Every URL is fetched and extracted at most once: the first request that
+    needs it starts the call and later ones await the same task. The stage
+    concurrency is bounded across the whole batch rather than per request.
+
+    The call gets a deadline of its own, ``page_deadline_secs`` from when it
+    starts, not that of the request that happened to ask first: every request
+    gets its answer, and one near its deadline would leave them all without.
+
+    Once a page's extraction has started its HTML is dropped from the memo and
+    later requests fetching it get only ``{"url": ...}``, enough to pick up the
+    memoized extraction, so a long batch does not keep every page in memory.
+    """
+
+    def __init__(
+        self,
+        fetch_concurrency: int,
+        extract_concurrency: int,
+        page_deadline_secs: float,
+    ):
+        self.page_deadline_secs = page_deadline_secs
+        self._fetch_slots = asyncio.Semaphore(fetch_concurrency)
+        self._extract_slots = asyncio.Semaphore(extract_concurrency)
+        self._fetched: Dict[str, asyncio.Future] = {}
+        self._extracted: Dict[str, asyncio.Future] = {}
+
+    @property
+    def pages_fetched(self) -> int:
+        return len(self._fetched)
+
+    @property
+    def pages_extracted(self) -> int:
+        return len(self._extracted)
+
+    async def fetch(self, url: str, fn: PageFn) -> Optional[dict]:
+        task = self._once(self._fetched, self._fetch_slots, url, fn)
+        # a request that stops early must not cancel a page others wait for
+        return await asyncio.shield(task)
+
+    async def extract(self, url: str, fn: PageFn) -> Optional[dict]:
+        task = self._once(self._extracted, self._extract_slots, url, fn)
+        self._drop_html(url)
+        return await asyncio.shield(task)
+
+    def _once(
+        self,
+        tasks: Dict[str, asyncio.Future],
+        slots: asyncio.Semaphore,
+        url: str,
+        fn: PageFn,
+    ) -> asyncio.Future:
+        task = tasks.get(url)
+        if task is None:
+
+            async def run() -> Optional[dict]:
+                async with slots:
+                    return await fn(Deadline(self.page_deadline_secs))
+
+            task = tasks[url] = asyncio.ensure_future(run())
+        return task
+
+    def _drop_html(self, url: str) -> None:
+        fetched = self._fetched.get(url)
+        if fetched is None or not fetched.done() or fetched.cancelled():
+            return
+        if fetched.exception() is None and fetched.result():
+            stub = asyncio.get_running_loop().create_future()
+            stub.set_result({"url": url})
+            self._fetched[url] = stub
+
+    def cancel_all(self) -> None:
+        for task in [*self._fetched.values(), *self._extracted.values()]:
+            task.cancel()
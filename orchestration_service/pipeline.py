@@ -0,0 +1,122 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Awaitable, Callable, List, Optional, Tuple, Union
+
+FetchFn = Callable[[str], Awaitable[Optional[dict]]]
+ExtractFn = Callable[[dict], Awaitable[Optional[dict]]]
+
+# marks the end of the url and page streams for the workers
+_DONE = object()
+
+
+@dataclass
+class PipelineResult:
+    pages_fetched: int = 0
+    recipes: List[dict] = field(default_factory=list)
+    # the time limit ran out before the pages did
+    timed_out: bool = False
+
+
+async def run_page_pipeline(
+    urls: Union[List[str], AsyncIterable[List[str]]],
+    fetch_page: FetchFn,
+    extract_page: ExtractFn,
+    fetch_workers: int,
+    extract_workers: int,
+    queue_size: int,
+    stop_after: Optional[int] = None,
+    time_limit: Optional[float] = None,
+) -> PipelineResult:
+    """Fetch and extract the given pages as a two stage streaming pipeline.
+
+    Fetch workers pull URLs and push every fetched page onto a bounded queue,
+    extract workers pick the pages up as soon as they arrive, so a page is
+    extracted while the other fetches are still in flight. Recipes are
+    returned in the order of ``urls``.
+
+    ``urls`` may also be an async iterable of URL batches, the fetch workers
+    start on each batch as it arrives. Errors raised by it end the pipeline.
+
+    Once ``stop_after`` recipes have been extracted, or after ``time_limit``
+    seconds, the outstanding fetch and extract work is cancelled and the
+    recipes found so far are returned.
+    """
+    result = PipelineResult()
+    url_queue: asyncio.Queue = asyncio.Queue()
+    if isinstance(urls, list):
+        fetch_workers = min(fetch_workers, len(urls))
+    fetch_workers = max(1, fetch_workers)
+    page_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    extracted: List[Tuple[int, dict]] = []
+    enough = asyncio.Event()
+
+    async def batches():
+        if isinstance(urls, list):
+            yield urls
+        else:
+            async for batch in urls:
+                yield batch
+
+    async def produce():
+        position = 0
+        try:
+            async for batch in batches():
+                for url in batch:
+                    url_queue.put_nowait((position, url))
+                    position += 1
+        finally:
+            for _ in range(fetch_workers):
+                url_queue.put_nowait(_DONE)
+
+    async def fetch_worker():
+        while True:
+            item = await url_queue.get()
+            if item is _DONE:
+                return
+            position, url = item
+            page = await fetch_page(url)
+            if page:
+                result.pages_fetched += 1
+                await page_queue.put((position, page))
+
+    async def extract_worker():
+        while True:
+            item = await page_queue.get()
+            if item is _DONE:
+                return
+            position, page = item
+            recipe = await extract_page(page)
+            if recipe:
+                extracted.append((position, recipe))
+                if stop_after and len(extracted) >= stop_after:
+                    enough.set()
+
+    producer = asyncio.create_task(produce())
+    fetchers = [asyncio.create_task(fetch_worker()) for _ in range(fetch_workers)]
+    extractors = [
+        asyncio.create_task(extract_worker()) for _ in range(max(1, extract_workers))
+    ]
+
+    async def drain():
+        await asyncio.gather(producer, *fetchers)
+        for _ in extractors:
+            await page_queue.put(_DONE)
+        await asyncio.gather(*extractors)
+
+    drained = asyncio.create_task(drain())
+    stopped = asyncio.create_task(enough.wait())
+    try:
+        await asyncio.wait(
+            {drained, stopped},
+            timeout=time_limit,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if drained.done():
+            drained.result()
+        result.timed_out = not (drained.done() or stopped.done())
+    finally:
+        for task in [producer] + fetchers + extractors + [drained, stopped]:
+            task.cancel()
+
+    result.recipes = [recipe for _, recipe in sorted(extracted, key=lambda e: e[0])]
+    return result
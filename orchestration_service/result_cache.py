@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class ResultCache(Generic[V]):
+    """LRU cache with a TTL and a stale-while-revalidate window.
+
+    An entry is fresh for ``ttl`` seconds, then stale for another
+    ``stale_ttl`` seconds during which it is still served (the caller is
+    expected to refresh it), after that it is dropped.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        stale_ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[V, float]]" = OrderedDict()
+        self._refreshing = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Tuple[Optional[V], bool]:
+        """Return ``(value, is_stale)``, value is None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        value, stored_at = entry
+        age = self.clock() - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return None, False
+        self._entries.move_to_end(key)
+        return value, age >= self.ttl
+
+    def set(self, key: Hashable, value: V) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (value, self.clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def start_refresh(self, key: Hashable) -> bool:
+        """Claim the refresh of a stale key, False if one is already running."""
+        if key in self._refreshing:
+            return False
+        self._refreshing.add(key)
+        return True
+
+    def end_refresh(self, key: Hashable) -> None:
+        self._refreshing.discard(key)
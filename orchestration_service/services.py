@@ -0,0 +1,340 @@
+import asyncio
+import importlib
+import json
+import os
+import sys
+from types import ModuleType
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+from circuit_breaker import DEADLINE_CUT, CircuitBreaker, CircuitOpenError
+from codec import JSON, decode_body, encode_body
+from deadline import DEADLINE_HEADER, Deadline
+from fastapi import HTTPException, Response
+
+# status the html fetcher answers for a page its site would not serve, the
+# service itself is fine
+SITE_FAILURE_STATUS = 424
+
+
+class ServiceReply(NamedTuple):
+    data: dict
+    # the Server-Timing header the service reported, if any
+    server_timing: Optional[str] = None
+
+
+class Services:
+    """The calls the orchestrator makes to the five downstream services.
+
+    Implementations raise ``httpx.HTTPError`` subclasses on failure, so callers
+    handle remote and in-process services alike: ``httpx.TimeoutException``
+    when the call ran out of time, ``CircuitOpenError`` while the service's
+    breaker is open and ``httpx.HTTPStatusError`` for error answers.
+    """
+
+    async def generate_queries(
+        self, ingredients: str, deadline: Deadline
+    ) -> ServiceReply:
+        raise NotImplementedError
+
+    async def stream_queries(
+        self, ingredients: str, deadline: Deadline
+    ) -> AsyncIterator[dict]:
+        """The planned queries one by one as ``{"query": ...}``, as the planner
+        finishes them, then ``{"requirements": ...}``.
+
+        Without a streaming planner they all arrive at once.
+        """
+        reply = await self.generate_queries(ingredients, deadline)
+        for query in reply.data.get("queries", []):
+            yield {"query": query}
+        if "requirements" in reply.data:
+            yield {"requirements": reply.data["requirements"]}
+
+    async def search_urls(
+        self, queries: List[str], num_results: int, deadline: Deadline
+    ) -> ServiceReply:
+        raise NotImplementedError
+
+    async def fetch_html(
+        self, url: str, by_reference: bool, deadline: Deadline
+    ) -> ServiceReply:
+        raise NotImplementedError
+
+    async def extract_recipe(
+        self, page: dict, deadline: Deadline, replica: int = 0
+    ) -> ServiceReply:
+        raise NotImplementedError
+
+    async def rank_recipes(self, payload: dict, deadline: Deadline) -> ServiceReply:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        return None
+
+
+class HttpServices(Services):
+    """Downstream services deployed as microservices, one client per service.
+
+    Request bodies are sent as ``media_type`` (JSON or msgpack), compressed
+    with ``encoding`` (gzip or zstd) when large, and the same media type is
+    asked for in the answers. Compressed answers are decoded by httpx.
+    """
+
+    def __init__(
+        self,
+        clients: Dict[str, httpx.AsyncClient],
+        extractor_urls: List[str],
+        media_type: str = JSON,
+        encoding: Optional[str] = None,
+    ):
+        self.clients = clients
+        self.extractor_urls = extractor_urls
+        self.media_type = media_type
+        self.encoding = encoding
+        self.accept = (
+            media_type if media_type == JSON else f"{media_type}, {JSON};q=0.5"
+        )
+
+    async def post(
+        self, service: str, path: str, body: dict, deadline: Deadline, cap: float
+    ) -> ServiceReply:
+        content, headers = encode_body(body, self.media_type, self.encoding)
+        response = await self.clients[service].post(
+            path,
+            content=content,
+            headers={**headers, **deadline.headers(), "Accept": self.accept},
+            timeout=deadline.timeout(cap),
+            extensions={DEADLINE_CUT: deadline.cuts_short(cap)},
+        )
+        response.raise_for_status()
+        return ServiceReply(
+            decode_body(response.content, response.headers.get("content-type")),
+            response.headers.get("Server-Timing"),
+        )
+
+    async def generate_queries(self, ingredients, deadline):
+        return await self.post(
+            "query_planner",
+            "/generate_queries",
+            {"ingredients": ingredients},
+            deadline,
+            90,
+        )
+
+    async def stream_queries(self, ingredients, deadline):
+        content, headers = encode_body(
+            {"ingredients": ingredients}, self.media_type, self.encoding
+        )
+        async with self.clients["query_planner"].stream(
+            "POST",
+            "/generate_queries/stream",
+            content=content,
+            headers={**headers, **deadline.headers()},
+            timeout=deadline.timeout(90),
+            extensions={DEADLINE_CUT: deadline.cuts_short(90)},
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if "error" in item:
+                    error = item["error"]
+                    raise httpx.HTTPStatusError(
+                        f"query_planner failed midway: {error['detail']}",
+                        request=response.request,
+                        response=httpx.Response(
+                            error["status_code"], json=error, request=response.request
+                        ),
+                    )
+                yield item
+
+    async def search_urls(self, queries, num_results, deadline):
+        return await self.post(
+            "search_service",
+            "/search_urls",
+            {"queries": queries, "num_results": num_results},
+            deadline,
+            60,
+        )
+
+    async def fetch_html(self, url, by_reference, deadline):
+        return await self.post(
+            "html_fetcher",
+            "/fetch_html",
+            {"urls": [url], "by_reference": by_reference},
+            deadline,
+            60,
+        )
+
+    async def extract_recipe(self, page, deadline, replica=0):
+        return await self.post(
+            "extractor_service",
+            f"{self.extractor_urls[replica]}/extract_recipe",
+            page,
+            deadline,
+            60,
+        )
+
+    async def rank_recipes(self, payload, deadline):
+        return await self.post("ranker_service", "/rank_recipes", payload, deadline, 60)
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
+
+
+# service directory, module and endpoint function of each in-process service
+LOCAL_ENDPOINTS = {
+    "query_planner": ("query_planner", "query_planner_app", "generate_queries"),
+    "search_service": ("search_service", "search_service_app", "search_urls"),
+    "html_fetcher": ("html_fetcher", "html_fetcher_app", "fetch_html"),
+    "extractor_service": (
+        "extractor_service",
+        "extractor_service_app",
+        "extract_recipe",
+    ),
+    "ranker_service": ("ranker_service", "ranker_service_app", "rank_recipes"),
+}
+
+
+def import_isolated(path: str, module: str) -> ModuleType:
+    """Import ``module`` from the service directory ``path`` together with the
+    sibling modules it imports, all from that directory.
+
+    Services import their siblings by plain name and several ship a module of
+    the same name (``codec``, ``constraints``, ``blob_store``). Whatever is
+    loaded under one of those names is set aside while the service imports,
+    and the service's own copies are kept as ``<directory>.<name>`` afterwards,
+    so no service ever runs with another one's copy.
+    """
+    siblings = {name[:-3] for name in os.listdir(path) if name.endswith(".py")}
+    shadowed = {name: sys.modules.pop(name) for name in siblings if name in sys.modules}
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module(module)
+    finally:
+        sys.path.remove(path)
+        directory = os.path.basename(path)
+        for name in siblings:
+            if name in sys.modules:
+                sys.modules[f"{directory}.{name}"] = sys.modules.pop(name)
+        sys.modules.update(shadowed)
+
+
+def load_service_functions(root: Optional[str] = None) -> Dict[str, Callable]:
+    """Import the endpoint functions of the services from their directories.
+
+    ``root`` holds the service directories, by default the parent of this one
+    as in the repository and the monolith image.
+    """
+    root = root or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    functions = {}
+    for service, (directory, module, function) in LOCAL_ENDPOINTS.items():
+        path = os.path.join(root, directory)
+        functions[service] = getattr(import_isolated(path, module), function)
+    return functions
+
+
+class LocalServices(Services):
+    """Downstream services called in this process, without HTTP.
+
+    Each endpoint function gets its request model built from the same body the
+    microservice would receive, and runs in a worker thread since the
+    services are synchronous. Results are passed on as Python objects and
+    never encoded. ``HTTPException`` answers and other errors are turned into
+    the ``httpx`` errors a remote call would raise, and the breakers keep
+    tracking the services' health. There is no blob store hop: pages are
+    always handed to the extractor by value.
+    """
+
+    def __init__(
+        self,
+        breakers: Dict[str, CircuitBreaker],
+        functions: Optional[Dict[str, Callable]] = None,
+    ):
+        self.breakers = breakers
+        self.functions = functions or load_service_functions()
+
+    async def call(
+        self, service: str, body: dict, deadline: Deadline, cap: float, **dump: Any
+    ) -> ServiceReply:
+        breaker = self.breakers[service]
+        if not breaker.allow():
+            raise CircuitOpenError(breaker)
+        function = self.functions[service]
+        request_model = function.__annotations__["req"]
+        http_response = Response()
+        cut = deadline.cuts_short(cap)
+        try:
+            result = await asyncio.wait_for(
+                asyncio.to_thread(
+                    function,
+                    request_model(**body),
+                    http_response,
+                    deadline.headers()[DEADLINE_HEADER],
+                ),
+                deadline.timeout(cap),
+            )
+        except asyncio.TimeoutError:
+            if cut:
+                breaker.release()
+            else:
+                breaker.record_failure()
+            raise httpx.TimeoutException(f"{service} timed out")
+        except HTTPException as err:
+            if err.status_code == 504 and cut:
+                breaker.release()
+            elif err.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise self.status_error(service, err)
+        except Exception as err:
+            breaker.record_failure()
+            raise self.status_error(service, HTTPException(500, str(err)))
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return ServiceReply(
+            result.model_dump(**dump), http_response.headers.get("Server-Timing")
+        )
+
+    @staticmethod
+    def status_error(service: str, err: HTTPException) -> httpx.HTTPError:
+        if err.status_code == 504:
+            return httpx.TimeoutException(f"{service}: {err.detail}")
+        request = httpx.Request("POST", f"local://{service}")
+        response = httpx.Response(
+            err.status_code, json={"detail": err.detail}, request=request
+        )
+        return httpx.HTTPStatusError(
+            f"{service} answered {err.status_code}: {err.detail}",
+            request=request,
+            response=response,
+        )
+
+    async def generate_queries(self, ingredients, deadline):
+        return await self.call(
+            "query_planner", {"ingredients": ingredients}, deadline, 90
+        )
+
+    async def search_urls(self, queries, num_results, deadline):
+        return await self.call(
+            "search_service",
+            {"queries": queries, "num_results": num_results},
+            deadline,
+            60,
+        )
+
+    async def fetch_html(self, url, by_reference, deadline):
+        return await self.call(
+            "html_fetcher", {"urls": [url]}, deadline, 60, exclude_none=True
+        )
+
+    async def extract_recipe(self, page, deadline, replica=0):
+        return await self.call("extractor_service", page, deadline, 60)
+
+    async def rank_recipes(self, payload, deadline):
+        return await self.call("ranker_service", payload, deadline, 60)
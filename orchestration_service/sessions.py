@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from typing import Iterable, List
+
+from constraints import Constraints, parse_constraints
+
+
+class Session:
+    """State of one interactive search: the request, its refinements and the
+    pool of candidate recipes found so far (by URL, at most ``max_pool``,
+    oldest dropped first)."""
+
+    def __init__(self, ingredients: str, top_k: int, max_pool: int = 100):
+        self.ingredients = ingredients
+        self.top_k = top_k
+        self.max_pool = max_pool
+        self.refinements: List[str] = []
+        self.constraints = parse_constraints(ingredients)
+        self.pool: "OrderedDict[str, dict]" = OrderedDict()
+
+    def query(self) -> str:
+        """The request with its refinements, as sent to a new search."""
+        return ", ".join([self.ingredients, *self.refinements])
+
+    def refine(self, text: str) -> Constraints:
+        self.refinements.append(text)
+        self.constraints = self.constraints.merge(parse_constraints(text))
+        return self.constraints
+
+    def add(self, recipes: Iterable[dict]) -> None:
+        for recipe in recipes:
+            self.pool[recipe["url"]] = recipe
+            self.pool.move_to_end(recipe["url"])
+        while len(self.pool) > self.max_pool:
+            self.pool.popitem(last=False)
+
+    def candidates(self) -> List[dict]:
+        return self.constraints.filter(self.pool.values())
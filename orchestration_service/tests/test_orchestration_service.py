@@ -1,138 +1,1251 @@
+import asyncio
 import json
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import httpx
 import pytest
+from fastapi import HTTPException, Request
 from fastapi.testclient import TestClient
+from pydantic import BaseModel, ConfigDict
 
-os.environ["QUERY_URL"] = "http://mockqueryurl"
-os.environ["SEARCH_URL"] = "http://mocksearchurl"
-os.environ["HTML_URL"] = "http://mockhtmlurl"
-os.environ["EXTRACT_URL"] = "http://mockextracturl"
-os.environ["RANK_URL"] = "http://mockrankurl"
+os.environ["QUERY_PLANNER_URL"] = "http://mockqueryurl"
+os.environ["SEARCH_SERVICE_URL"] = "http://mocksearchurl"
+os.environ["HTML_FETCHER_URL"] = "http://mockhtmlurl"
+os.environ["EXTRACTOR_SERVICE_URL"] = "http://mockextracturl"
+os.environ["RANKER_SERVICE_URL"] = "http://mockrankurl"
 
-from orchestration_service_app import app
+import orchestration_service_app
+from admission import (
+    ANONYMOUS,
+    BACKGROUND,
+    INTERACTIVE,
+    AdmissionController,
+    Overloaded,
+)
+from circuit_breaker import BreakerTransport, CircuitBreaker
+from codec import decode_body
+from constraints import from_requirements, parse_constraints
+from hedging import Hedger
+from jobs import Job, JobRunner, MemoryJobStore, SqliteJobStore
+from orchestration_service_app import app, merge_by_rank
+from page_memo import PageMemo
+from result_cache import ResultCache
+from services import LocalServices, import_isolated, load_service_functions
+from yield_stats import YieldTracker
 
-client = TestClient(app)
+recipe1 = {
+    "title": "Creamy mushroom pasta",
+    "ingredients": ["pasta", "mushrooms", "cream", "parmesan", "lemon"],
+    "steps": [
+        "Cook pasta",
+        "Chop mushrooms",
+        "Cook mushrooms",
+        "Add cream and pasta water",
+        "Add in pasta",
+        "Let reduce",
+        "Add lemon zest, salt, and pepper to taste",
+    ],
+    "tools": ["pot", "pan", "zester"],
+    "cook_time_mins": 35,
+    "source_url": "http:creamymushroompasta.com",
+}
+recipe2 = {
+    "title": "Mushroom risotto",
+    "ingredients": [
+        "arborio rice",
+        "mushrooms",
+        "white wine",
+        "parmesan",
+        "vegetable broth",
+        "onion",
+        "garlic",
+    ],
+    "steps": [
+        "Chop mushrooms, onion and garlic",
+        "Cook onion and garlic until fragrant",
+        "Add mushrooms",
+        "Add in rice",
+        "Slowly add in wine and broth",
+        "Add salt, and pepper to taste",
+    ],
+    "tools": ["pot", "pan", "laddle"],
+    "cook_time_mins": 45,
+    "source_url": "http:mushroomrisotto.com",
+}
+recipe3 = {
+    "title": "Cream of mushroom soup",
+    "ingredients": [
+        "mushrooms",
+        "dried thyme",
+        "butter",
+        "vegetable broth",
+        "onion",
+        "flour",
+        "sherry",
+    ],
+    "steps": [
+        "Simmer mushrooms, stock, onion, and thyme until vegetables are tender",
+        "Blend in a food processor",
+        "Melt butter and whisk in flour in pan",
+        "Add in mushroom mixture",
+        "Bring to a boil",
+        "Add in sherry, salt, and pepper to taste",
+    ],
+    "tools": ["large saucepan", "food processor", "whisk"],
+    "cook_time_mins": 50,
+    "source_url": "http:creamofmushroomsoup.com",
+}
+recipes_by_url = {"url1": recipe1, "url2": recipe2, "url3": recipe3}
 
 
-class MockResponse:
-    def __init__(self, data):
-        self._data = data
+class MockServices:
+    """Answers every downstream call of the orchestrator by host name."""
 
-    def raise_for_status(self):
-        pass
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.query_delay = 0.0
+        self.requirements = None
+        self.rank_bodies = []
+        self.page_delays = {}
+        self.once_delays = {}
+        self.calls = []
+        self.completed = []
+        self.fail_hosts = set()
+        # pages whose site the fetcher could not reach
+        self.site_failures = set()
+        self.budgets = []
+        self.extract_bodies = []
+        self.search_bodies = []
+        self.request_encodings = []
+        self.in_flight = {}
+        self.max_in_flight = {}
 
-    def json(self):
-        return self._data
+    async def stream_queries(self, queries):
+        for i, query in enumerate(queries):
+            if i:
+                await asyncio.sleep(self.query_delay)
+            yield (json.dumps({"query": query}) + "\n").encode()
+        if self.requirements is not None:
+            yield (json.dumps({"requirements": self.requirements}) + "\n").encode()
+        self.completed.append(("mockqueryurl", None))
 
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        body = decode_body(
+            request.content,
+            request.headers.get("content-type"),
+            request.headers.get("content-encoding"),
+        )
+        self.request_encodings.append(
+            (request.headers["content-type"], request.headers.get("content-encoding"))
+        )
+        self.calls.append(host)
+        self.budgets.append(float(request.headers["X-Request-Timeout"]))
+        if host in self.fail_hosts:
+            return httpx.Response(503, json={"detail": "unavailable"})
+        if host == "mockqueryurl" and request.url.path.endswith("/stream"):
+            return httpx.Response(
+                200,
+                content=self.stream_queries(["query1", "query2"]),
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+        if host == "mockqueryurl":
+            await asyncio.sleep(self.query_delay)
+            self.completed.append((host, None))
+            answer = {"queries": ["query1", "query2"]}
+            if self.requirements is not None:
+                answer["requirements"] = self.requirements
+            return httpx.Response(
+                200,
+                json=answer,
+                headers={"Server-Timing": "openai;dur=12.5"},
+            )
+        if host == "mocksearchurl":
+            self.search_bodies.append(body)
+            return httpx.Response(
+                200,
+                json={"results": [{"url": "url1"}, {"url": "url2"}, {"url": "url3"}]},
+            )
+        if host == "mockrankurl":
+            self.rank_bodies.append(body)
+            by_title = {r["title"]: r for r in body["recipes"]}
+            ranked = [recipe3["title"], recipe1["title"], recipe2["title"]]
+            return httpx.Response(
+                200, json={"recipes": [by_title[t] for t in ranked if t in by_title]}
+            )
 
-@pytest.fixture(autouse=True)
-def patch_request(monkeypatch):
-    import requests
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        self.max_in_flight[host] = max(
+            self.max_in_flight.get(host, 0), self.in_flight[host]
+        )
+        page_url = body["urls"][0] if host == "mockhtmlurl" else body.get("url")
+        delay = self.page_delays.get((host, page_url), self.delay)
+        if host.startswith("mockextracturl"):
+            # replicas share the once-only delays of the extractor
+            delay = self.once_delays.pop(page_url, delay)
+        await asyncio.sleep(delay)
+        self.in_flight[host] -= 1
+        self.completed.append((host, page_url))
+        if host == "mockhtmlurl" and page_url in self.site_failures:
+            return httpx.Response(424, json={"detail": f"Error fetching {page_url}"})
+        if host == "mockhtmlurl":
+            url = page_url
+            if body.get("by_reference"):
+                page = {"url": url, "html_ref": f"ref-{url}"}
+            else:
+                page = {"url": url, "html": f"<html>{url}</html>"}
+            return httpx.Response(200, json={"results": [page]})
+        if host.startswith("mockextracturl"):
+            self.extract_bodies.append(body)
+            return httpx.Response(200, json=recipes_by_url[body["url"]])
+        return httpx.Response(404)
 
-    mock_response_objects = []
 
-    # generate queries
-    mock_response_objects.append(MockResponse({"queries": ["query1", "query2"]}))
-    # search urls
-    mock_response_objects.append(
-        MockResponse({"results": [{"url": "url1"}, {"url": "url2"}, {"url": "url3"}]})
-    )
-    # fetch html
-    mock_response_objects.append(
-        MockResponse(
-            {
-                "results": [
-                    {"url": "url1", "html": "<html>html1</html>"},
-                    {"url": "url2", "html": "<html>html2</html>"},
-                    {"url": "url3", "html": "<html>html3</html>"},
-                ]
-            }
-        )
+@pytest.fixture
+def services(monkeypatch):
+    mock = MockServices()
+    build_clients = orchestration_service_app.build_clients
+    monkeypatch.setattr(
+        orchestration_service_app,
+        "build_clients",
+        lambda breakers: build_clients(
+            breakers, transport=httpx.MockTransport(mock.handler)
+        ),
     )
-    # extract recipe
-    recipe1 = {
-        "title": "Creamy mushroom pasta",
-        "ingredients": ["pasta", "mushrooms", "cream", "parmesan", "lemon"],
-        "steps": [
-            "Cook pasta",
-            "Chop mushrooms",
-            "Cook mushrooms",
-            "Add cream and pasta water",
-            "Add in pasta",
-            "Let reduce",
-            "Add lemon zest, salt, and pepper to taste",
-        ],
-        "tools": ["pot", "pan", "zester"],
-        "cook_time_mins": 35,
-        "source_url": "http:creamymushroompasta.com",
-    }
-    recipe2 = {
-        "title": "Mushroom risotto",
-        "ingredients": [
-            "arborio rice",
-            "mushrooms",
-            "white wine",
-            "parmesan",
-            "vegetable broth",
-            "onion",
-            "garlic",
-        ],
-        "steps": [
-            "Chop mushrooms, onion and garlic",
-            "Cook onion and garlic until fragrant",
-            "Add mushrooms",
-            "Add in rice",
-            "Slowly add in wine and broth",
-            "Add salt, and pepper to taste",
-        ],
-        "tools": ["pot", "pan", "laddle"],
-        "cook_time_mins": 45,
-        "source_url": "http:mushroomrisotto.com",
-    }
-    recipe3 = {
-        "title": "Cream of mushroom soup",
-        "ingredients": [
-            "mushrooms",
-            "dried thyme",
-            "butter",
-            "vegetable broth",
-            "onion",
-            "flour",
-            "sherry",
-        ],
-        "steps": [
-            "Simmer mushrooms, stock, onion, and thyme until vegetables are tender",
-            "Blend in a food processor",
-            "Melt butter and whisk in flour in pan",
-            "Add in mushroom mixture",
-            "Bring to a boil",
-            "Add in sherry, salt, and pepper to taste",
-        ],
-        "tools": ["large saucepan", "food processor", "whisk"],
-        "cook_time_mins": 50,
-        "source_url": "http:creamofmushroomsoup.com",
-    }
-    mock_response_objects.append(MockResponse(recipe1))
-    mock_response_objects.append(MockResponse(recipe2))
-    mock_response_objects.append(MockResponse(recipe3))
-    # rank recipes
-    mock_response_objects.append(MockResponse({"recipes": [recipe3, recipe1, recipe2]}))
+    return mock
 
-    def fake_post(url, json, timeout):
-        return mock_response_objects.pop(0)
 
-    monkeypatch.setattr(requests, "post", fake_post)
+@pytest.fixture
+def client(services):
+    with TestClient(app) as test_client:
+        yield test_client
 
 
-def test_find_recipes():
-    requirements = {"ingredients": ["mushrooms", "cream"], "top_k": 3}
+def test_find_recipes(client):
+    requirements = {"ingredients": "mushrooms cream", "top_k": 3}
 
     response_recipe = client.post("/find_recipes", json=requirements)
-    assert response_recipe.status_code == 200
+    assert response_recipe.status_code == 200, response_recipe.text
 
     recipes = response_recipe.json()
     assert len(recipes["results"]) == 3
     assert recipes["results"][0]["title"] == "Cream of mushroom soup"
     assert recipes["results"][1]["title"] == "Creamy mushroom pasta"
     assert recipes["results"][2]["title"] == "Mushroom risotto"
+
+
+def test_find_recipes_fans_out_page_calls(client, services):
+    services.delay = 0.05
+
+    response_recipe = client.post(
+        "/find_recipes", json={"ingredients": "mushrooms cream", "top_k": 3}
+    )
+    assert response_recipe.status_code == 200, response_recipe.text
+
+    assert services.calls.count("mockhtmlurl") == 3
+    assert services.calls.count("mockextracturl") == 3
+    assert services.max_in_flight["mockhtmlurl"] > 1
+
+
+def test_find_recipes_extracts_while_fetches_in_flight(client, services):
+    services.page_delays[("mockhtmlurl", "url3")] = 0.3
+
+    response_recipe = client.post(
+        "/find_recipes", json={"ingredients": "mushrooms cream", "top_k": 3}
+    )
+    assert response_recipe.status_code == 200, response_recipe.text
+
+    completed = services.completed
+    assert completed.index(("mockextracturl", "url1")) < completed.index(
+        ("mockhtmlurl", "url3")
+    )
+    titles = [r["title"] for r in response_recipe.json()["results"]]
+    assert titles == [recipe3["title"], recipe1["title"], recipe2["title"]]
+
+
+def parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_find_recipes_stream_reports_progress(client):
+    with client.stream(
+        "POST",
+        "/find_recipes/stream",
+        json={"ingredients": "mushrooms cream", "top_k": 3},
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(response.read().decode())
+
+    names = [name for name, _ in events]
+    assert names[:2] == ["queries", "urls"]
+    assert names.count("page_fetched") == 3
+    assert names.count("recipe") == 3
+    assert names[-1] == "results"
+    assert events[0][1] == {"queries": ["query1", "query2"]}
+    assert events[-1][1]["results"][0]["title"] == "Cream of mushroom soup"
+
+
+def test_find_recipes_stream_reports_errors(client, services):
+    services.fail_hosts.add("mockqueryurl")
+
+    response = client.post(
+        "/find_recipes/stream", json={"ingredients": "mushrooms cream"}
+    )
+
+    events = parse_sse(response.text)
+    assert [name for name, _ in events] == ["error"]
+    assert events[0][1]["status_code"] == 502
+
+
+def test_find_recipes_stops_once_enough_recipes_extracted(
+    client, services, monkeypatch
+):
+    monkeypatch.setattr(orchestration_service_app, "EARLY_STOP_FACTOR", 2)
+    services.page_delays[("mockhtmlurl", "url3")] = 5
+
+    response_recipe = client.post(
+        "/find_recipes", json={"ingredients": "mushrooms cream", "top_k": 1}
+    )
+    assert response_recipe.status_code == 200, response_recipe.text
+
+    assert ("mockhtmlurl", "url3") not in services.completed
+    assert services.calls.count("mockextracturl") == 2
+
+
+def test_find_recipes_serves_repeated_requests_from_cache(client, services):
+    first = client.post("/find_recipes", json={"ingredients": "Mushrooms  cream"})
+    calls = len(services.calls)
+    second = client.post("/find_recipes", json={"ingredients": "mushrooms cream"})
+
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.json() == first.json()
+    assert len(services.calls) == calls
+
+
+def test_find_recipes_refreshes_stale_results_in_background(client, services):
+    app.state.result_cache.ttl = 0
+    client.post("/find_recipes", json={"ingredients": "mushrooms cream"})
+    calls = len(services.calls)
+
+    stale = client.post("/find_recipes", json={"ingredients": "mushrooms cream"})
+    assert stale.status_code == 200
+    assert stale.headers["X-Cache"] == "STALE"
+
+    for _ in range(50):
+        if services.calls.count("mockrankurl") == 2:
+            break
+        time.sleep(0.02)
+    assert len(services.calls) == 2 * calls
+
+
+def test_result_cache_evicts_least_recently_used():
+    now = [0.0]
+    cache = ResultCache(max_entries=2, ttl=10, stale_ttl=5, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") == (None, False)
+    assert cache.get("a") == (1, False)
+    now[0] = 12
+    assert cache.get("a") == (1, True)
+    now[0] = 15
+    assert cache.get("a") == (None, False)
+
+
+def test_concurrent_identical_requests_share_one_pipeline(client, services):
+    services.delay = 0.1
+    payload = {"ingredients": "mushrooms cream", "top_k": 3}
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        responses = list(
+            pool.map(lambda _: client.post("/find_recipes", json=payload), range(5))
+        )
+
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.json() == responses[0].json() for r in responses)
+    assert services.calls.count("mockqueryurl") == 1
+    assert services.calls.count("mockextracturl") == 3
+
+
+def test_failing_listener_does_not_fail_the_shared_run(client, services):
+    services.delay = 0.05
+    received = []
+
+    async def gone(event, data):
+        raise RuntimeError("websocket closed")
+
+    async def listening(event, data):
+        received.append(event)
+
+    async def both():
+        req = orchestration_service_app.FindRequest(ingredients="shared")
+        return await asyncio.gather(
+            orchestration_service_app.coalesced_find_recipes(req, gone),
+            orchestration_service_app.coalesced_find_recipes(req, listening),
+        )
+
+    first, second = client.portal.call(both)
+    assert first == second
+    assert len(second.results) == 3
+    assert "recipe" in received
+    assert services.calls.count("mockqueryurl") == 1
+
+
+def test_find_recipes_propagates_deadline(client, services):
+    services.page_delays[("mockhtmlurl", "url3")] = 5
+
+    started = time.monotonic()
+    response_recipe = client.post(
+        "/find_recipes",
+        json={"ingredients": "mushrooms cream", "top_k": 3, "deadline_secs": 1},
+    )
+    assert time.monotonic() - started < 2
+
+    assert response_recipe.status_code == 200, response_recipe.text
+    assert len(response_recipe.json()["results"]) == 2
+    assert all(0 < budget <= 1 for budget in services.budgets)
+
+
+def test_deadline_is_capped_and_keys_shared_runs(client, services):
+    response = client.post(
+        "/find_recipes", json={"ingredients": "mushrooms", "deadline_secs": 10000}
+    )
+    assert response.status_code == 200, response.text
+    assert max(services.budgets) <= orchestration_service_app.REQUEST_DEADLINE_SECS
+
+    short = orchestration_service_app.FindRequest(ingredients="x", deadline_secs=2)
+    long = orchestration_service_app.FindRequest(ingredients="x", deadline_secs=60)
+    assert orchestration_service_app.cache_key(short) == (
+        orchestration_service_app.cache_key(long)
+    )
+    assert orchestration_service_app.flight_key(short) != (
+        orchestration_service_app.flight_key(long)
+    )
+
+
+def test_slow_extractor_calls_are_hedged(client, services):
+    app.state.services.extractor_urls = [
+        "http://mockextracturl",
+        "http://mockextracturl2",
+    ]
+    hedger = Hedger(replicas=2, budget_ratio=1, min_samples=1)
+    hedger.record(0.05)
+    app.state.extract_hedger = hedger
+    services.once_delays["url1"] = 5
+
+    started = time.monotonic()
+    response_recipe = client.post(
+        "/find_recipes", json={"ingredients": "mushrooms cream", "top_k": 3}
+    )
+    assert time.monotonic() - started < 2
+
+    assert response_recipe.status_code == 200, response_recipe.text
+    assert len(response_recipe.json()["results"]) == 3
+    assert hedger.hedges_sent == 1
+    assert {"mockextracturl", "mockextracturl2"} <= set(services.calls)
+
+
+def test_open_breaker_fails_fast_and_falls_back(client, services):
+    services.fail_hosts.add("mockextracturl")
+    for breaker in app.state.breakers.values():
+        breaker.failure_threshold = 3
+
+    first = client.post("/find_recipes", json={"ingredients": "mushrooms cream"})
+    assert first.status_code == 404
+    assert client.get("/health").json()["breakers"]["extractor_service"] == {
+        "state": "open",
+        "failures": 3,
+    }
+
+    extract_calls = services.calls.count("mockextracturl")
+    second = client.post("/find_recipes", json={"ingredients": "mushrooms pasta"})
+    assert second.status_code == 404
+    assert services.calls.count("mockextracturl") == extract_calls
+
+    services.fail_hosts = {"mockrankurl", "mocksearchurl"}
+    services.calls.clear()
+    app.state.breakers["extractor_service"].record_success()
+    app.state.breakers["ranker_service"].state = "open"
+    app.state.breakers["ranker_service"].opened_at = time.monotonic()
+    app.state.breakers["search_service"].state = "open"
+    app.state.breakers["search_service"].opened_at = time.monotonic()
+
+    unavailable = client.post("/find_recipes", json={"ingredients": "rice"})
+    assert unavailable.status_code == 503
+    assert int(unavailable.headers["Retry-After"]) > 0
+
+    app.state.breakers["search_service"].record_success()
+    services.fail_hosts = set()
+    ranked_locally = client.post(
+        "/find_recipes", json={"ingredients": "risotto", "top_k": 1}
+    )
+    assert ranked_locally.status_code == 200, ranked_locally.text
+    assert ranked_locally.json()["results"][0]["title"] == "Mushroom risotto"
+    assert "mockrankurl" not in services.calls
+    # fallback answers are not cached
+    again = client.post("/find_recipes", json={"ingredients": "risotto", "top_k": 1})
+    assert again.headers["X-Cache"] == "MISS"
+
+
+def test_site_failures_do_not_open_the_fetcher_breaker(client, services):
+    services.site_failures = {"url1", "url2"}
+    app.state.breakers["html_fetcher"].failure_threshold = 2
+
+    for ingredients in ("mushrooms", "mushrooms pasta", "mushrooms rice"):
+        res = client.post("/find_recipes", json={"ingredients": ingredients})
+        assert res.status_code == 200, res.text
+        assert res.json()["results"][0]["title"] == recipe3["title"]
+    assert app.state.breakers["html_fetcher"].state == "closed"
+
+
+def test_circuit_breaker_probes_when_half_open():
+    now = [0.0]
+    breaker = CircuitBreaker(
+        "svc", failure_threshold=2, reset_timeout=10, clock=lambda: now[0]
+    )
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 11
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 22
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_cancelled_probe_frees_its_slot():
+    now = [0.0]
+    breaker = CircuitBreaker(
+        "svc", failure_threshold=1, reset_timeout=10, clock=lambda: now[0]
+    )
+    breaker.record_failure()
+    now[0] = 11
+
+    async def hang(request):
+        await asyncio.sleep(10)
+
+    async def probe():
+        async with httpx.AsyncClient(
+            transport=BreakerTransport(httpx.MockTransport(hang), breaker)
+        ) as client:
+            task = asyncio.create_task(client.get("http://svc/"))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(probe())
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_timeouts_cut_short_by_the_deadline_are_not_failures():
+    breaker = CircuitBreaker("svc", failure_threshold=1)
+
+    async def slow(request):
+        raise httpx.ReadTimeout("slow", request=request)
+
+    async def call(cut):
+        async with httpx.AsyncClient(
+            transport=BreakerTransport(httpx.MockTransport(slow), breaker)
+        ) as client:
+            with pytest.raises(httpx.TimeoutException):
+                await client.get("http://svc/", extensions={"deadline_cut": cut})
+
+    asyncio.run(call(True))
+    assert breaker.state == "closed"
+    asyncio.run(call(False))
+    assert breaker.state == "open"
+
+
+def test_find_recipes_passes_html_by_reference(client, services, monkeypatch):
+    monkeypatch.setattr(orchestration_service_app, "PASS_HTML_BY_REFERENCE", True)
+
+    response_recipe = client.post(
+        "/find_recipes", json={"ingredients": "mushrooms cream", "top_k": 3}
+    )
+    assert response_recipe.status_code == 200, response_recipe.text
+
+    assert sorted(body["html_ref"] for body in services.extract_bodies) == [
+        "ref-url1",
+        "ref-url2",
+        "ref-url3",
+    ]
+    assert not any("html" in body for body in services.extract_bodies)
+
+
+def test_find_recipes_batch_shares_pages_across_requests(client, services):
+    batch = {
+        "requests": [
+            {"ingredients": "mushrooms cream"},
+            {"ingredients": "mushroom risotto"},
+            {"ingredients": "Mushrooms cream"},
+        ]
+    }
+
+    response = client.post("/find_recipes/batch", json=batch)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+    assert all(len(line["results"]) == 3 for line in lines)
+    assert services.calls.count("mockqueryurl") == 2
+    assert services.calls.count("mockhtmlurl") == 3
+    assert services.calls.count("mockextracturl") == 3
+
+
+def test_page_memo_gives_shared_pages_their_own_deadline():
+    budgets = []
+
+    async def fetch(deadline):
+        budgets.append(deadline.remaining())
+        return {"url": "url1"}
+
+    async def twice():
+        memo = PageMemo(
+            fetch_concurrency=2, extract_concurrency=2, page_deadline_secs=30
+        )
+        return [await memo.fetch("url1", fetch), await memo.fetch("url1", fetch)]
+
+    assert asyncio.run(twice()) == [{"url": "url1"}, {"url": "url1"}]
+    assert len(budgets) == 1 and 29 < budgets[0] <= 30
+
+
+def test_page_memo_drops_html_once_extraction_started():
+    async def fetch(deadline):
+        return {"url": "url1", "html": "<html>url1</html>"}
+
+    async def extract(deadline):
+        return recipe1
+
+    async def pages():
+        memo = PageMemo(
+            fetch_concurrency=2, extract_concurrency=2, page_deadline_secs=30
+        )
+        first = await memo.fetch("url1", fetch)
+        recipe = await memo.extract("url1", extract)
+        later = await memo.fetch("url1", fetch)
+        return first, recipe, later, await memo.extract("url1", extract)
+
+    first, recipe, later, again = asyncio.run(pages())
+    assert first["html"] == "<html>url1</html>"
+    assert recipe == again == recipe1
+    assert later == {"url": "url1"}
+
+
+def test_find_recipes_batch_reports_errors_per_request(client, services):
+    services.fail_hosts.add("mocksearchurl")
+
+    response = client.post(
+        "/find_recipes/batch", json={"requests": [{"ingredients": "tofu"}]}
+    )
+
+    [line] = [json.loads(line) for line in response.text.splitlines()]
+    assert line["index"] == 0
+    assert line["error"]["status_code"] == 502
+
+
+def test_jobs_run_in_background_and_can_be_polled(client, services):
+    services.delay = 0.05
+
+    submitted = client.post("/jobs", json={"ingredients": "mushrooms cream"})
+    assert submitted.status_code == 202, submitted.text
+    job_id = submitted.json()["job_id"]
+    assert submitted.headers["Location"] == f"/jobs/{job_id}"
+
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] == "done":
+            break
+        time.sleep(0.02)
+
+    assert job["status"] == "done"
+    assert len(job["partial"]) == 3
+    assert job["result"]["results"][0]["title"] == "Cream of mushroom soup"
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_jobs_are_rejected_when_queue_is_full(client):
+    app.state.jobs = JobRunner(
+        MemoryJobStore(), None, workers=1, queue_size=1, retention=60
+    )
+
+    assert client.post("/jobs", json={"ingredients": "tofu"}).status_code == 202
+    rejected = client.post("/jobs", json={"ingredients": "rice"})
+    assert rejected.status_code == 503
+    assert "Retry-After" in rejected.headers
+
+
+def test_sqlite_job_store_fails_interrupted_jobs(tmp_path):
+    store = SqliteJobStore(str(tmp_path / "jobs.sqlite3"))
+    job = Job(job_id="job1", created_at=1, updated_at=1, request={"ingredients": "x"})
+    store.save(job)
+
+    runner = JobRunner(store, None, workers=1, queue_size=1, retention=60)
+
+    async def restart():
+        runner.start()
+        await runner.stop()
+
+    asyncio.run(restart())
+
+    assert store.get("job1").status == "failed"
+    assert store.unfinished() == []
+    store.prune(finished_before=time.time())
+    assert store.get("job1") is None
+
+
+def test_find_recipes_reports_stage_timings(services, client):
+    res = client.post("/find_recipes", json={"ingredients": "timed", "top_k": 2})
+    assert res.status_code == 200, res.text
+    assert "timings" not in res.json()
+
+    header = res.headers["Server-Timing"]
+    for stage in ("plan", "plan.openai", "search", "fetch", "extract", "rank", "total"):
+        assert f"{stage};" in header
+    assert "plan.openai;dur=12.5" in header
+
+    res = client.post(
+        "/find_recipes",
+        json={"ingredients": "timed again", "top_k": 2, "include_timings": True},
+    )
+    timings = res.json()["timings"]
+    assert timings["plan.openai"] == 12.5
+    assert "fetch:url1" in timings and "extract:url1" in timings
+    assert timings["total"] >= timings["plan"]
+
+
+class AnyBody(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+def local_service_functions(budgets: list) -> dict:
+    def generate_queries(req: AnyBody, http_response, x_request_timeout=None):
+        budgets.append(x_request_timeout)
+        http_response.headers["Server-Timing"] = "openai;dur=7.0"
+        return AnyBody(queries=["query1", "query2"])
+
+    def search_urls(req: AnyBody, http_response, x_request_timeout=None):
+        return AnyBody(results=[{"url": url} for url in recipes_by_url])
+
+    def fetch_html(req: AnyBody, http_response, x_request_timeout=None):
+        return AnyBody(results=[{"url": req.urls[0], "html": "<html></html>"}])
+
+    def extract_recipe(req: AnyBody, http_response, x_request_timeout=None):
+        if req.url == "url2":
+            raise HTTPException(status_code=502, detail="OpenAI API error")
+        return AnyBody(**recipes_by_url[req.url])
+
+    def rank_recipes(req: AnyBody, http_response, x_request_timeout=None):
+        return AnyBody(recipes=list(reversed(req.recipes)))
+
+    return {
+        "query_planner": generate_queries,
+        "search_service": search_urls,
+        "html_fetcher": fetch_html,
+        "extractor_service": extract_recipe,
+        "ranker_service": rank_recipes,
+    }
+
+
+def test_find_recipes_in_process(monkeypatch):
+    budgets = []
+    monkeypatch.setattr(
+        orchestration_service_app,
+        "build_services",
+        lambda breakers: LocalServices(breakers, local_service_functions(budgets)),
+    )
+    with TestClient(app) as client:
+        res = client.post("/find_recipes", json={"ingredients": "local", "top_k": 3})
+
+    assert res.status_code == 200, res.text
+    titles = [recipe["title"] for recipe in res.json()["results"]]
+    assert titles == [recipe3["title"], recipe1["title"]]
+    assert "plan.openai;dur=7.0" in res.headers["Server-Timing"]
+    assert 0 < float(budgets[0]) <= 90
+
+
+def test_load_service_functions():
+    os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+    functions = load_service_functions()
+    assert {service: fn.__name__ for service, fn in functions.items()} == {
+        "query_planner": "generate_queries",
+        "search_service": "search_urls",
+        "html_fetcher": "fetch_html",
+        "extractor_service": "extract_recipe",
+        "ranker_service": "rank_recipes",
+    }
+    # every service got its own copy of the shared modules
+    root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    planner_constraints = sys.modules["query_planner.constraints"]
+    assert planner_constraints.__file__ == os.path.join(
+        root, "query_planner", "constraints.py"
+    )
+    assert sys.modules["constraints"].__file__ == os.path.join(
+        root, "orchestration_service", "constraints.py"
+    )
+
+
+def test_services_load_their_own_copy_of_shared_modules(tmp_path):
+    for service in ("first", "second"):
+        (tmp_path / service).mkdir()
+        (tmp_path / service / "codec.py").write_text(f"NAME = {service!r}\n")
+        (tmp_path / service / "app.py").write_text("from codec import NAME\n")
+
+    own_codec = sys.modules["codec"]
+    first = import_isolated(str(tmp_path / "first"), "app")
+    second = import_isolated(str(tmp_path / "second"), "app")
+    assert (first.NAME, second.NAME) == ("first", "second")
+    assert sys.modules["codec"] is own_codec
+    for service in ("first", "second"):
+        sys.modules.pop(f"{service}.app")
+        sys.modules.pop(f"{service}.codec")
+
+
+def test_admission_queue_is_bounded():
+    async def scenario():
+        admission = AdmissionController(max_active=1, max_queued=1, queue_timeout=1)
+        await admission.acquire()
+        waiting = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        assert admission.snapshot()["queued"] == 1
+
+        with pytest.raises(Overloaded):
+            await admission.acquire()
+
+        admission.release()
+        await waiting
+        assert admission.snapshot()["active"] == 1
+        assert admission.snapshot()["queued"] == 0
+
+        admission.queue_timeout = 0.01
+        with pytest.raises(Overloaded):
+            await admission.acquire()
+        assert admission.snapshot()["rejected"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_find_recipes_sheds_load_when_queue_is_full(client, services):
+    services.delay = 0.2
+    app.state.admission = AdmissionController(
+        max_active=1, max_queued=0, queue_timeout=1
+    )
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        responses = list(
+            pool.map(
+                lambda i: client.post(
+                    "/find_recipes", json={"ingredients": f"load {i}"}
+                ),
+                range(2),
+            )
+        )
+
+    statuses = sorted(r.status_code for r in responses)
+    assert statuses == [200, 503]
+    shed = next(r for r in responses if r.status_code == 503)
+    assert int(shed.headers["Retry-After"]) >= 1
+    admission = client.get("/health").json()["admission"]
+    assert admission["rejected"] == 1
+    assert admission["queued"] == 0
+
+
+def test_yield_tracker_orders_domains_and_sizes_fan_out():
+    tracker = YieldTracker(initial_rate=0.5, min_rate=0.25)
+    assert tracker.urls_needed(target=6, cap=24) == 12
+
+    for _ in range(10):
+        tracker.record("https://www.listicles.example/top-10", False)
+        tracker.record("https://recipes.example/risotto", True)
+    urls = [
+        "https://listicles.example/best",
+        "https://new.example/soup",
+        "https://recipes.example/pasta",
+    ]
+    assert tracker.order(urls) == [
+        "https://recipes.example/pasta",
+        "https://new.example/soup",
+        "https://listicles.example/best",
+    ]
+
+    for _ in range(100):
+        tracker.record("https://recipes.example/stew", True)
+    assert tracker.urls_needed(target=6, cap=24) < 12
+    for _ in range(400):
+        tracker.record("https://paywall.example/x", False)
+    assert tracker.urls_needed(target=6, cap=24) == 24
+
+
+def test_search_fan_out_follows_observed_yield(client, services):
+    res = client.post("/find_recipes", json={"ingredients": "first", "top_k": 3})
+    assert res.status_code == 200, res.text
+    assert services.search_bodies[0]["num_results"] == 12
+
+    tracker = app.state.yield_tracker
+    for _ in range(50):
+        tracker.record("https://recipes.example/stew", True)
+    client.post("/find_recipes", json={"ingredients": "second", "top_k": 3})
+    assert services.search_bodies[1]["num_results"] < 12
+    assert client.get("/health").json()["yield"]["domains"] == 4
+
+
+def test_yield_counts_only_what_happened_to_the_page(client, services):
+    services.site_failures = {"url1"}
+    res = client.post("/find_recipes", json={"ingredients": "first", "top_k": 3})
+    assert res.status_code == 200, res.text
+    observed = {"url1": (0, 1), "url2": (1, 1), "url3": (1, 1)}
+    assert dict(app.state.yield_tracker._domains) == observed
+
+    # an extractor outage and an open fetcher breaker are not the sites' fault
+    services.site_failures = set()
+    services.fail_hosts = {"mockextracturl"}
+    res = client.post("/find_recipes", json={"ingredients": "second", "top_k": 3})
+    assert res.status_code == 404
+    services.fail_hosts = set()
+    app.state.breakers["html_fetcher"].state = "open"
+    app.state.breakers["html_fetcher"].opened_at = time.monotonic()
+    res = client.post("/find_recipes", json={"ingredients": "third", "top_k": 3})
+    assert res.status_code == 404
+    assert dict(app.state.yield_tracker._domains) == observed
+
+
+def test_services_exchange_msgpack_and_zstd(monkeypatch, services):
+    monkeypatch.setattr(orchestration_service_app, "SERVICE_MEDIA_TYPE", "msgpack")
+    monkeypatch.setattr(orchestration_service_app, "SERVICE_CONTENT_ENCODING", "zstd")
+    with TestClient(app) as client:
+        res = client.post("/find_recipes", json={"ingredients": "binary", "top_k": 3})
+
+    assert res.status_code == 200, res.text
+    assert len(res.json()["results"]) == 3
+    media_types = {media_type for media_type, _ in services.request_encodings}
+    assert media_types == {"application/msgpack"}
+    # the ranker gets every extracted recipe, large enough to be compressed
+    assert ("application/msgpack", "zstd") in services.request_encodings
+
+
+def test_parse_constraints():
+    dairy_free = parse_constraints("now make it dairy-free")
+    assert not dairy_free.allows(recipe1)
+    assert not dairy_free.allows(recipe3)
+    assert dairy_free.allows({"ingredients": ["butternut squash"]})
+
+    quick = parse_constraints("no more than 40 minutes, without eggs")
+    assert quick.max_cook_mins == 40
+    assert quick.allows(recipe1) and not quick.allows(recipe2)
+    assert not quick.allows({"ingredients": ["3 eggs"], "cook_time_mins": 10})
+
+    assert parse_constraints("vegetarian").allows(recipe2)
+    assert not parse_constraints("vegan").allows(recipe2)
+
+
+def receive_results(websocket) -> dict:
+    while True:
+        message = websocket.receive_json()
+        if message["type"] in ("results", "error"):
+            return message
+
+
+def test_session_refinements_reuse_the_candidate_pool(client, services):
+    with client.websocket_connect("/sessions") as websocket:
+        websocket.send_json({"type": "refine", "text": "no butter"})
+        assert receive_results(websocket)["status_code"] == 400
+
+        websocket.send_json(
+            {"type": "search", "ingredients": "mushrooms cream", "top_k": 2}
+        )
+        first = receive_results(websocket)
+        assert first["source"] == "search"
+        assert first["pool_size"] == 3
+        calls = len(services.calls)
+
+        websocket.send_json({"type": "refine", "text": "without butter"})
+        refined = receive_results(websocket)
+        assert refined["source"] == "pool"
+        assert {r["title"] for r in refined["results"]} == {
+            recipe1["title"],
+            recipe2["title"],
+        }
+        assert len(services.calls) == calls
+
+        websocket.send_json({"type": "refine", "text": "under 40 minutes"})
+        dry = receive_results(websocket)
+        assert dry["source"] == "search"
+        assert [r["title"] for r in dry["results"]] == [recipe1["title"]]
+        assert services.calls.count("mockqueryurl") == 2
+
+
+def test_admission_shares_slots_by_weight_and_client_quota():
+    async def scenario():
+        admission = AdmissionController(
+            max_active=1,
+            max_queued=10,
+            queue_timeout=1,
+            weights={INTERACTIVE: 3, BACKGROUND: 1},
+        )
+        granted = []
+        await admission.acquire("holder")
+
+        async def wait(client, priority):
+            await admission.acquire(client, priority)
+            granted.append((client, priority))
+
+        waiters = [
+            asyncio.ensure_future(wait("backfill", BACKGROUND)) for _ in range(3)
+        ] + [
+            asyncio.ensure_future(wait(client, INTERACTIVE))
+            for client in ("alice", "alice", "alice", "bob")
+        ]
+        await asyncio.sleep(0)
+        admission.release("holder")
+        for served in range(len(waiters)):
+            while len(granted) <= served:
+                await asyncio.sleep(0)
+            client, priority = granted[-1]
+            admission.release(client, priority)
+        await asyncio.gather(*waiters)
+        return granted
+
+    granted = asyncio.run(scenario())
+    # three interactive runs per background one, alternating between clients
+    assert granted[:5] == [
+        ("alice", INTERACTIVE),
+        ("bob", INTERACTIVE),
+        ("alice", INTERACTIVE),
+        ("backfill", BACKGROUND),
+        ("alice", INTERACTIVE),
+    ]
+
+    async def quotas():
+        admission = AdmissionController(
+            max_active=3,
+            max_queued=10,
+            queue_timeout=0.05,
+            client_max_active=1,
+            class_max_active={BACKGROUND: 1},
+        )
+        await admission.acquire("alice")
+        await admission.acquire("backfill", BACKGROUND)
+        with pytest.raises(Overloaded):
+            await admission.acquire("alice")
+        with pytest.raises(Overloaded):
+            await admission.acquire("other-backfill", BACKGROUND)
+        await admission.acquire("bob")
+        return admission.snapshot()
+
+    snapshot = asyncio.run(quotas())
+    assert snapshot["classes"][INTERACTIVE]["active"] == 2
+    assert snapshot["classes"][BACKGROUND]["active"] == 1
+
+
+def test_client_quota_applies_per_client_id(client, services):
+    services.delay = 0.2
+    app.state.admission = AdmissionController(
+        max_active=4, max_queued=0, queue_timeout=1, client_max_active=1
+    )
+
+    def post(args):
+        client_id, ingredients = args
+        return client.post(
+            "/find_recipes",
+            json={"ingredients": ingredients},
+            headers={"X-Client-Id": client_id},
+        )
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        responses = list(
+            pool.map(post, [("batchy", "a"), ("batchy", "b"), ("human", "c")])
+        )
+
+    assert responses[2].status_code == 200
+    assert sorted(r.status_code for r in responses[:2]) == [200, 503]
+
+
+def test_callers_without_client_id_are_told_apart_by_address(monkeypatch):
+    def caller(headers, peer=("10.0.0.1", 80)):
+        request = Request({"type": "http", "headers": headers, "client": peer})
+        return orchestration_service_app.identify(request).client_id
+
+    assert caller([]) == "10.0.0.1"
+    assert caller([], peer=None) == ANONYMOUS
+    assert caller([(b"x-client-id", b"app")]) == "app"
+    monkeypatch.setattr(
+        orchestration_service_app, "CLIENT_ADDRESS_HEADER", "X-Forwarded-For"
+    )
+    assert caller([(b"x-forwarded-for", b"203.0.113.7, 10.0.0.1")]) == "203.0.113.7"
+    assert caller([]) == "10.0.0.1"
+
+    admission = AdmissionController(
+        max_active=4, max_queued=4, queue_timeout=0.1, client_max_active=1
+    )
+
+    async def fill():
+        await admission.acquire(ANONYMOUS)
+        with pytest.raises(Overloaded):
+            await admission.acquire(ANONYMOUS)
+
+    asyncio.run(fill())
+    assert admission.active == 1
+
+
+def test_merge_by_rank():
+    assert merge_by_rank(["a", "b", "c"], ["d", "a"]) == ["a", "d", "b", "c"]
+    assert merge_by_rank([], ["x"]) == ["x"]
+
+
+def test_speculative_search_fetches_before_queries_are_planned(
+    client, services, monkeypatch
+):
+    monkeypatch.setattr(orchestration_service_app, "SPECULATIVE_SEARCH", True)
+    services.query_delay = 0.3
+
+    res = client.post(
+        "/find_recipes/stream", json={"ingredients": "mushrooms cream", "top_k": 3}
+    )
+    assert res.status_code == 200, res.text
+
+    queries = [body["queries"] for body in services.search_bodies]
+    assert ["mushrooms cream recipe"] in queries
+    assert ["query1", "query2"] in queries
+    completed = services.completed
+    assert completed.index(("mockhtmlurl", "url1")) < completed.index(
+        ("mockqueryurl", None)
+    )
+    # the planned search repeats the speculative URLs, each is fetched once
+    assert services.calls.count("mockhtmlurl") == 3
+    events = parse_sse(res.text)
+    url_events = [data["urls"] for event, data in events if event == "urls"]
+    assert url_events[-1] == ["url1", "url2", "url3"]
+    assert events[-1][0] == "results"
+    assert len(events[-1][1]["results"]) == 3
+
+
+def test_speculative_search_survives_planner_failure(client, services, monkeypatch):
+    monkeypatch.setattr(orchestration_service_app, "SPECULATIVE_SEARCH", True)
+    services.fail_hosts.add("mockqueryurl")
+
+    res = client.post("/find_recipes", json={"ingredients": "mushrooms", "top_k": 3})
+    assert res.status_code == 200, res.text
+    assert len(res.json()["results"]) == 3
+    assert [body["queries"] for body in services.search_bodies] == [
+        ["mushrooms recipe"]
+    ]
+
+
+def test_streamed_queries_are_searched_as_they_arrive(client, services, monkeypatch):
+    monkeypatch.setattr(orchestration_service_app, "STREAM_QUERIES", True)
+    services.query_delay = 0.3
+
+    res = client.post(
+        "/find_recipes/stream", json={"ingredients": "mushrooms cream", "top_k": 3}
+    )
+    assert res.status_code == 200, res.text
+
+    # one search per query, the first one fetched from before the second query
+    assert [body["queries"] for body in services.search_bodies] == [
+        ["query1"],
+        ["query2"],
+    ]
+    completed = services.completed
+    assert completed.index(("mockhtmlurl", "url1")) < completed.index(
+        ("mockqueryurl", None)
+    )
+    events = parse_sse(res.text)
+    queries = [data["queries"] for event, data in events if event == "queries"]
+    assert queries == [["query1"], ["query1", "query2"]]
+    assert services.calls.count("mockhtmlurl") == 3
+    assert events[-1][0] == "results"
+
+
+def test_streamed_requirements_filter_recipes(client, services, monkeypatch):
+    monkeypatch.setattr(orchestration_service_app, "STREAM_QUERIES", True)
+    services.requirements = {"max_cook_mins": 40}
+
+    res = client.post("/find_recipes", json={"ingredients": "mushrooms", "top_k": 3})
+    assert res.status_code == 200, res.text
+    assert [r["title"] for r in res.json()["results"]] == [recipe1["title"]]
+
+
+def test_streamed_queries_report_planner_errors(client, services, monkeypatch):
+    monkeypatch.setattr(orchestration_service_app, "STREAM_QUERIES", True)
+    services.fail_hosts.add("mockqueryurl")
+
+    res = client.post("/find_recipes", json={"ingredients": "mushrooms", "top_k": 3})
+    assert res.status_code == 502
+    assert "QueryPlanner" in res.json()["detail"]
+
+
+def test_from_requirements_builds_local_filters():
+    constraints = from_requirements(
+        {
+            "required_ingredients": ["pasta"],
+            "excluded_ingredients": ["Mushrooms", "nut"],
+            "diets": ["dairy-free", "vegetarian", "high-protein"],
+            "max_cook_mins": 40,
+        }
+    )
+    assert "mushroom" in constraints.excluded
+    assert {"almond", "butter", "cream"} <= constraints.excluded
+    assert constraints.diets == {"vegetarian"}
+    assert constraints.allows(
+        {"ingredients": ["gluten-free pasta", "vegan butter"], "cook_time_mins": 20}
+    )
+    assert not constraints.allows({"ingredients": ["pasta"], "cook_time_mins": 45})
+    assert not from_requirements({})
+
+
+def test_plant_milks_and_nut_butters_are_not_dairy():
+    dairy_free = parse_constraints("dairy-free curry")
+    for line in ["1 can coconut milk", "2 tbsp peanut butter", "butter beans"]:
+        assert dairy_free.allows({"ingredients": [line]}), line
+    assert not dairy_free.allows({"ingredients": ["whole milk"]})
+    assert parse_constraints("vegan").allows({"ingredients": ["almond milk"]})
+    assert not parse_constraints("nut-free").allows({"ingredients": ["almond milk"]})
+
+
+def test_planner_requirements_filter_recipes_before_ranking(client, services):
+    services.requirements = {
+        "required_ingredients": ["mushrooms"],
+        "excluded_ingredients": ["cream"],
+        "diets": [],
+        "max_cook_mins": 48,
+    }
+
+    res = client.post(
+        "/find_recipes", json={"ingredients": "mushrooms, no cream", "top_k": 3}
+    )
+    assert res.status_code == 200, res.text
+    assert [r["title"] for r in res.json()["results"]] == [recipe2["title"]]
+    ranked = services.rank_bodies[0]
+    assert [r["title"] for r in ranked["recipes"]] == [recipe2["title"]]
+    assert ranked["requirements"]["excluded_ingredients"] == ["cream"]
+    assert ranked["requirements"]["ingredients"] == "mushrooms, no cream"
+
+
+def test_no_recipe_matching_the_requirements_is_a_404(client, services):
+    services.requirements = {"excluded_ingredients": ["mushroom"]}
+
+    res = client.post("/find_recipes", json={"ingredients": "anything", "top_k": 3})
+    assert res.status_code == 404
+    assert res.json()["detail"] == "No recipes match the requirements"
+    assert not services.rank_bodies
@@ -0,0 +1,52 @@
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# one metric of a Server-Timing header, e.g. ``openai;dur=812.3``
+_METRIC = re.compile(r'^\s*([\w.-]+)(?:;desc="?([^";]*)"?)?(?:;dur=([\d.]+))?')
+
+
+class StageTimer:
+    """Collects stage durations (ms) of one request for the Server-Timing header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.entries: List[Tuple[str, Optional[str], float]] = []
+
+    def add(self, name: str, duration_ms: float, desc: Optional[str] = None) -> None:
+        self.entries.append((name, desc, duration_ms))
+
+    @contextmanager
+    def measure(self, name: str, desc: Optional[str] = None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000, desc)
+
+    def add_downstream(
+        self, stage: str, server_timing: Optional[str], desc: Optional[str] = None
+    ) -> None:
+        """Record the Server-Timing metrics of a downstream response as stage.*"""
+        for metric in (server_timing or "").split(","):
+            match = _METRIC.match(metric)
+            if match and match.group(3):
+                self.add(f"{stage}.{match.group(1)}", float(match.group(3)), desc)
+
+    def total(self) -> None:
+        self.add("total", (time.perf_counter() - self.started) * 1000)
+
+    def header(self) -> str:
+        metrics = []
+        for name, desc, duration_ms in self.entries:
+            desc_part = f';desc="{desc}"' if desc else ""
+            metrics.append(f"{name}{desc_part};dur={duration_ms:.1f}")
+        return ", ".join(metrics)
+
+    def as_dict(self) -> Dict[str, float]:
+        """Durations keyed ``name`` or ``name:desc`` (e.g. ``fetch:<url>``)."""
+        return {
+            f"{name}:{desc}" if desc else name: round(duration_ms, 1)
+            for name, desc, duration_ms in self.entries
+        }
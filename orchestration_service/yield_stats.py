@@ -0,0 +1,78 @@
+import math
+from collections import OrderedDict
+from typing import List, Tuple
+from urllib.parse import urlsplit
+
+
+def domain_of(url: str) -> str:
+    host = urlsplit(url).hostname or url
+    return host[4:] if host.startswith("www.") else host
+
+
+class YieldTracker:
+    """Observed share of URLs that end up as an extracted recipe.
+
+    Every fetched (or failed) URL counts as an attempt of its domain, and as a
+    success when a recipe was extracted from it. A domain's rate is smoothed
+    towards the global rate with ``prior_weight`` pseudo attempts, so one
+    unlucky page does not bury a domain. Counts are halved once they pass
+    ``max_attempts`` so the rates follow sites that change, and at most
+    ``max_domains`` domains are kept (least recently seen dropped first).
+    """
+
+    def __init__(
+        self,
+        initial_rate: float = 0.5,
+        min_rate: float = 0.25,
+        prior_weight: float = 4,
+        max_attempts: float = 200,
+        max_domains: int = 10000,
+    ):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.prior_weight = prior_weight
+        self.max_attempts = max_attempts
+        self.max_domains = max_domains
+        # (successes, attempts) overall and per domain
+        self.overall: Tuple[float, float] = (0.0, 0.0)
+        self._domains: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def _add(self, counts: Tuple[float, float], success: bool) -> Tuple[float, float]:
+        successes, attempts = counts
+        successes, attempts = successes + success, attempts + 1
+        if attempts > self.max_attempts:
+            successes, attempts = successes / 2, attempts / 2
+        return successes, attempts
+
+    def record(self, url: str, success: bool) -> None:
+        self.overall = self._add(self.overall, success)
+        domain = domain_of(url)
+        self._domains[domain] = self._add(self._domains.get(domain, (0, 0)), success)
+        self._domains.move_to_end(domain)
+        while len(self._domains) > self.max_domains:
+            self._domains.popitem(last=False)
+
+    def global_rate(self) -> float:
+        successes, attempts = self.overall
+        prior = self.prior_weight
+        return (successes + prior * self.initial_rate) / (attempts + prior)
+
+    def rate(self, url: str) -> float:
+        successes, attempts = self._domains.get(domain_of(url), (0, 0))
+        prior = self.prior_weight
+        return (successes + prior * self.global_rate()) / (attempts + prior)
+
+    def urls_needed(self, target: int, cap: int) -> int:
+        """URLs to request for ``target`` recipes at the global yield."""
+        rate = max(self.global_rate(), self.min_rate)
+        return max(min(math.ceil(target / rate), cap), target)
+
+    def order(self, urls: List[str]) -> List[str]:
+        """Most promising domains first, search order among equals."""
+        return sorted(urls, key=self.rate, reverse=True)
+
+    def snapshot(self) -> dict:
+        return {
+            "global_rate": round(self.global_rate(), 3),
+            "domains": len(self._domains),
+        }
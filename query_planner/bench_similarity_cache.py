@@ -0,0 +1,63 @@
+"""Lookup latency of the similarity cache when full.
+
+    python bench_similarity_cache.py --entries 1000000
+
+Fills a cache with random ingredient lists from the planner's lexicon, then
+times lookups of fresh ones and prints the latency percentiles in ms. A hit
+is a fresh list with the same ingredients as a cached one.
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from heuristic_planner import INGREDIENTS, MODIFIERS
+from similarity_cache import SimilarityCache
+
+
+def random_input(rng: random.Random, words) -> str:
+    picked = rng.sample(words, rng.randint(2, 4))
+    if rng.random() < 0.3:
+        picked.append(rng.choice(sorted(MODIFIERS)))
+    return ", ".join(picked)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = sorted(INGREDIENTS)
+    cache = SimilarityCache(args.entries, args.threshold, ttl=3600, dim=args.dim)
+    started = time.perf_counter()
+    for i in range(args.entries):
+        cache.add(random_input(rng, words), {"queries": [str(i)]})
+    fill_secs = time.perf_counter() - started
+
+    latencies = []
+    hits = 0
+    for _ in range(args.lookups):
+        text = random_input(rng, words)
+        started = time.perf_counter()
+        hits += cache.get(text) is not None
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    matrix_mb = cache._vectors.nbytes / 2**20
+    print(
+        f"entries={len(cache)} dim={args.dim} matrix={matrix_mb:.0f}MB "
+        f"fill={fill_secs:.1f}s"
+    )
+    print(
+        f"lookup p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms "
+        f"hits={hits}/{args.lookups}"
+    )
+
+
+if __name__ == "__main__":
+    main()
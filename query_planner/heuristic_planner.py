@@ -0,0 +1,188 @@
+import re
+from dataclasses import dataclass, field
+from typing import FrozenSet, List, Optional
+
+from constraints import singular, take_phrases, take_requirements
+
+# words that describe the dish rather than what goes in it
+MODIFIERS: FrozenSet[str] = frozenset(
+    [
+        "breakfast",
+        "brunch",
+        "lunch",
+        "dinner",
+        "supper",
+        "dessert",
+        "snack",
+        "appetizer",
+        "side",
+        "quick",
+        "easy",
+        "simple",
+        "healthy",
+        "cheap",
+        "budget",
+        "weeknight",
+        "spicy",
+        "comfort",
+        "one-pot",
+        "one pot",
+        "sheet-pan",
+        "sheet pan",
+        "slow cooker",
+        "instant pot",
+        "air fryer",
+    ]
+)
+
+# common ingredients; an item counts as an ingredient if it has one of these
+INGREDIENTS: FrozenSet[str] = frozenset("""
+    almond anchovy apple apricot artichoke arugula asparagus aubergine avocado
+    bacon banana barley basil bean beef beet bell berry blueberry bread
+    broccoli broth brussels butter buttermilk cabbage capers carrot cashew
+    cauliflower celery chard cheddar cheese cherry chicken chickpea chili
+    chilli chive chocolate chorizo cilantro cinnamon clam coconut cod
+    coriander corn couscous crab cranberry cream cucumber cumin curry date dill
+    duck egg eggplant fennel feta fig fish flour garlic ginger gnocchi goat
+    grape grapefruit halloumi ham hazelnut herb honey kale leek lemon lentil
+    lettuce lime lobster mango maple milk mince mint miso mozzarella mushroom
+    mussel mustard noodle nut oat oil olive onion orange oregano paneer
+    pancetta paprika parmesan parsley parsnip pasta pea peach peanut pear
+    pecan pepper pesto pine pineapple pistachio plum pork potato prawn
+    prosciutto pumpkin quinoa radish raisin raspberry rice ricotta rosemary
+    saffron sage salmon sausage scallion scallop seitan sesame shallot shrimp
+    spaghetti spinach squash steak stock strawberry sugar sweet tahini thyme
+    tofu tomato tortilla trout tuna turkey turmeric veal vinegar walnut
+    watermelon wine yogurt yoghurt zucchini
+    """.split())
+
+# words that mark a sentence rather than a list of ingredients
+FREE_FORM_WORDS: FrozenSet[str] = frozenset("""
+    i i'm im me my we our you your something anything what which how can could
+    would should want need like love hate make cook give find show please
+    help that this these those but because if not don't dont isn't no without
+    for from have has got leftover leftovers kids guests party
+    """.split())
+
+# an item of more words than this is a phrase, not an ingredient
+MAX_ITEM_WORDS = 3
+
+_SEPARATORS = re.compile(r"\s*(?:[,;/+&\n]|\band\b|\bwith\b|\bplus\b)\s*")
+_MODIFIERS = [(word, word) for word in sorted(MODIFIERS, key=len, reverse=True)]
+
+
+@dataclass
+class ParsedInput:
+    """An input understood without the LLM: its ingredients in input order,
+    diet tags, dish modifiers like "dinner" or "quick", the ingredients to
+    leave out and the cook time limit."""
+
+    ingredients: List[str] = field(default_factory=list)
+    diets: List[str] = field(default_factory=list)
+    modifiers: List[str] = field(default_factory=list)
+    excluded: List[str] = field(default_factory=list)
+    max_cook_mins: Optional[int] = None
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().replace("’", "'").split())
+
+
+def _take_constraints(text: str, parsed: ParsedInput) -> str:
+    """Move the diets, exclusions and cook time limit of ``text`` into
+    ``parsed`` (see ``constraints.take_requirements``)."""
+    text, requirements = take_requirements(text)
+    parsed.diets = requirements["diets"]
+    parsed.excluded = requirements["excluded_ingredients"]
+    parsed.max_cook_mins = requirements["max_cook_mins"]
+    return text
+
+
+def parse_input(text: str) -> Optional[ParsedInput]:
+    """The ingredient list in ``text``, or None when it does not read as one.
+
+    Diet keywords (``constraints.DIET_KEYWORDS``), exclusions, time limits
+    and modifiers are taken out first, the rest is split at commas, "and",
+    "with" and the like. Every remaining item must be a short phrase without
+    sentence words (``FREE_FORM_WORDS``), and at least half of them must name
+    a known ingredient.
+    """
+    parsed = ParsedInput()
+    text = _take_constraints(_normalize(text), parsed)
+    text = take_phrases(text, _MODIFIERS, parsed.modifiers)
+    text = re.sub(r"\b(?:recipes?|ideas?|meals?|dish(?:es)?)\b", " ", text)
+    known = 0
+    for item in _SEPARATORS.split(text):
+        item = item.strip(" .!-")
+        if not item:
+            continue
+        words = item.split()
+        if len(words) > MAX_ITEM_WORDS or not re.fullmatch(r"[a-z' -]+", item):
+            return None
+        if any(word in FREE_FORM_WORDS for word in words):
+            return None
+        # "couscous" or "capers" must not lose their "s"
+        if any(word in INGREDIENTS or singular(word) in INGREDIENTS for word in words):
+            known += 1
+        if item not in parsed.ingredients:
+            parsed.ingredients.append(item)
+    if not parsed.ingredients or known * 2 < len(parsed.ingredients):
+        return None
+    return parsed
+
+
+def template_queries(parsed: ParsedInput) -> List[str]:
+    """Three search queries of the parsed input, most specific first."""
+    prefix = " ".join(parsed.diets + parsed.modifiers)
+    ingredients = parsed.ingredients
+    everything = " ".join(ingredients)
+    if len(ingredients) == 1:
+        pair = ingredients[0]
+    else:
+        pair = f"{ingredients[0]} and {ingredients[1]}"
+    with_list = ", ".join(ingredients[1:])
+    limits = ""
+    if parsed.excluded:
+        limits += " without " + " or ".join(parsed.excluded)
+    if parsed.max_cook_mins:
+        limits += f" under {parsed.max_cook_mins} minutes"
+    queries = [
+        f"{prefix} {everything} recipe{limits}",
+        (
+            f"{prefix} {ingredients[0]} with {with_list} recipe"
+            if with_list
+            else f"{prefix} {pair} recipe ideas"
+        ),
+        f"best {prefix} {pair} recipes",
+    ]
+    unique: List[str] = []
+    for query in queries:
+        query = " ".join(query.split())
+        if query not in unique:
+            unique.append(query)
+    return unique
+
+
+def plan_locally(text: str) -> Optional[List[str]]:
+    """Search queries of a plain ingredient list, None for free-form input."""
+    parsed = parse_input(text)
+    return template_queries(parsed) if parsed else None
+
+
+def requirements_of(parsed: ParsedInput) -> dict:
+    return {
+        "required_ingredients": list(parsed.ingredients),
+        "excluded_ingredients": list(parsed.excluded),
+        "diets": list(parsed.diets),
+        "max_cook_mins": parsed.max_cook_mins,
+    }
+
+
+def parse_requirements(text: str) -> dict:
+    """Structured requirements of any input: those of the ingredient list it
+    is, or else only the diets, exclusions and time limit it states."""
+    parsed = parse_input(text)
+    if parsed is None:
+        parsed = ParsedInput()
+        _take_constraints(_normalize(text), parsed)
+    return requirements_of(parsed)
@@ -0,0 +1,146 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from constraints import singular, take_requirements
+
+# words that make the order of the words around them matter
+_NEGATION = re.compile(
+    r"\b(?:no|not|never|without|or|except|avoid|skip|hate|allergic|don'?t|doesn'?t)\b"
+)
+
+
+def _words(text: str) -> list:
+    return [singular(word) for word in re.sub(r"[^\w\s]", " ", text).split()]
+
+
+def canonical_key(text: str) -> str:
+    """``text`` lower-cased, without punctuation and with its words
+    de-pluralized, so "Lemons, Garlic" and "garlic lemon" match.
+
+    The diets, exclusions and time limit it states (``take_requirements``)
+    are parts of the key of their own, so "chicken, garlic, no dairy" and
+    "dairy, garlic, no chicken" do not match. The other words are sorted and
+    de-duplicated, unless a negation the parser did not understand is left
+    among them: then they keep their order.
+    """
+    text = " ".join(text.lower().replace("’", "'").split())
+    rest, requirements = take_requirements(text)
+    words = _words(rest)
+    if not _NEGATION.search(rest):
+        words = sorted(set(words))
+    parts = [" ".join(words)]
+    parts += [f"diet {diet}" for diet in sorted(requirements["diets"])]
+    excluded = {
+        " ".join(_words(phrase)) for phrase in requirements["excluded_ingredients"]
+    }
+    parts += [f"no {phrase}" for phrase in sorted(excluded)]
+    if requirements["max_cook_mins"]:
+        parts.append(f"under {requirements['max_cook_mins']} min")
+    return " | ".join(parts)
+
+
+class QueryCache:
+    """Planner answers by canonical input, fresh for ``ttl`` seconds.
+
+    Answers without queries are not stored: the model may fail differently
+    the next time.
+
+    The ``max_entries`` most recently used answers are kept in memory. With
+    a ``path``, every answer is also written to SQLite, so the cache survives
+    restarts and is shared by the workers of one host; a memory miss that
+    hits on disk is promoted back into memory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        path: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS queries ("
+                "key TEXT PRIMARY KEY, stored_at REAL, data TEXT)"
+            )
+            self._db.execute(
+                "DELETE FROM queries WHERE stored_at < ?", (self.clock() - ttl,)
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, value: dict, stored_at: float) -> None:
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, text: str) -> Optional[dict]:
+        key = canonical_key(text)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT stored_at, data FROM queries WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[0] < self.ttl:
+                    value = json.loads(row[1])
+                    if self.max_entries > 0:
+                        self._remember(key, value, row[0])
+                    self.disk_hits += 1
+                    return value
+                if row:
+                    self._db.execute("DELETE FROM queries WHERE key = ?", (key,))
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def set(self, text: str, value: dict) -> None:
+        if not value.get("queries"):
+            return
+        key = canonical_key(text)
+        stored_at = self.clock()
+        with self._lock:
+            if self.max_entries > 0:
+                self._remember(key, value, stored_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+                    (key, stored_at, json.dumps(value)),
+                )
+                self._db.commit()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(
+                    (self.memory_hits + self.disk_hits) / lookups if lookups else 0, 3
+                ),
+            }
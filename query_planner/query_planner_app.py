@@ -1,42 +1,204 @@
 import json
 import os
-from typing import List
+import time
+from typing import Iterator, List, Optional
 
 import openai
-from fastapi import FastAPI, HTTPException
+from codec import CodecRoute, NegotiatedResponse
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from heuristic_planner import (
+    parse_input,
+    parse_requirements,
+    requirements_of,
+    template_queries,
+)
 from pydantic import BaseModel
+from query_cache import QueryCache
+from similarity_cache import SimilarityCache
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 if not openai.api_key:
     raise RuntimeError("missing open ai key")
 
+# OpenAI timeout when the caller sends no X-Request-Timeout budget
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+# "llm" asks the model for every input, "heuristic" builds the queries of plain
+# ingredient lists locally and only asks the model about free-form input
+PLANNER_MODE = os.getenv("PLANNER_MODE", "llm")
+if PLANNER_MODE not in ("llm", "heuristic"):
+    raise RuntimeError(f"Unknown PLANNER_MODE {PLANNER_MODE}")
+# answers are cached by canonical input for QUERY_CACHE_TTL seconds, the
+# QUERY_CACHE_SIZE most recent in memory and all of them in SQLite at
+# QUERY_CACHE_PATH (empty for memory only)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "604800"))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+# model answers are also reused for inputs worded differently whose embedding
+# has a cosine similarity of at least SIMILARITY_THRESHOLD, for the
+# SIMILARITY_CACHE_SIZE most recently used inputs (0 disables it)
+SIMILARITY_CACHE_SIZE = int(os.getenv("SIMILARITY_CACHE_SIZE", "0"))
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))
+
+
+NDJSON = "application/x-ndjson"
+# marks the line of the model's answer with the structured requirements
+REQUIREMENTS_PREFIX = "REQUIREMENTS:"
+
 
 class QueryRequest(BaseModel):
     ingredients: str
 
 
+class Requirements(BaseModel):
+    required_ingredients: List[str] = []
+    excluded_ingredients: List[str] = []
+    diets: List[str] = []
+    max_cook_mins: Optional[int] = None
+
+
 class QueryResponse(BaseModel):
     queries: List[str]
+    # "heuristic" or "llm"
+    planner: str = "llm"
+    requirements: Requirements = Requirements()
 
 
-app = FastAPI(title="Query Planner Service")
+app = FastAPI(title="Query Planner Service", default_response_class=NegotiatedResponse)
+# msgpack and compressed bodies besides plain JSON
+app.router.route_class = CodecRoute
 
+query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_PATH or None)
+similarity_cache = SimilarityCache(
+    SIMILARITY_CACHE_SIZE, SIMILARITY_THRESHOLD, QUERY_CACHE_TTL
+)
 
-@app.post("/generate_queries", response_model=QueryResponse)
-def generate_queries(req: QueryRequest):
-    prompt = (
-        f"I have the following ingredients and/or recipe requirements for my meal: {req.ingredients}."
+
+def time_budget(x_request_timeout: Optional[str], default: float) -> float:
+    """Seconds left of the caller's X-Request-Timeout budget, capped at default."""
+    if x_request_timeout is None:
+        return default
+    try:
+        budget = float(x_request_timeout)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail=f"invalid X-Request-Timeout {x_request_timeout}"
+        )
+    if budget <= 0:
+        raise HTTPException(status_code=504, detail="request deadline exceeded")
+    return min(budget, default)
+
+
+def cut_by_budget(err: Exception, timeout: float, default: float) -> bool:
+    """Whether ``err`` is the timeout of a call that the caller's budget gave less
+    than its ``default`` timeout, answered with 504 instead of 502."""
+    return isinstance(err, openai.APITimeoutError) and timeout < default
+
+
+@app.get("/health")
+def health():
+    return {
+        "cache": query_cache.snapshot(),
+        "similarity_cache": similarity_cache.snapshot(),
+    }
+
+
+def answer_without_model(
+    req: QueryRequest, http_response: Response
+) -> Optional[QueryResponse]:
+    """The queries from the caches or the heuristic planner, if they have them."""
+    started = time.perf_counter()
+    cached = query_cache.get(req.ingredients)
+    if cached is not None:
+        cache_ms = (time.perf_counter() - started) * 1000
+        http_response.headers["Server-Timing"] = f"cache;desc=hit;dur={cache_ms:.1f}"
+        return QueryResponse(**cached)
+
+    if PLANNER_MODE == "heuristic":
+        started = time.perf_counter()
+        parsed = parse_input(req.ingredients)
+        if parsed:
+            response = QueryResponse(
+                queries=template_queries(parsed),
+                planner="heuristic",
+                requirements=requirements_of(parsed),
+            )
+            heuristic_ms = (time.perf_counter() - started) * 1000
+            http_response.headers["Server-Timing"] = f"heuristic;dur={heuristic_ms:.1f}"
+            query_cache.set(req.ingredients, response.model_dump())
+            return response
+
+    if SIMILARITY_CACHE_SIZE:
+        started = time.perf_counter()
+        similar = similarity_cache.get(req.ingredients)
+        if similar is not None:
+            value, similarity = similar
+            similar_ms = (time.perf_counter() - started) * 1000
+            http_response.headers["Server-Timing"] = (
+                f'similar;desc="{similarity:.2f}";dur={similar_ms:.1f}'
+            )
+            # not copied into the exact cache, a wrong match would stay there
+            return QueryResponse(**value)
+    return None
+
+
+def remember(req: QueryRequest, response: QueryResponse) -> None:
+    if not response.queries:
+        return
+    query_cache.set(req.ingredients, response.model_dump())
+    similarity_cache.add(req.ingredients, response.model_dump())
+
+
+def prompt_for(ingredients: str) -> str:
+    return (
+        f"I have the following ingredients and/or recipe requirements for my meal: {ingredients}."
         "Generate 3 concise web search queries that would find recipes matching these constraints, each on its own line"
+        f"\nThen add one last line starting with {REQUIREMENTS_PREFIX} followed by a JSON object with"
+        ' the keys "required_ingredients", "excluded_ingredients" and "diets" (lists of lower-case strings)'
+        ' and "max_cook_mins" (an integer, or null when no time limit is stated)'
     )
 
+
+def read_line(line: str) -> Optional[dict]:
+    """A line of the model's answer as ``{"query": ...}`` or
+    ``{"requirements": ...}``, None for blank or unreadable lines."""
+    line = line.strip()
+    if not line:
+        return None
+    if line.upper().startswith(REQUIREMENTS_PREFIX):
+        try:
+            requirements = Requirements(**json.loads(line[len(REQUIREMENTS_PREFIX) :]))
+        except (ValueError, TypeError):
+            return None
+        return {"requirements": requirements.model_dump()}
+    return {"query": line}
+
+
+@app.post("/generate_queries", response_model=QueryResponse)
+def generate_queries(
+    req: QueryRequest,
+    http_response: Response,
+    x_request_timeout: Optional[str] = Header(default=None),
+):
+    answer = answer_without_model(req, http_response)
+    if answer is not None:
+        return answer
+
+    timeout = time_budget(x_request_timeout, OPENAI_TIMEOUT)
+    started = time.perf_counter()
     try:
         response = openai.responses.create(
             model="gpt-4.1-mini",
             instructions="You are a recipe search query generator",
-            input=prompt,
+            input=prompt_for(req.ingredients),
+            timeout=timeout,
         )
     except openai.OpenAIError as e:
+        if cut_by_budget(e, timeout, OPENAI_TIMEOUT):
+            raise HTTPException(status_code=504, detail=f"OpenAI timed out: {e}")
         raise HTTPException(status_code=502, detail=f"OpenAI error: {e}")
+    openai_ms = (time.perf_counter() - started) * 1000
+    http_response.headers["Server-Timing"] = f"openai;dur={openai_ms:.1f}"
 
     if isinstance(response, dict):
         data = response
@@ -64,6 +226,77 @@ def generate_queries(req: QueryRequest):
             detail=f"no content in first output message: {json.dumps(first_message)}",
         )
     text = "".join(chunk.get("text", "") for chunk in content).strip()
-    queries = [line.strip() for line in text.splitlines() if line.strip()]
+    items = [item for item in map(read_line, text.splitlines()) if item]
+    queries = [item["query"] for item in items if "query" in item]
+    requirements = [item["requirements"] for item in items if "requirements" in item]
+
+    response = QueryResponse(
+        queries=queries,
+        # the local parser stands in when the model left them out
+        requirements=(requirements or [parse_requirements(req.ingredients)])[-1],
+    )
+    remember(req, response)
+    return response
+
+
+@app.post("/generate_queries/stream")
+def generate_queries_stream(
+    req: QueryRequest, x_request_timeout: Optional[str] = Header(default=None)
+):
+    """The queries as NDJSON, one ``{"query": ...}`` line each as soon as the
+    model has finished it, then a ``{"requirements": ...}`` line, or an
+    ``{"error": {"status_code", "detail"}}`` line when the model fails midway."""
+    answer = answer_without_model(req, Response())
+    if answer is not None:
+        items = [{"query": query} for query in answer.queries]
+        items.append({"requirements": answer.requirements.model_dump()})
+        lines = (json.dumps(item) + "\n" for item in items)
+        return StreamingResponse(lines, media_type=NDJSON)
+
+    timeout = time_budget(x_request_timeout, OPENAI_TIMEOUT)
+    try:
+        stream = openai.responses.create(
+            model="gpt-4.1-mini",
+            instructions="You are a recipe search query generator",
+            input=prompt_for(req.ingredients),
+            timeout=timeout,
+            stream=True,
+        )
+    except openai.OpenAIError as e:
+        if cut_by_budget(e, timeout, OPENAI_TIMEOUT):
+            raise HTTPException(status_code=504, detail=f"OpenAI timed out: {e}")
+        raise HTTPException(status_code=502, detail=f"OpenAI error: {e}")
+
+    def answer_lines() -> Iterator[str]:
+        pending = ""
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                *finished, pending = (pending + event.delta).split("\n")
+                yield from finished
+            elif event.type in ("error", "response.failed"):
+                raise RuntimeError(f"stream failed: {event}")
+        yield pending
+
+    def query_lines() -> Iterator[str]:
+        queries: List[str] = []
+        requirements = None
+        try:
+            for item in filter(None, map(read_line, answer_lines())):
+                if "query" in item:
+                    queries.append(item["query"])
+                else:
+                    requirements = item["requirements"]
+                yield json.dumps(item) + "\n"
+        except Exception as e:
+            if cut_by_budget(e, timeout, OPENAI_TIMEOUT):
+                error = {"status_code": 504, "detail": f"OpenAI timed out: {e}"}
+            else:
+                error = {"status_code": 502, "detail": f"OpenAI error: {e}"}
+            yield json.dumps({"error": error}) + "\n"
+            return
+        if requirements is None:
+            requirements = parse_requirements(req.ingredients)
+            yield json.dumps({"requirements": requirements}) + "\n"
+        remember(req, QueryResponse(queries=queries, requirements=requirements))
 
-    return QueryResponse(queries=queries)
+    return StreamingResponse(query_lines(), media_type=NDJSON)
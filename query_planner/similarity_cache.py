@@ -0,0 +1,169 @@
+import re
+import threading
+import time
+import zlib
+from typing import Callable, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+from constraints import singular, take_requirements
+from heuristic_planner import INGREDIENTS
+
+# "chicken without garlic" reads much like "garlic chicken", so inputs with
+# one of these words are not matched by similarity
+NEGATIONS = frozenset(["no", "not", "without", "free", "except", "avoid", "skip"])
+
+
+def char_ngrams(text: str, n: int = 3) -> List[str]:
+    """Character n-grams of the de-pluralized words of ``text``, each word
+    padded with spaces so its first and last letters count too."""
+    grams = []
+    for word in re.sub(r"[^\w\s]", " ", text.lower()).split():
+        padded = f" {singular(word)} "
+        grams.extend(padded[i : i + n] for i in range(max(len(padded) - n + 1, 1)))
+    return grams
+
+
+# what two inputs must have in common to share an answer
+Signature = Tuple[FrozenSet[str], FrozenSet[str], Tuple[str, ...]]
+
+
+def _ingredient(word: str) -> Optional[str]:
+    """The lexicon ingredient ``word`` names, like "lemon" for "lemony"."""
+    for form in (word, singular(word), word[:-1], word[:-2]):
+        if len(form) >= 3 and form in INGREDIENTS:
+            return form
+    return None
+
+
+def signature(text: str) -> Signature:
+    """The known ingredients, diets and numbers of ``text``.
+
+    Embeddings cannot tell "pork, shallot, seitan" from "shallot, seitan",
+    or 30 minutes from 60, so a similar input only counts as the same when
+    its signature is equal too.
+    """
+    text = text.lower()
+    words = re.sub(r"[^\w\s]", " ", text).split()
+    ingredients = frozenset(filter(None, map(_ingredient, words)))
+    diets = frozenset(take_requirements(" ".join(text.split()))[1]["diets"])
+    numbers = tuple(sorted(re.findall(r"\d+(?:\.\d+)?", text)))
+    return ingredients, diets, numbers
+
+
+def embed(text: str, dim: int = 128, n: int = 3) -> np.ndarray:
+    """Unit vector of the hashed character n-grams of ``text``.
+
+    Every n-gram adds +1 or -1 (by one bit of its hash) to one of ``dim``
+    buckets, so colliding n-grams tend to cancel out instead of adding up.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for gram in char_ngrams(text, n):
+        digest = zlib.crc32(gram.encode())
+        vector[digest % dim] += 1.0 if digest & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SimilarityCache:
+    """Planner answers reused for inputs that are worded differently.
+
+    Inputs are embedded locally (``embed``) into the rows of one matrix. A
+    lookup is a single matrix-vector product, and returns the answer of the
+    most similar input whose cosine similarity is at least ``threshold``,
+    that has the same ``signature`` and is younger than ``ttl`` seconds. The matrix grows up to ``max_entries``
+    rows; after that a new answer replaces the least recently used one.
+    Inputs with a negation (``NEGATIONS``) are neither matched nor stored.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        threshold: float,
+        ttl: float,
+        dim: int = 128,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.dim = dim
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = 0
+        self._tick = 0
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._stored_at = np.zeros(0)
+        # tick of the last use of every row, the smallest is evicted first
+        self._used = np.zeros(0, dtype=np.int64)
+        self._values: List[Optional[dict]] = []
+        self._signatures: List[Optional[Signature]] = []
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self) -> None:
+        capacity = min(max(len(self._values) * 2, 1024), self.max_entries)
+        extra = capacity - len(self._values)
+        self._vectors = np.vstack(
+            [self._vectors, np.zeros((extra, self.dim), dtype=np.float32)]
+        )
+        self._stored_at = np.concatenate([self._stored_at, np.zeros(extra)])
+        self._used = np.concatenate([self._used, np.zeros(extra, dtype=np.int64)])
+        self._values.extend([None] * extra)
+        self._signatures.extend([None] * extra)
+
+    @staticmethod
+    def matchable(text: str) -> bool:
+        return NEGATIONS.isdisjoint(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+    def get(self, text: str) -> Optional[Tuple[dict, float]]:
+        """The answer of the most similar cached input and the similarity."""
+        if not self.matchable(text):
+            return None
+        vector = embed(text, self.dim)
+        wanted = signature(text)
+        with self._lock:
+            self._tick += 1
+            if self._size:
+                scores = self._vectors[: self._size] @ vector
+                expired = self._stored_at[: self._size] <= self.clock() - self.ttl
+                scores[expired] = -1.0
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for row in candidates[np.argsort(-scores[candidates])]:
+                    if self._signatures[row] == wanted:
+                        self._used[row] = self._tick
+                        self.hits += 1
+                        return self._values[row], float(scores[row])
+            self.misses += 1
+            return None
+
+    def add(self, text: str, value: dict) -> None:
+        if self.max_entries <= 0 or not self.matchable(text):
+            return
+        vector = embed(text, self.dim)
+        text_signature = signature(text)
+        with self._lock:
+            self._tick += 1
+            if self._size < self.max_entries:
+                if self._size == len(self._values):
+                    self._grow()
+                row = self._size
+                self._size += 1
+            else:
+                row = int(np.argmin(self._used))
+            self._vectors[row] = vector
+            self._stored_at[row] = self.clock()
+            self._used[row] = self._tick
+            self._values[row] = value
+            self._signatures[row] = text_signature
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "entries": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "threshold": self.threshold,
+            }
@@ -1,11 +1,19 @@
+import json
 import os
+from types import SimpleNamespace
 
+import httpx
+import openai
 import pytest
 from fastapi.testclient import TestClient
 
 os.environ["OPENAI_API_KEY"] = "sk-test"
 
+import query_planner_app
+from heuristic_planner import parse_input, parse_requirements, plan_locally
+from query_cache import QueryCache, canonical_key
 from query_planner_app import app
+from similarity_cache import SimilarityCache, embed
 
 mock_content = "mushroom risotto\ncreamy mushroom pasta"
 
@@ -31,6 +39,14 @@ def patch_openai(monkeypatch):
     monkeypatch.setattr(openai.responses, "create", mock_create)
 
 
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(query_planner_app, "query_cache", QueryCache(100, 3600))
+    monkeypatch.setattr(
+        query_planner_app, "similarity_cache", SimilarityCache(100, 0.8, 3600)
+    )
+
+
 client = TestClient(app)
 
 
@@ -44,3 +60,301 @@ def test_generate_queries():
     assert isinstance(data["queries"], list)
 
     assert data["queries"] == ["mushroom risotto", "creamy mushroom pasta"]
+    assert res.headers["Server-Timing"].startswith("openai;dur=")
+
+
+def test_parse_input_reads_ingredient_lists():
+    parsed = parse_input("Gluten-free high protein chicken, rice and broccoli dinner")
+    assert parsed.ingredients == ["chicken", "rice", "broccoli"]
+    assert parsed.diets == ["gluten-free", "high-protein"]
+    assert parsed.modifiers == ["dinner"]
+    assert plan_locally("mushrooms, pasta, lemon, parmesan") == [
+        "mushrooms pasta lemon parmesan recipe",
+        "mushrooms with pasta, lemon, parmesan recipe",
+        "best mushrooms and pasta recipes",
+    ]
+
+
+def test_parse_input_knows_ingredients_ending_in_s():
+    parsed = parse_input("asparagus, couscous, capers and brussels sprouts")
+    assert parsed is not None
+    assert parsed.ingredients == ["asparagus", "couscous", "capers", "brussels sprouts"]
+
+
+def test_parse_input_rejects_free_form_text():
+    assert parse_input("something cozy for my in-laws who hate onions") is None
+    assert parse_input("what can I make with eggs?") is None
+    # no known ingredient
+    assert parse_input("pad thai") is None
+
+
+def test_heuristic_mode_skips_the_llm(monkeypatch):
+    monkeypatch.setattr(query_planner_app, "PLANNER_MODE", "heuristic")
+    calls = []
+    monkeypatch.setattr(
+        openai.responses, "create", lambda *a, **kw: calls.append(kw) or mock_create()
+    )
+
+    res = client.post("/generate_queries", json={"ingredients": "vegan tofu, rice"})
+    assert res.status_code == 200, res.text
+    assert res.json()["planner"] == "heuristic"
+    assert res.json()["queries"][0] == "vegan tofu rice recipe"
+    assert res.headers["Server-Timing"].startswith("heuristic;dur=")
+    assert not calls
+
+    res = client.post(
+        "/generate_queries", json={"ingredients": "I need something for a picnic"}
+    )
+    assert res.json()["queries"] == ["mushroom risotto", "creamy mushroom pasta"]
+    assert res.json()["planner"] == "llm"
+    assert len(calls) == 1
+
+
+def test_canonical_key_ignores_order_case_plurals_and_punctuation():
+    assert canonical_key("Lemons, Garlic & CHICKEN!") == "chicken garlic lemon"
+    assert canonical_key("chicken garlic lemon") == "chicken garlic lemon"
+
+
+def test_cache_keeps_exclusions_apart_from_ingredients(monkeypatch):
+    monkeypatch.setattr(query_planner_app, "PLANNER_MODE", "heuristic")
+    assert canonical_key("chicken, garlic, no dairy") == "chicken garlic | no dairy"
+
+    first = client.post(
+        "/generate_queries", json={"ingredients": "chicken, garlic, no dairy"}
+    )
+    second = client.post(
+        "/generate_queries", json={"ingredients": "dairy, garlic, no chicken"}
+    )
+    assert second.headers["Server-Timing"].startswith("heuristic;")
+    requirements = second.json()["requirements"]
+    assert requirements["excluded_ingredients"] == ["chicken"]
+    assert first.json()["queries"] != second.json()["queries"]
+
+
+def test_empty_answers_are_not_cached(monkeypatch):
+    monkeypatch.setattr(
+        openai.responses,
+        "create",
+        lambda *a, **kw: {"output": [{"content": [{"text": " "}]}]},
+    )
+    res = client.post("/generate_queries", json={"ingredients": "mushroom cream"})
+    assert res.json()["queries"] == []
+
+    monkeypatch.setattr(openai.responses, "create", mock_create)
+    res = client.post("/generate_queries", json={"ingredients": "mushroom cream"})
+    assert res.json()["queries"] == ["mushroom risotto", "creamy mushroom pasta"]
+
+
+def test_repeated_inputs_are_answered_from_cache(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        openai.responses, "create", lambda *a, **kw: calls.append(kw) or mock_create()
+    )
+
+    first = client.post("/generate_queries", json={"ingredients": "Mushrooms, cream"})
+    second = client.post("/generate_queries", json={"ingredients": "cream mushroom"})
+    assert first.json() == second.json()
+    assert len(calls) == 1
+    assert second.headers["Server-Timing"].startswith("cache;desc=hit")
+    cache = client.get("/health").json()["cache"]
+    assert cache["memory_hits"] == 1
+    assert cache["misses"] == 1
+
+
+def test_query_cache_tiers_and_expiry(tmp_path):
+    now = [1000.0]
+    path = str(tmp_path / "queries.sqlite3")
+    cache = QueryCache(1, 60, path, clock=lambda: now[0])
+    cache.set("pasta", {"queries": ["pasta recipe"]})
+    cache.set("rice", {"queries": ["rice recipe"]})
+    # evicted from memory, still on disk
+    assert cache.get("Pasta") == {"queries": ["pasta recipe"]}
+    assert cache.disk_hits == 1
+
+    restarted = QueryCache(10, 60, path, clock=lambda: now[0])
+    assert restarted.get("rice") == {"queries": ["rice recipe"]}
+    now[0] += 61
+    assert restarted.get("rice") is None
+    assert restarted.get("pasta") is None
+    assert restarted.snapshot()["misses"] == 2
+
+
+def test_embeddings_of_reworded_inputs_are_similar():
+    similar = embed("chicken lemon garlic dinner") @ embed("lemony garlic chicken")
+    different = embed("chicken lemon garlic") @ embed("beef lemon garlic")
+    assert similar > 0.8 > different
+
+
+def test_similarity_cache_reuses_near_duplicates_and_evicts_lru():
+    now = [0.0]
+    cache = SimilarityCache(2, 0.8, ttl=60, clock=lambda: now[0])
+    cache.add("chicken lemon garlic dinner", {"queries": ["a"]})
+    cache.add("beef stew", {"queries": ["b"]})
+    value, similarity = cache.get("lemony garlic chicken")
+    assert value == {"queries": ["a"]} and similarity > 0.8
+    assert cache.get("chocolate cake") is None
+    # "beef stew" is the least recently used and makes room
+    cache.add("chocolate cake", {"queries": ["c"]})
+    assert cache.get("beef stews") is None
+    assert cache.get("lemon garlic chicken dinner") is not None
+    # negated inputs are never matched
+    cache.add("pasta without cheese", {"queries": ["d"]})
+    assert cache.get("cheese pasta") is None
+    now[0] += 61
+    assert cache.get("lemon garlic chicken dinner") is None
+    assert cache.snapshot()["hits"] == 2
+
+
+def test_similar_inputs_must_share_ingredients_and_numbers():
+    cache = SimilarityCache(10, 0.8, ttl=60)
+    for text in ["pasta under 30 minutes", "shallot, seitan", "brussels, turkey"]:
+        cache.add(text, {"queries": [text]})
+    assert cache.get("pasta under 60 minutes") is None
+    assert cache.get("shallot, pork, seitan") is None
+    assert cache.get("cod, brussels, turkey") is None
+    assert cache.get("turkey and brussels")[0] == {"queries": ["brussels, turkey"]}
+
+
+def test_similar_inputs_reuse_the_model_answer(monkeypatch):
+    monkeypatch.setattr(query_planner_app, "SIMILARITY_CACHE_SIZE", 100)
+    calls = []
+    monkeypatch.setattr(
+        openai.responses, "create", lambda *a, **kw: calls.append(kw) or mock_create()
+    )
+
+    client.post("/generate_queries", json={"ingredients": "lemon garlic chicken"})
+    res = client.post(
+        "/generate_queries", json={"ingredients": "garlic chicken with lemon"}
+    )
+    assert res.status_code == 200, res.text
+    assert res.json()["queries"] == ["mushroom risotto", "creamy mushroom pasta"]
+    assert res.headers["Server-Timing"].startswith('similar;desc="0.9')
+    assert len(calls) == 1
+    assert client.get("/health").json()["similarity_cache"]["hits"] == 1
+    # similarity hits are not copied into the exact cache
+    assert query_planner_app.query_cache.get("garlic chicken with lemon") is None
+
+
+def text_events(*deltas):
+    for delta in deltas:
+        yield SimpleNamespace(type="response.output_text.delta", delta=delta)
+    yield SimpleNamespace(type="response.completed")
+
+
+def test_generate_queries_stream_emits_each_line(monkeypatch):
+    calls = []
+
+    def streaming_create(*args, **kwargs):
+        calls.append(kwargs)
+        return text_events(
+            "mushroom ris",
+            "otto\ncreamy mush",
+            "room pasta\nsoup\nREQUIREMENTS: ",
+            '{"diets": ["vegetarian"], "max_cook_mins": 30}',
+        )
+
+    monkeypatch.setattr(openai.responses, "create", streaming_create)
+
+    with client.stream(
+        "POST", "/generate_queries/stream", json={"ingredients": "mushroom cream"}
+    ) as res:
+        assert res.status_code == 200
+        assert res.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in res.iter_lines() if line]
+    assert lines[:3] == [
+        {"query": "mushroom risotto"},
+        {"query": "creamy mushroom pasta"},
+        {"query": "soup"},
+    ]
+    assert lines[3]["requirements"]["diets"] == ["vegetarian"]
+    assert lines[3]["requirements"]["max_cook_mins"] == 30
+    assert calls[0]["stream"] is True
+
+    # the streamed answer was cached for both endpoints
+    res = client.post("/generate_queries", json={"ingredients": "Mushrooms, cream"})
+    assert res.json()["queries"] == [
+        "mushroom risotto",
+        "creamy mushroom pasta",
+        "soup",
+    ]
+    assert len(calls) == 1
+
+
+def test_generate_queries_stream_reports_failures_midway(monkeypatch):
+    def failing_create(*args, **kwargs):
+        yield SimpleNamespace(type="response.output_text.delta", delta="pasta\n")
+        yield SimpleNamespace(type="error", message="overloaded")
+
+    monkeypatch.setattr(openai.responses, "create", failing_create)
+
+    res = client.post("/generate_queries/stream", json={"ingredients": "pasta"})
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert lines[0] == {"query": "pasta"}
+    assert lines[1]["error"]["status_code"] == 502
+
+    def timing_out_create(*args, **kwargs):
+        yield SimpleNamespace(type="response.output_text.delta", delta="pasta\n")
+        raise openai.APITimeoutError(request=httpx.Request("POST", "https://openai"))
+
+    monkeypatch.setattr(openai.responses, "create", timing_out_create)
+    res = client.post(
+        "/generate_queries/stream",
+        json={"ingredients": "pasta"},
+        headers={"X-Request-Timeout": "5"},
+    )
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert lines[1]["error"]["status_code"] == 504
+
+
+def test_requirements_come_from_the_same_model_call(monkeypatch):
+    answer = (
+        "vegan lentil curry\nquick lentil stew\n"
+        'REQUIREMENTS: {"required_ingredients": ["lentils"], '
+        '"excluded_ingredients": ["coconut"], "diets": ["vegan"], '
+        '"max_cook_mins": 45}'
+    )
+    monkeypatch.setattr(
+        openai.responses,
+        "create",
+        lambda *a, **kw: {"output": [{"content": [{"text": answer}]}]},
+    )
+
+    res = client.post(
+        "/generate_queries", json={"ingredients": "I'd like a vegan lentil dish"}
+    )
+    assert res.json()["queries"] == ["vegan lentil curry", "quick lentil stew"]
+    assert res.json()["requirements"] == {
+        "required_ingredients": ["lentils"],
+        "excluded_ingredients": ["coconut"],
+        "diets": ["vegan"],
+        "max_cook_mins": 45,
+    }
+
+
+def test_local_parser_supplies_requirements():
+    assert parse_requirements("chicken, rice, no mushrooms, under 30 minutes") == {
+        "required_ingredients": ["chicken", "rice"],
+        "excluded_ingredients": ["mushrooms"],
+        "diets": [],
+        "max_cook_mins": 30,
+    }
+    # free-form input still has its stated constraints read
+    requirements = parse_requirements("something vegetarian for a crowd, no nuts")
+    assert requirements["required_ingredients"] == []
+    assert requirements["excluded_ingredients"] == ["nuts"]
+    assert requirements["diets"] == ["vegetarian"]
+
+
+def test_heuristic_answers_carry_requirements(monkeypatch):
+    monkeypatch.setattr(query_planner_app, "PLANNER_MODE", "heuristic")
+
+    res = client.post(
+        "/generate_queries", json={"ingredients": "gluten-free chicken, no garlic"}
+    )
+    assert res.json()["planner"] == "heuristic"
+    assert res.json()["requirements"] == {
+        "required_ingredients": ["chicken"],
+        "excluded_ingredients": ["garlic"],
+        "diets": ["gluten-free"],
+        "max_cook_mins": None,
+    }
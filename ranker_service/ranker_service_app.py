@@ -1,15 +1,20 @@
 import json
 import os
-from typing import Dict, List
+import time
+from typing import Any, Dict, List, Optional
 
 import openai
-from fastapi import FastAPI, HTTPException
+from codec import CodecRoute, NegotiatedResponse
+from fastapi import FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 if not openai.api_key:
     raise RuntimeError("missing open ai key")
 
+# OpenAI timeout when the caller sends no X-Request-Timeout budget
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+
 
 class Recipe(BaseModel):
     id: str
@@ -22,7 +27,7 @@ class Recipe(BaseModel):
 
 
 class RankRequest(BaseModel):
-    requirements: Dict[str, str]
+    requirements: Dict[str, Any]
     recipes: List[Recipe]
     top_k: int = 3
 
@@ -39,11 +44,38 @@ rank_schema = {
     "additionalProperties": False,
 }
 
-app = FastAPI(title="Recipe Ranker Service")
+app = FastAPI(title="Recipe Ranker Service", default_response_class=NegotiatedResponse)
+# msgpack and compressed bodies besides plain JSON
+app.router.route_class = CodecRoute
+
+
+def time_budget(x_request_timeout: Optional[str], default: float) -> float:
+    """Seconds left of the caller's X-Request-Timeout budget, capped at default."""
+    if x_request_timeout is None:
+        return default
+    try:
+        budget = float(x_request_timeout)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail=f"invalid X-Request-Timeout {x_request_timeout}"
+        )
+    if budget <= 0:
+        raise HTTPException(status_code=504, detail="request deadline exceeded")
+    return min(budget, default)
+
+
+def cut_by_budget(err: Exception, timeout: float, default: float) -> bool:
+    """Whether ``err`` is the timeout of a call that the caller's budget gave less
+    than its ``default`` timeout, answered with 504 instead of 502."""
+    return isinstance(err, openai.APITimeoutError) and timeout < default
 
 
 @app.post("/rank_recipes", response_model=RankResponse)
-def rank_recipes(req: RankRequest):
+def rank_recipes(
+    req: RankRequest,
+    http_response: Response,
+    x_request_timeout: Optional[str] = Header(default=None),
+):
     prompt_lines = [
         "You are a recipe ranking assistant.",
         f"Requirements: {json.dumps(req.requirements)}",
@@ -58,6 +90,8 @@ def rank_recipes(req: RankRequest):
         'Return a JSON object with a single key "ranked_ids"\ containing the recipe IDs from best to worst'
     )
     prompt = "\n".join(prompt_lines)
+    timeout = time_budget(x_request_timeout, OPENAI_TIMEOUT)
+    started = time.perf_counter()
     try:
         response = openai.responses.create(
             model="gpt-4.1-mini",
@@ -71,9 +105,14 @@ def rank_recipes(req: RankRequest):
                 }
             },
             stream=False,
+            timeout=timeout,
         )
     except Exception as e:
+        if cut_by_budget(e, timeout, OPENAI_TIMEOUT):
+            raise HTTPException(status_code=504, detail=f"LLM timed out: {e}")
         raise HTTPException(status_code=502, detail=f"LLM error: {e}")
+    openai_ms = (time.perf_counter() - started) * 1000
+    http_response.headers["Server-Timing"] = f"openai;dur={openai_ms:.1f}"
 
     json_text = getattr(response, "output_text", None)
     if not json_text:
@@ -0,0 +1,181 @@
+import gzip
+import json
+import os
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import msgpack
+import zstandard
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ENCODINGS = ("zstd", "gzip")
+
+# bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+
+def media_type_of(content_type: Optional[str]) -> str:
+    return (content_type or JSON).split(";")[0].strip().lower()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=5)
+    return data
+
+
+def decompress(data: bytes, encoding: Optional[str]) -> bytes:
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "identity":
+        return data
+    raise ValueError(f"unsupported Content-Encoding {encoding}")
+
+
+def dumps(value: Any, media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        return msgpack.packb(value, use_bin_type=True)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def loads(data: bytes, media_type: str) -> Any:
+    if media_type == MSGPACK:
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def encode_body(
+    value: Any, media_type: str = JSON, encoding: Optional[str] = None
+) -> Tuple[bytes, Dict[str, str]]:
+    """Body and headers of ``value`` sent as ``media_type``, compressed."""
+    data = dumps(value, media_type)
+    headers = {"Content-Type": media_type}
+    if encoding in ENCODINGS and len(data) >= COMPRESS_MIN_BYTES:
+        data = compress(data, encoding)
+        headers["Content-Encoding"] = encoding
+    return data, headers
+
+
+def decode_body(
+    data: bytes, content_type: Optional[str], content_encoding: Optional[str] = None
+) -> Any:
+    return loads(decompress(data, content_encoding), media_type_of(content_type))
+
+
+def preferred(header: Optional[str], offered: Tuple[str, ...]) -> Optional[str]:
+    """The first of ``offered`` the Accept(-Encoding) header allows, by q."""
+    choices = []
+    for position, part in enumerate((header or "").split(",")):
+        name, *params = [piece.strip().lower() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if name in offered and quality > 0:
+            choices.append((-quality, position, name))
+    return min(choices)[2] if choices else None
+
+
+# Accept and Accept-Encoding of the request being answered
+_negotiated: ContextVar[Tuple[Optional[str], Optional[str]]] = ContextVar(
+    "negotiated", default=(None, None)
+)
+
+
+class NegotiatedResponse(Response):
+    """Response in the media type and encoding the client asked for.
+
+    JSON unless the client accepts msgpack, compressed with zstd or gzip when
+    the client accepts it and the body is large enough.
+    """
+
+    media_type = JSON
+
+    def __init__(
+        self,
+        content: Any = None,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        background=None,
+    ):
+        accept, accept_encoding = _negotiated.get()
+        self.media_type = preferred(accept, (MSGPACK,)) or JSON
+        self.encoding = preferred(accept_encoding, ENCODINGS)
+        super().__init__(content, status_code, headers, self.media_type, background)
+        if self.encoding and len(self.body) >= COMPRESS_MIN_BYTES:
+            self.body = compress(self.body, self.encoding)
+            self.headers["content-encoding"] = self.encoding
+            self.headers["content-length"] = str(len(self.body))
+        self.headers["vary"] = "Accept, Accept-Encoding"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content, self.media_type)
+
+
+class CodecRequest(Request):
+    """Request whose body may be msgpack and zstd or gzip compressed."""
+
+    def __init__(self, scope, receive, media_type: str):
+        super().__init__(scope, receive)
+        self.body_media_type = media_type
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_decoded_body"):
+            try:
+                self._decoded_body = decompress(
+                    await super().body(), self.headers.get("content-encoding")
+                )
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"bad body encoding: {e}")
+        return self._decoded_body
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            try:
+                self._json = loads(body, self.body_media_type)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"bad body: {e}")
+        return self._json
+
+
+class CodecRoute(APIRoute):
+    """Route accepting msgpack and compressed bodies, answering as negotiated.
+
+    FastAPI only hands JSON content types to ``Request.json``, so a msgpack
+    request is shown to it as JSON and decoded by ``CodecRequest.json``.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def codec_handler(request: Request) -> Response:
+            media_type = media_type_of(request.headers.get("content-type"))
+            scope = request.scope
+            if media_type == MSGPACK:
+                scope = dict(scope)
+                scope["headers"] = [
+                    (name, JSON.encode() if name == b"content-type" else value)
+                    for name, value in scope["headers"]
+                ]
+            token = _negotiated.set(
+                (request.headers.get("accept"), request.headers.get("accept-encoding"))
+            )
+            try:
+                return await handler(CodecRequest(scope, request.receive, media_type))
+            finally:
+                _negotiated.reset(token)
+
+        return codec_handler
@@ -1,14 +1,19 @@
 import os
-from typing import List
+import time
+from typing import List, Optional
 
 import openai
-from fastapi import FastAPI, HTTPException
+from codec import CodecRoute, NegotiatedResponse
+from fastapi import FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 if not openai.api_key:
     raise RuntimeError("missing open ai key")
 
+# OpenAI timeout when the caller sends no X-Request-Timeout budget
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+
 
 class SearchRequest(BaseModel):
     queries: List[str]
@@ -24,15 +29,51 @@ class SearchResponse(BaseModel):
     results: List[SearchResult]
 
 
-app = FastAPI(title="Search Service")
+app = FastAPI(title="Search Service", default_response_class=NegotiatedResponse)
+# msgpack and compressed bodies besides plain JSON
+app.router.route_class = CodecRoute
+
+
+def time_budget(x_request_timeout: Optional[str], default: float) -> float:
+    """Seconds left of the caller's X-Request-Timeout budget, capped at default."""
+    if x_request_timeout is None:
+        return default
+    try:
+        budget = float(x_request_timeout)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail=f"invalid X-Request-Timeout {x_request_timeout}"
+        )
+    if budget <= 0:
+        raise HTTPException(status_code=504, detail="request deadline exceeded")
+    return min(budget, default)
+
+
+def cut_by_budget(err: Exception, timeout: float, default: float) -> bool:
+    """Whether ``err`` is the timeout of a call that the caller's budget gave less
+    than its ``default`` timeout, answered with 504 instead of 502."""
+    return isinstance(err, openai.APITimeoutError) and timeout < default
 
 
 @app.post("/search_urls", response_model=SearchResponse)
-def search_urls(req: SearchRequest):
+def search_urls(
+    req: SearchRequest,
+    http_response: Response,
+    x_request_timeout: Optional[str] = Header(default=None),
+):
     seen_recipes = set()
     results: List[SearchResult] = []
+    budget = time_budget(x_request_timeout, OPENAI_TIMEOUT)
+    deadline = time.monotonic() + budget
+    openai_ms = 0.0
+    openai_calls = 0
 
     for q in req.queries:
+        # return what was found so far once the caller's budget is used up
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        started = time.perf_counter()
         try:
             response = openai.responses.create(
                 model="gpt-4.1-mini",
@@ -46,9 +87,16 @@ def search_urls(req: SearchRequest):
                 tool_choice="required",
                 include=["web_search_call.results"],
                 temperature=0,
+                timeout=remaining,
             )
         except Exception as e:
+            if cut_by_budget(e, budget, OPENAI_TIMEOUT):
+                raise HTTPException(
+                    status_code=504, detail=f"Search-plugin timed out: {e}"
+                )
             raise HTTPException(status_code=502, detail=f"Search-plugin error: {e}")
+        openai_ms += (time.perf_counter() - started) * 1000
+        openai_calls += 1
 
         data = response.to_dict() if hasattr(response, "to_dict") else dict(response)
         output = data.get("output", [])
@@ -83,4 +131,7 @@ def search_urls(req: SearchRequest):
         if len(results) >= req.num_results:
             break
 
+    http_response.headers["Server-Timing"] = (
+        f'openai;desc="{openai_calls} calls";dur={openai_ms:.1f}'
+    )
     return SearchResponse(results=results[: req.num_results])